@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import logging
+import time
+
+from src.config import Config
+from src.ffmpeg import FFMPEGController
+from src.resources import read_proc
+
+
+def sample_processes(controller):
+    cpu = 0.0
+    rss = 0
+    for instance in controller.instances.values():
+        if instance.process is None:
+            continue
+        usage = read_proc(instance.process.pid)
+        if usage:
+            cpu += usage[0]
+            rss += usage[1]
+    return cpu, rss
+
+
+def wait_first_frames(controller, timeout):
+    deadline = time.monotonic() + timeout
+    for instance in controller.instances.values():
+        if instance.watcher is None or not instance.watcher.wait_first_frame(max(0.0, deadline - time.monotonic())):
+            return False
+    return True
+
+
+def run_layout(layout, devices, profiles, duration, base_port, timeout):
+    """
+    Run all testsrc devices in one process layout and measure it.
+
+    Args:
+        layout (str): per_device or single.
+        devices (int): Number of testsrc inputs.
+        profiles (list): Two profiles to run at and switch between.
+        duration (float): Seconds to measure CPU and RSS for.
+        base_port (int): First UDP port of the outputs.
+        timeout (float): Seconds to wait for the first frame of every output.
+
+    Returns:
+        dict: Process count, CPU share, peak RSS and profile switch times.
+    """
+    input_devices = ",".join(f"testsrc{i}:udp://127.0.0.1:{base_port + i}" for i in range(devices))
+    config = Config(
+        "main.conf",
+        overrides={
+            ("Profile", "input_devices"): input_devices,
+            ("ffmpeg", "process_layout"): layout,
+            ("ffmpeg", "encoder_mode"): "restart",
+            ("ffmpeg", "transition_mode"): "restart",
+            ("ffmpeg", "restart_mode"): "parallel",
+        },
+    )
+    controller = FFMPEGController(config)
+    try:
+        controller.restart_if_needed(profiles[0])
+        if not wait_first_frames(controller, timeout):
+            return {"layout": layout, "error": "encoders did not start"}
+
+        cpu_start, _ = sample_processes(controller)
+        started_at = time.monotonic()
+        peak_rss = 0
+        while time.monotonic() - started_at < duration:
+            time.sleep(0.25)
+            peak_rss = max(peak_rss, sample_processes(controller)[1])
+        cpu_end, _ = sample_processes(controller)
+        elapsed = time.monotonic() - started_at
+
+        switch_started = time.monotonic()
+        controller.restart_if_needed(profiles[1])
+        restart_done = time.monotonic() - switch_started
+        live = wait_first_frames(controller, timeout)
+        switch_to_live = time.monotonic() - switch_started
+
+        return {
+            "layout": layout,
+            "devices": devices,
+            "processes": len(controller.instances),
+            "cpu_percent": round(100 * (cpu_end - cpu_start) / elapsed, 1),
+            "peak_rss_mb": round(peak_rss / 2**20, 1),
+            "switch_restart_seconds": round(restart_done, 3),
+            "switch_to_first_frame_seconds": round(switch_to_live, 3) if live else None,
+        }
+    finally:
+        controller.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare one-process-per-device and single-process ffmpeg layouts on testsrc inputs"
+    )
+    parser.add_argument("--devices", type=int, default=5, help="Number of testsrc inputs")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds to measure each layout")
+    parser.add_argument("--base-port", type=int, default=23000, help="First UDP output port")
+    parser.add_argument("--timeout", type=float, default=15, help="Seconds to wait for encoders to start")
+    parser.add_argument("--json", action="store_true", help="Print one JSON object per layout")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    profiles = [
+        {"resolution": "1280x720", "bitrate": "2000k", "fps": "30"},
+        {"resolution": "640x360", "bitrate": "800k", "fps": "24"},
+    ]
+    for layout in ("per_device", "single"):
+        result = run_layout(layout, args.devices, profiles, args.duration, args.base_port, args.timeout)
+        if args.json:
+            print(json.dumps(result))
+            continue
+        print(f"\nLayout: {layout}")
+        for key, value in result.items():
+            if key != "layout":
+                print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
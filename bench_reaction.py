@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+
+from rci_emulator import RCIEmulator
+from replay import parse_override
+from src.config import Config
+from src.ffmpeg import FFMPEGController
+from src.rciclient import KeeneticRCIClient
+from src.signalpolicy import SignalPolicyEngine
+from src.supervisor import Supervisor
+
+
+def build_config(args, emulator):
+    input_devices = ",".join(f"testsrc{i}:udp://127.0.0.1:{args.base_port + i}" for i in range(args.devices))
+    overrides = {
+        ("Router", "ip_addr"): emulator.address,
+        ("Router", "login"): emulator.login,
+        ("Router", "password"): emulator.password,
+        ("settings", "timeout"): args.poll_interval,
+        ("settings", "connection_check"): "false",
+        ("Profile", "input_devices"): input_devices,
+        # The expected profile after a drop must follow from SNR alone
+        ("policy", "allocation"): "uniform",
+        ("policy", "profile_input"): "snr",
+        ("policy", "min_dwell_up"): 0,
+        # Encoder restarts for CPU reasons would distort the timing
+        ("resources", "tuning"): "false",
+        ("telemetry", "capacity"): 0,
+        ("metrics", "enabled"): "false",
+    }
+    overrides.update(dict(args.overrides))
+    return Config(args.config, overrides=overrides)
+
+
+def live_at(instance, profile, since):
+    """
+    Monotonic time the instance started producing frames on `profile`, or None.
+    For a process started before `since` the profile was applied live, so the
+    time it is observed is the best estimate available.
+    """
+    if instance.current_profile != profile or instance.watcher is None or not instance.watcher.first_frame.is_set():
+        return None
+    if instance.watcher.first_frame_at < since:
+        return time.monotonic()
+    return instance.watcher.first_frame_at
+
+
+async def wait_profile(controller, profiles, since, timeout):
+    """Wait until every encoder is live on its profile from `profiles`; returns the time the last one got there"""
+    deadline = time.monotonic() + timeout
+    reached = {}
+    while time.monotonic() < deadline:
+        for name, instance in controller.instances.items():
+            if name not in reached:
+                at = live_at(instance, instance.select_profile(profiles), since)
+                if at is not None:
+                    reached[name] = at
+        if len(reached) == len(controller.instances):
+            return max(reached.values())
+        await asyncio.sleep(0.005)
+    return None
+
+
+async def measure(args):
+    emulator = RCIEmulator(
+        latency=args.router_latency, jitter=args.router_jitter, error_rate=args.error_rate, seed=args.seed
+    )
+    emulator.set_signal(args.good_rssi, args.noise, args.good_rate)
+    emulator.start()
+    config = build_config(args, emulator)
+
+    client = KeeneticRCIClient(config)
+    if not await asyncio.to_thread(client.authenticate):
+        emulator.stop()
+        return {"error": "authentication against the emulator failed"}
+    ffmpeg = FFMPEGController(config)
+    policy = SignalPolicyEngine(client, ffmpeg, config)
+    supervisor = Supervisor(config, client, ffmpeg, policy)
+    good_profile = policy.uniform_profiles(policy._index_for_snr(args.good_rssi - args.noise))
+    bad_profile = policy.uniform_profiles(policy._index_for_snr(args.bad_rssi - args.noise))
+
+    run_task = asyncio.create_task(supervisor.run())
+    latencies = []
+    detections = []
+    timeouts = 0
+    idle_rate = None
+    started_at = time.monotonic()
+    try:
+        if await wait_profile(ffmpeg, good_profile, time.monotonic(), args.timeout) is None:
+            return {"error": "encoders did not start on the initial profile"}
+        if args.idle > 0:
+            # Router load while the signal is steady
+            requests = emulator.requests
+            await asyncio.sleep(args.idle)
+            idle_rate = (emulator.requests - requests) / args.idle
+        for _ in range(args.drops):
+            switches = policy.switch_count
+            dropped_at = emulator.set_signal(args.bad_rssi, args.noise, args.bad_rate)
+            detected_at = None
+            live = None
+            deadline = dropped_at + args.timeout
+            while time.monotonic() < deadline:
+                if detected_at is None and policy.switch_count != switches:
+                    detected_at = time.monotonic()
+                live = await wait_profile(ffmpeg, bad_profile, dropped_at, 0.005)
+                if live is not None:
+                    break
+            if live is None:
+                timeouts += 1
+            else:
+                latencies.append(live - dropped_at)
+                if detected_at is not None:
+                    detections.append(detected_at - dropped_at)
+
+            # Recover before the next drop; not measured
+            recovered_at = emulator.set_signal(args.good_rssi, args.noise, args.good_rate)
+            if await wait_profile(ffmpeg, good_profile, recovered_at, args.timeout) is None:
+                timeouts += 1
+                break
+            await asyncio.sleep(args.settle)
+    finally:
+        elapsed = time.monotonic() - started_at
+        supervisor.stop()
+        await run_task
+        emulator.stop()
+
+    latencies.sort()
+    return {
+        "devices": args.devices,
+        "poll_interval": args.poll_interval,
+        "poll_mode": config.poll_mode,
+        "filter": config.policy_filter,
+        "transition_mode": config.ffmpeg_transition_mode,
+        "encoder_mode": config.ffmpeg_encoder_mode,
+        "drops": len(latencies),
+        "timeouts": timeouts,
+        "detect_mean": round(sum(detections) / len(detections), 3) if detections else None,
+        "live_mean": round(sum(latencies) / len(latencies), 3) if latencies else None,
+        "live_p95": round(latencies[int(0.95 * (len(latencies) - 1))], 3) if latencies else None,
+        "live_max": round(latencies[-1], 3) if latencies else None,
+        "router_requests": emulator.requests,
+        "router_request_rate": round(emulator.requests / elapsed, 2),
+        "idle_request_rate": round(idle_rate, 2) if idle_rate is not None else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time from a signal drop on an emulated router to the new profile being live on every output"
+    )
+    parser.add_argument("--config", default="main.conf", help="Config the daemon is built from")
+    parser.add_argument(
+        "--set",
+        dest="overrides",
+        action="append",
+        type=parse_override,
+        default=[],
+        help="Override a config option, e.g. --set ffmpeg.transition_mode=restart (repeatable)",
+    )
+    parser.add_argument("--devices", type=int, default=5, help="Number of testsrc encoders")
+    parser.add_argument("--drops", type=int, default=5, help="Signal drops to measure")
+    parser.add_argument(
+        "--poll-interval", type=float, default=1.0, help="Signal poll interval with polling.mode = fixed, seconds"
+    )
+    parser.add_argument("--good-rssi", type=int, default=-50)
+    parser.add_argument("--bad-rssi", type=int, default=-88)
+    parser.add_argument("--noise", type=int, default=-95)
+    parser.add_argument("--good-rate", type=float, default=144.0, help="PHY rate before a drop, Mbit/s")
+    parser.add_argument("--bad-rate", type=float, default=13.0, help="PHY rate after a drop, Mbit/s")
+    parser.add_argument("--router-latency", type=float, default=0.0, help="Seconds added to every RCI response")
+    parser.add_argument("--router-jitter", type=float, default=0.0, help="Random extra RCI latency, seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of RCI requests failing with HTTP 500")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--settle", type=float, default=1.0, help="Seconds to wait after recovering")
+    parser.add_argument(
+        "--idle", type=float, default=0.0, help="Seconds of steady signal to measure the router request rate over"
+    )
+    parser.add_argument("--timeout", type=float, default=30, help="Seconds to wait for a switch")
+    parser.add_argument("--base-port", type=int, default=24000, help="First UDP output port")
+    parser.add_argument(
+        "--max-p95", type=float, help="Exit with status 1 if the p95 drop-to-live latency exceeds this many seconds"
+    )
+    parser.add_argument("--json", action="store_true", help="Print the result as one JSON object")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    result = asyncio.run(measure(args))
+    if args.json:
+        print(json.dumps(result))
+    else:
+        for key, value in result.items():
+            print(f"{key}: {value}")
+
+    if "error" in result or result["timeouts"]:
+        sys.exit(1)
+    if args.max_p95 is not None and result["live_p95"] is not None and result["live_p95"] > args.max_p95:
+        print(f"p95 drop-to-live latency {result['live_p95']} s exceeds {args.max_p95} s", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import logging
+import math
+import socket
+import sys
+import threading
+import time
+
+from replay import parse_override
+from src.config import Config
+from src.udp_relay import DEFAULT_PKT_SIZE, TS_PACKET_SIZE, TransportStreamScanner, UDPRelay, parse_udp_url
+
+VIDEO_PID = 0x100
+PMT_PID = 0x1000
+
+
+def ts_packet(pid, unit_start=False, random_access=False):
+    """One 188-byte TS packet with a dummy payload, optionally flagged as a random access point"""
+    header = bytes([0x47, (0x40 if unit_start else 0) | (pid >> 8), pid & 0xFF])
+    if random_access:
+        # adaptation_field_control = 3, adaptation field of one flags byte with random_access_indicator
+        return header + bytes([0x30, 1, 0x40]) + b"\xff" * (TS_PACKET_SIZE - 6)
+    return header + b"\x10" + b"\xff" * (TS_PACKET_SIZE - 4)
+
+
+def pat_packet():
+    section = bytes([0x00, 0xB0, 0x0D, 0x00, 0x01, 0xC1, 0x00, 0x00, 0x00, 0x01, 0xE0 | (PMT_PID >> 8), PMT_PID & 0xFF])
+    payload = b"\x00" + section + b"\x00" * 4
+    return bytes([0x47, 0x40, 0x00, 0x10]) + payload + b"\xff" * (TS_PACKET_SIZE - 4 - len(payload))
+
+
+class SyntheticCamera(threading.Thread):
+    """
+    Sends an mpegts-like stream the way ffmpeg does: every frame is written at once
+    as datagrams of 7 TS packets, so a keyframe leaves as a burst.
+    """
+
+    def __init__(self, target, bitrate_kbps, fps, gop, keyframe_ratio, duration, phase=0):
+        super().__init__(daemon=True)
+        self.target = target
+        self.fps = fps
+        self.gop = gop
+        self.phase = phase
+        self.duration = duration
+        mean_frame = bitrate_kbps * 1000 / 8 / fps
+        self.delta_bytes = gop * mean_frame / (keyframe_ratio + gop - 1)
+        self.key_bytes = keyframe_ratio * self.delta_bytes
+        self.sent_bytes = 0
+        self.keyframes = 0
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._pending = []
+
+    def _queue(self, packet):
+        self._pending.append(packet)
+        if len(self._pending) == DEFAULT_PKT_SIZE // TS_PACKET_SIZE:
+            self._flush()
+
+    def _flush(self):
+        if self._pending:
+            datagram = b"".join(self._pending)
+            self._pending = []
+            self.socket.sendto(datagram, self.target)
+            self.sent_bytes += len(datagram)
+
+    def run(self):
+        started_at = time.monotonic()
+        frame = 0
+        while time.monotonic() - started_at < self.duration:
+            keyframe = (frame + self.phase) % self.gop == 0
+            if keyframe:
+                self._queue(pat_packet())
+                self._queue(ts_packet(PMT_PID, unit_start=True))
+                self.keyframes += 1
+            size = self.key_bytes if keyframe else self.delta_bytes
+            for index in range(max(1, math.ceil(size / (TS_PACKET_SIZE - 4)))):
+                self._queue(ts_packet(VIDEO_PID, unit_start=index == 0, random_access=keyframe and index == 0))
+            self._flush()
+            frame += 1
+            delay = started_at + frame / self.fps - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        self.socket.close()
+
+
+class Receiver(threading.Thread):
+    """Counts what arrives at an output and the peak rate over `bin_ms` windows"""
+
+    def __init__(self, bin_ms):
+        super().__init__(daemon=True)
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        self.socket.bind(("127.0.0.1", 0))
+        self.socket.settimeout(0.2)
+        self.bin = bin_ms / 1000
+        self.received_bytes = 0
+        self.bins = {}
+        self.scanner = TransportStreamScanner()
+        self.running = True
+
+    @property
+    def url(self):
+        host, port = self.socket.getsockname()
+        return f"udp://{host}:{port}?pkt_size={DEFAULT_PKT_SIZE}"
+
+    def run(self):
+        buffer = bytearray(65536)
+        while self.running:
+            try:
+                length = self.socket.recv_into(buffer)
+            except socket.timeout:
+                continue
+            self.received_bytes += length
+            slot = int(time.monotonic() / self.bin)
+            self.bins[slot] = self.bins.get(slot, 0) + length
+            self.scanner.scan(buffer, length)
+
+    def peak_mbps(self):
+        return max(self.bins.values(), default=0) * 8 / self.bin / 1_000_000
+
+    def stop(self):
+        self.running = False
+        self.join()
+        self.socket.close()
+
+
+def run(args):
+    receivers = [Receiver(args.bin_ms) for _ in range(args.devices)]
+    priorities = [int(value) for value in args.priorities.split(",")] if args.priorities else list(range(args.devices))
+    overrides = {
+        ("Profile", "input_devices"): ",".join(f"cam{i}:{receiver.url}" for i, receiver in enumerate(receivers)),
+        ("relay", "rate_kbps"): args.rate,
+    }
+    for i in range(args.devices):
+        overrides[(f"device:cam{i}", "priority")] = priorities[i % len(priorities)]
+    overrides.update(dict(args.overrides))
+    config = Config(args.config, overrides=overrides)
+
+    relay = None
+    targets = {}
+    if args.direct:
+        for name, device_config in config.device_configs.items():
+            targets[name] = parse_udp_url(device_config.output)[:2]
+    else:
+        relay = UDPRelay(config)
+        for name, device_config in config.device_configs.items():
+            targets[name] = parse_udp_url(relay.route(device_config).output)[:2]
+        relay.start()
+
+    for receiver in receivers:
+        receiver.start()
+    cameras = {
+        name: SyntheticCamera(
+            target,
+            args.bitrate,
+            args.fps,
+            args.gop,
+            args.keyframe_ratio,
+            args.duration,
+            phase=i * args.gop // args.devices if args.stagger else 0,
+        )
+        for i, (name, target) in enumerate(targets.items())
+    }
+    for camera in cameras.values():
+        camera.start()
+    for camera in cameras.values():
+        camera.join()
+    # Let the relay drain its queue
+    time.sleep(args.max_delay_drain)
+    for receiver in receivers:
+        receiver.stop()
+    stats = relay.snapshot() if relay is not None else {}
+    if relay is not None:
+        relay.stop()
+
+    streams = {}
+    for (name, camera), receiver in zip(cameras.items(), receivers):
+        relayed = stats.get(name, {})
+        streams[name] = {
+            "priority": config.device_configs[name].priority,
+            "sent_kbps": round(camera.sent_bytes * 8 / 1000 / args.duration),
+            "delivered_kbps": round(receiver.received_bytes * 8 / 1000 / args.duration),
+            "delivered_ratio": round(receiver.received_bytes / camera.sent_bytes, 3) if camera.sent_bytes else None,
+            "keyframes_sent": camera.keyframes,
+            "keyframes_delivered": receiver.scanner.keyframes,
+            "peak_mbps": round(receiver.peak_mbps(), 1),
+            "dropped_packets": relayed.get("dropped_packets"),
+            "dropped_keyframe_packets": relayed.get("dropped_protected"),
+        }
+    return {
+        "mode": "direct" if args.direct else "relay",
+        "rate_kbps": None if args.direct else config.relay_rate_kbps,
+        "bin_ms": args.bin_ms,
+        "streams": streams,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Push synthetic bursty mpegts through the UDP relay on loopback and measure pacing and shedding"
+    )
+    parser.add_argument("--config", default="main.conf", help="Config the relay settings are taken from")
+    parser.add_argument(
+        "--set",
+        dest="overrides",
+        action="append",
+        type=parse_override,
+        default=[],
+        help="Override a config option, e.g. --set relay.burst_ms=10 (repeatable)",
+    )
+    parser.add_argument("--devices", type=int, default=5, help="Number of synthetic cameras")
+    parser.add_argument("--bitrate", type=float, default=4000, help="Mean bitrate of every camera, kbit/s")
+    parser.add_argument("--fps", type=float, default=25)
+    parser.add_argument("--gop", type=int, default=50, help="Frames between keyframes")
+    parser.add_argument("--keyframe-ratio", type=float, default=10, help="Keyframe size relative to a delta frame")
+    parser.add_argument(
+        "--stagger", action="store_true", help="Spread keyframes of the cameras over the GOP instead of aligning them"
+    )
+    parser.add_argument("--rate", default="0", help="Relay rate limit, kbit/s (0 = unpaced)")
+    parser.add_argument(
+        "--priorities", help="Comma-separated priorities of the cameras, lower is more important (default 0,1,2,...)"
+    )
+    parser.add_argument("--duration", type=float, default=10, help="Seconds to send for")
+    parser.add_argument("--bin-ms", type=float, default=10, help="Window for the peak output rate, ms")
+    parser.add_argument(
+        "--max-delay-drain", type=float, default=0.5, help="Seconds to wait for the relay queue after sending"
+    )
+    parser.add_argument("--direct", action="store_true", help="Send straight to the outputs, without the relay")
+    parser.add_argument("--json", action="store_true", help="Print the result as one JSON object")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    result = run(args)
+    if args.json:
+        print(json.dumps(result))
+        return
+    print(f"mode: {result['mode']}, rate limit: {result['rate_kbps']} kbit/s")
+    for name, stream in result["streams"].items():
+        print(f"{name}: " + ", ".join(f"{key}={value}" for key, value in stream.items()))
+    if any(stream["delivered_ratio"] is None for stream in result["streams"].values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,20 @@
 #!/usr/bin/env python3
 import subprocess
-import re
 import argparse
 import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-def analyze_camera_stream(camera_url):
+def analyze_camera_stream(camera_url, timeout=10):
     """
     Analyze a camera stream using ffprobe to get fps, bitrate, and resolution.
     
     Args:
         camera_url (str): URL of the camera stream (e.g., rtsp://192.168.1.100:554/stream)
+        timeout (float): Seconds to wait for ffprobe
         
     Returns:
         dict: Dictionary containing fps, bitrate, and resolution information
@@ -25,7 +30,7 @@ def analyze_camera_stream(camera_url):
             camera_url
         ]
         
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=10)
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
         
         if result.returncode != 0:
             raise Exception(f"ffprobe failed: {result.stderr}")
@@ -55,14 +60,17 @@ def analyze_camera_stream(camera_url):
         
         # Extract bitrate (comes in bits/s)
         bitrate = "Unknown"
+        bitrate_kbps = None
         if 'bit_rate' in stream_info:
             bitrate_bps = int(stream_info['bit_rate'])
             bitrate = f"{bitrate_bps / 1000:.2f} kbps"
+            bitrate_kbps = round(bitrate_bps / 1000, 2)
         
         return {
             "resolution": resolution,
             "fps": fps,
-            "bitrate": bitrate
+            "bitrate": bitrate,
+            "bitrate_kbps": bitrate_kbps
         }
         
     except subprocess.TimeoutExpired:
@@ -70,13 +78,263 @@ def analyze_camera_stream(camera_url):
     except Exception as e:
         return {"error": str(e)}
 
+def sample_stream(camera_url, window=5.0, timeout=None):
+    """
+    Measure the bitrate and fps actually delivered by a stream over a time window.
+
+    Reads the video packets of the first `window` seconds and derives the rates from
+    their sizes and timestamps, unlike analyze_camera_stream() which reports what the
+    container declares.
+
+    Args:
+        camera_url (str): URL of the stream (e.g., udp://127.0.0.1:1234)
+        window (float): Seconds of stream to read
+        timeout (float): Seconds to wait for ffprobe, window + 10 by default
+
+    Returns:
+        dict: resolution, fps, bitrate_kbps, packets, keyframes and the measured duration
+    """
+    cmd = [
+        'ffprobe',
+        '-v', 'error',
+        '-select_streams', 'v:0',
+        '-read_intervals', f'%+{window}',
+        '-show_entries', 'stream=width,height:packet=pts_time,dts_time,size,flags',
+        '-of', 'json',
+        camera_url
+    ]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout or window + 10)
+        if result.returncode != 0:
+            raise Exception(f"ffprobe failed: {result.stderr}")
+        data = json.loads(result.stdout)
+    except subprocess.TimeoutExpired:
+        return {"error": "Timeout while sampling stream"}
+    except Exception as e:
+        return {"error": str(e)}
+
+    streams = data.get('streams') or [{}]
+    width, height = streams[0].get('width'), streams[0].get('height')
+    times = []
+    total_bytes = 0
+    keyframes = 0
+    for packet in data.get('packets', []):
+        timestamp = packet.get('pts_time', packet.get('dts_time'))
+        if timestamp in (None, 'N/A'):
+            continue
+        times.append(float(timestamp))
+        total_bytes += int(packet.get('size', 0))
+        if 'K' in packet.get('flags', ''):
+            keyframes += 1
+    if len(times) < 2:
+        return {"error": "Not enough video packets in the window"}
+
+    times.sort()
+    duration = times[-1] - times[0]
+    if duration <= 0:
+        return {"error": "Video packets have no usable timestamps"}
+    return {
+        "resolution": f"{width}x{height}" if width and height else "Unknown",
+        "fps": round((len(times) - 1) / duration, 2),
+        "bitrate_kbps": round(total_bytes * 8 / 1000 / duration, 1),
+        "packets": len(times),
+        "keyframes": keyframes,
+        "duration": round(duration, 3),
+    }
+
+
+def compare_with_profile(result, profile, tolerance=0.2):
+    """
+    Check a probe or sample result against an encoder profile
+    ({"resolution": "1280x720", "bitrate": "2666k", "fps": "27"}).
+
+    Bitrate and fps may deviate by `tolerance` (relative); resolution must match exactly.
+    A bitrate the probe could not determine is a mismatch too: ffprobe often reports none
+    for mpegts over UDP, and --sample measures it instead.
+
+    Returns:
+        list: Human-readable mismatches, empty if the stream matches the profile
+    """
+    mismatches = []
+    if result.get('resolution') not in (None, 'Unknown') and result['resolution'] != profile['resolution']:
+        mismatches.append(f"resolution {result['resolution']} != {profile['resolution']}")
+    fps = result.get('fps')
+    if isinstance(fps, (int, float)) and abs(fps - float(profile['fps'])) > tolerance * float(profile['fps']):
+        mismatches.append(f"fps {fps} != {profile['fps']}")
+    bitrate = result.get('bitrate_kbps')
+    if bitrate is None:
+        mismatches.append(f"bitrate unknown != {profile['bitrate']} (use --sample to measure it)")
+    else:
+        expected = float(profile['bitrate'].rstrip('kK'))
+        if abs(bitrate - expected) > tolerance * expected:
+            mismatches.append(f"bitrate {bitrate} kbps != {profile['bitrate']}")
+    return mismatches
+
+
+class ResultCache:
+    """
+    TTL cache of probe results keyed by mode and URL, optionally persisted as a JSON file
+    so that repeated runs within `ttl` seconds do not probe the same stream again.
+    """
+
+    def __init__(self, ttl, path=None):
+        self.ttl = ttl
+        self.path = path
+        self.entries = {}
+        self.lock = threading.Lock()
+        if path and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                self.entries = {}
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or time.time() - entry['at'] > self.ttl:
+                return None
+            return entry['result']
+
+    def put(self, key, result):
+        with self.lock:
+            self.entries[key] = {"at": time.time(), "result": result}
+
+    def save(self):
+        if not self.path:
+            return
+        now = time.time()
+        with self.lock:
+            entries = {key: entry for key, entry in self.entries.items() if now - entry['at'] <= self.ttl}
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, self.path)
+
+
+def analyze_many(urls, workers=8, timeout=10, sample_window=None, cache=None):
+    """
+    Probe many streams in parallel with a bounded worker pool.
+
+    Args:
+        urls (list): Stream URLs
+        workers (int): Maximum number of concurrent ffprobe processes
+        timeout (float): Per-URL timeout in seconds
+        sample_window (float): If set, measure delivered bitrate/fps over this many seconds (sample_stream)
+        cache (ResultCache): Results younger than its TTL are returned without probing
+
+    Yields:
+        dict: One record per URL in completion order, with url, ok, elapsed and cached
+    """
+    mode = f"sample:{sample_window}" if sample_window else "probe"
+
+    def run(url):
+        started_at = time.monotonic()
+        if sample_window:
+            result = sample_stream(url, sample_window, timeout + sample_window)
+        else:
+            result = analyze_camera_stream(url, timeout)
+        return result, time.monotonic() - started_at
+
+    pending = []
+    for url in dict.fromkeys(urls):
+        cached = cache.get(f"{mode}|{url}") if cache else None
+        if cached is not None:
+            yield {"url": url, "ok": "error" not in cached, **cached, "elapsed": 0.0, "cached": True}
+        else:
+            pending.append(url)
+    if not pending:
+        return
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(pending)))) as pool:
+        futures = {pool.submit(run, url): url for url in pending}
+        for future in as_completed(futures):
+            url = futures[future]
+            result, elapsed = future.result()
+            if cache is not None:
+                cache.put(f"{mode}|{url}", result)
+            yield {"url": url, "ok": "error" not in result, **result, "elapsed": round(elapsed, 3), "cached": False}
+
+
+def config_outputs(config_path, expect_index=None):
+    """
+    Output URLs of all devices from a daemon config and, if `expect_index` is given,
+    the profile each of them should be streaming at that ladder step.
+    """
+    from src.config import Config
+    from src.signalpolicy import build_profile_ladder, fixed_profile_params
+
+    config = Config(config_path)
+    fixed = fixed_profile_params(config)
+    outputs = {}
+    for device_config in config.device_configs.values():
+        profile = None
+        if expect_index is not None:
+            ladder = build_profile_ladder(
+                device_config.resolution,
+                device_config.bitrate,
+                device_config.fps,
+                device_config.degradation_steps,
+                fixed,
+            )
+            profile = ladder[min(expect_index, len(ladder) - 1)]
+        outputs[device_config.output] = profile
+    return outputs
+
+
+def run_batch(args, urls, profiles):
+    cache = ResultCache(args.cache_ttl, args.cache) if args.cache_ttl > 0 else None
+    failed = 0
+    try:
+        for record in analyze_many(urls, args.workers, args.timeout, args.sample, cache):
+            profile = profiles.get(record['url']) or args.expect
+            if profile and record['ok']:
+                record['expected'] = profile
+                record['mismatches'] = compare_with_profile(record, profile, args.tolerance)
+                record['ok'] = not record['mismatches']
+            failed += not record['ok']
+            print(json.dumps(record), flush=True)
+    finally:
+        if cache is not None:
+            cache.save()
+    return failed
+
+
 def main():
     parser = argparse.ArgumentParser(description='Analyze web camera stream properties')
-    parser.add_argument('url', help='Camera stream URL (e.g., rtsp://192.168.1.100:554/stream)')
+    parser.add_argument('url', nargs='*', help='Camera stream URL (e.g., rtsp://192.168.1.100:554/stream)')
+    parser.add_argument('--file', help='Read stream URLs from a file, one per line')
+    parser.add_argument('--config', help='Probe the outputs of all devices from a daemon config (e.g., main.conf)')
+    parser.add_argument('--json', action='store_true', help='Print one JSON line per URL (implied for several URLs)')
+    parser.add_argument('--workers', type=int, default=8, help='Maximum concurrent ffprobe processes')
+    parser.add_argument('--timeout', type=float, default=10, help='Per-URL timeout in seconds')
+    parser.add_argument('--sample', type=float, metavar='SECONDS',
+                        help='Measure delivered bitrate and fps over this window instead of declared values')
+    parser.add_argument('--cache', help='JSON file to keep results in between runs')
+    parser.add_argument('--cache-ttl', type=float, default=0, help='Seconds a cached result stays valid (0 = off)')
+    parser.add_argument('--expect', type=json.loads,
+                        help='Profile every stream must match, e.g. \'{"resolution": "1280x720", "bitrate": "2666k", "fps": "27"}\'')
+    parser.add_argument('--expect-index', type=int,
+                        help='With --config: ladder step each device output must match')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed relative bitrate/fps deviation')
     args = parser.parse_args()
-    
-    print(f"Analyzing camera stream at: {args.url}")
-    result = analyze_camera_stream(args.url)
+
+    urls = list(args.url)
+    if args.file:
+        with open(args.file) as f:
+            urls.extend(line.strip() for line in f if line.strip() and not line.startswith('#'))
+    profiles = {}
+    if args.config:
+        profiles = config_outputs(args.config, args.expect_index)
+        urls.extend(profiles)
+    if not urls:
+        parser.error('no stream URLs given')
+
+    if len(urls) > 1 or args.json or args.sample or args.cache_ttl > 0 or args.expect or profiles:
+        sys.exit(1 if run_batch(args, urls, profiles) else 0)
+
+    print(f"Analyzing camera stream at: {urls[0]}")
+    result = analyze_camera_stream(urls[0], args.timeout)
     
     if "error" in result:
         print(f"Error: {result['error']}")
@@ -5,57 +5,77 @@ from src.connection_checker import ConnectionChecker
 from src.config import Config
 from src.logger import LogType
 from src.logger import GenericTextLogHandler
+from src.supervisor import Supervisor
+from src.telemetry import TelemetryRing
+from src.metrics import MetricsServer, build_registry
+from src.udp_relay import UDPRelay
+import asyncio
 import time
 
 from src.logger import get_logger
+from src.logger import configure_log_pipeline
 import signal
-import sys
 
 logger = get_logger(__name__, filename="main.csv", logType=LogType.BOTH, handler=GenericTextLogHandler)
 
 
-def check_init_connection(config: Config = None):
+async def run(config: Config, started_at: float = None):
+    # Аутентификация и проверки соединения идут в фоне (Supervisor), энкодеры стартуют сразу
+    client = KeeneticRCIClient(config)
+    checker = None
     try:
-        connection_check = ConnectionChecker(config)
-        connection = connection_check.check_all()
-        if connection:
-            logger.info("[CONNECTION CHECKER] Начальные проверки соединения прошли успешно.")
-        else:
-            logger.error("[CONNECTION CHECKER] Ошибка при начальной проверке соединения.")
-    except Exception as e:
-        logger.error(f"[CONNECTION CHECKER] Ошибка во время начальной проверки соединения: {e}")
+        checker = ConnectionChecker(config)
+    except ValueError as e:
+        logger.error(f"[CONNECTION CHECKER] Проверки соединения отключены: {e}")
+    relay = None
+    if config.relay_enabled:
+        relay = UDPRelay(config)
+        relay.start()
+    ffmpeg = FFMPEGController(config, relay=relay)
+    telemetry = None
+    if config.telemetry_capacity > 0:
+        # Битрейт пишется по процессам энкодеров: у группы камер он один, под именем группы
+        telemetry = TelemetryRing(config.telemetry_capacity, ffmpeg.instances, path=config.telemetry_path)
+    policy = SignalPolicyEngine(client, ffmpeg, config, telemetry=telemetry)
+    supervisor = Supervisor(config, client, ffmpeg, policy, checker, started_at=started_at)
 
+    metrics_server = None
+    if config.metrics_enabled:
+        registry = build_registry(client, ffmpeg, policy, supervisor)
+        # Экспортёр необязателен: занятый порт или неверный адрес не должны останавливать вещание
+        try:
+            metrics_server = MetricsServer(registry, config.metrics_host, config.metrics_port)
+            metrics_server.start()
+        except OSError as e:
+            logger.error(
+                f"[METRICS] Не удалось запустить экспортёр на {config.metrics_host}:{config.metrics_port}: {e}, "
+                f"продолжаем без метрик"
+            )
+            metrics_server = None
 
-def graceful_shutdown(signum, frame):
-    logger.info("[MAIN] Инициирована остановка.")
-    sys.exit(0)
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGINT, supervisor.stop)
+    loop.add_signal_handler(signal.SIGTERM, supervisor.stop)
+    loop.add_signal_handler(signal.SIGHUP, supervisor.request_reload)
 
+    logger.info("[MAIN] Старт цикла обработки сигналов.")
+    try:
+        await supervisor.run()
+    finally:
+        if metrics_server is not None:
+            metrics_server.stop()
+        if telemetry is not None:
+            telemetry.close()
 
-if __name__ == "__main__":
-    signal.signal(signal.SIGINT, graceful_shutdown)
-    signal.signal(signal.SIGTERM, graceful_shutdown)
 
+if __name__ == "__main__":
+    started_at = time.monotonic()
     config = Config()
+    configure_log_pipeline(config)
     
     # Log configured devices
     logger.info(f"[MAIN] Сконфигурировано {len(config.device_configs)} устройств:")
     for device_name, device_config in config.device_configs.items():
         logger.info(f"[MAIN] - {device_name} → {device_config.output}")
     
-    client = KeeneticRCIClient(config)
-    if client.authenticate():
-        check_init_connection(config)
-        ffmpeg = FFMPEGController(config)
-        policy = SignalPolicyEngine(client, ffmpeg, config)
-        logger.info("[MAIN] Старт цикла обработки сигналов.")
-        while True:
-            signal_info = client.get_signal_info()
-            logger.info(f"[SIGNAL POLICY] Получена информация о качестве соединения: {signal_info}")
-            if signal_info:
-                policy.evaluate_and_apply(signal_info)
-            else:
-                logger.error("[SIGNAL POLICY] Не удалось получить информацию о качестве соединения.")
-                break
-            time.sleep(int(config.timeout))
-    else:
-        logger.error("[MAIN] Аутентификация не удалась. Завершение работы.")
+    asyncio.run(run(config, started_at))
@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+import argparse
+import csv
+import hashlib
+import json
+import random
+import secrets
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+SESSION_COOKIE = "sysmode_session"
+
+
+class SignalSample:
+    __slots__ = ("offset", "rssi", "noise", "rate")
+
+    def __init__(self, offset, rssi, noise, rate=None):
+        self.offset = offset
+        self.rssi = rssi
+        self.noise = noise
+        self.rate = rate
+
+
+def load_script(value):
+    """
+    Parse a signal script: "offset:rssi:noise[:rate],..." with offsets in seconds.
+
+    Example: "0:-50:-95:144,10:-80:-95:13" is a strong signal that drops after 10 s.
+    """
+    samples = []
+    for entry in value.split(","):
+        parts = entry.strip().split(":")
+        if len(parts) not in (3, 4):
+            raise ValueError(f"Expected offset:rssi:noise[:rate], got: {entry}")
+        rate = float(parts[3]) if len(parts) == 4 else None
+        samples.append(SignalSample(float(parts[0]), int(parts[1]), int(parts[2]), rate))
+    return sorted(samples, key=lambda sample: sample.offset)
+
+
+def load_trace(path):
+    """
+    Load a CsvSignalLogHandler file (timestamp, ssid, rssi, noise, rate_mbps, quality_percent)
+    as a script with offsets relative to its first row.
+    """
+    samples = []
+    started_at = None
+    with open(path, newline="") as f:
+        for row in csv.reader(f):
+            if len(row) < 4 or not row[2] or not row[3]:
+                continue
+            try:
+                ts = datetime.fromisoformat(row[0]).timestamp()
+                rssi, noise = int(float(row[2])), int(float(row[3]))
+                rate = float(row[4]) if len(row) > 4 and row[4] else None
+            except ValueError:
+                continue
+            started_at = ts if started_at is None else started_at
+            samples.append(SignalSample(ts - started_at, rssi, noise, rate))
+    return samples
+
+
+class RCIEmulator:
+    """
+    Local stand-in for a Keenetic router's RCI API.
+
+    Implements the /auth X-NDM-Realm/X-NDM-Challenge handshake with a session cookie,
+    GET rci/show/interface[/stat] and batched POST rci/. The station signal follows a
+    scripted trace (looped if `loop`) or whatever set_signal() set last. Latency, jitter,
+    HTTP 500 errors, dropped connections and session expiry can be injected.
+    """
+
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=0,
+        login="admin",
+        password="admin",
+        interface="WifiMaster0/WifiStation0",
+        script=None,
+        loop=False,
+        latency=0.0,
+        jitter=0.0,
+        error_rate=0.0,
+        drop_rate=0.0,
+        session_ttl=None,
+        seed=None,
+    ):
+        self.login = login
+        self.password = password
+        self.interface = interface
+        self.realm = "Keenetic Emulator"
+        self.script = script or [SignalSample(0.0, -50, -95, 144.0)]
+        self.loop = loop
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.session_ttl = session_ttl
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.auth_requests = 0
+        self.rci_requests = 0
+        self.injected_errors = 0
+        self.injected_drops = 0
+        self._challenges = set()
+        self._sessions = {}
+        self._override = None
+        self._lock = threading.Lock()
+        self._started_at = time.monotonic()
+        self._txbytes = 0
+        self._rxbytes = 0
+        self._counters_at = self._started_at
+
+        emulator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(handler):
+                emulator._handle(handler, None)
+
+            def do_POST(handler):
+                length = int(handler.headers.get("Content-Length") or 0)
+                emulator._handle(handler, handler.rfile.read(length) if length else b"")
+
+            def log_message(handler, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self._thread = threading.Thread(target=self.server.serve_forever, name="rci-emulator", daemon=True)
+
+    @property
+    def address(self) -> str:
+        """host:port to put into [Router] ip_addr"""
+        host, port = self.server.server_address[:2]
+        return f"{host}:{port}"
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def set_signal(self, rssi, noise, rate=None):
+        """Override the scripted trace from now on; returns the monotonic time of the change"""
+        with self._lock:
+            self._advance_counters()
+            self._override = SignalSample(0.0, rssi, noise, rate)
+            return time.monotonic()
+
+    def restart_script(self):
+        with self._lock:
+            self._override = None
+            self._started_at = time.monotonic()
+
+    def current_signal(self) -> SignalSample:
+        if self._override is not None:
+            return self._override
+        elapsed = time.monotonic() - self._started_at
+        if self.loop and self.script[-1].offset > 0:
+            elapsed %= self.script[-1].offset
+        current = self.script[0]
+        for sample in self.script:
+            if sample.offset > elapsed:
+                break
+            current = sample
+        return current
+
+    def _advance_counters(self):
+        # The station sends at about half its PHY rate
+        now = time.monotonic()
+        rate = self.current_signal().rate or 0.0
+        self._txbytes += int(rate * 1_000_000 / 8 * 0.5 * (now - self._counters_at))
+        self._rxbytes += int(rate * 1_000_000 / 8 * 0.02 * (now - self._counters_at))
+        self._counters_at = now
+
+    def _interface_status(self, name):
+        signal = self.current_signal()
+        snr = signal.rssi - signal.noise
+        return {
+            "id": name,
+            "ssid": "emulator",
+            "link": "up",
+            "connected": "yes",
+            "rssi": signal.rssi,
+            "noise": signal.noise,
+            "rate": signal.rate,
+            "quality": max(0, min(100, snr * 2)),
+        }
+
+    def _interface_stats(self, name):
+        with self._lock:
+            self._advance_counters()
+            return {
+                "rxbytes": self._rxbytes,
+                "txbytes": self._txbytes,
+                "rxpackets": self._rxbytes // 1400,
+                "txpackets": self._txbytes // 1400,
+                "rxerrors": 0,
+                "txerrors": 0,
+            }
+
+    def _execute(self, body):
+        """Result of one RCI command in a batch"""
+        interface = body.get("show", {}).get("interface") if isinstance(body, dict) else None
+        if isinstance(interface, dict):
+            if "stat" in interface:
+                return self._interface_stats(interface["stat"].get("name", self.interface))
+            return self._interface_status(interface.get("name", self.interface))
+        if isinstance(body, dict) and "hotspot" in body.get("show", {}).get("ip", {}):
+            return {"host": []}
+        return {"status": [{"status": "error", "code": "7405600", "message": "unknown command"}]}
+
+    def _session_valid(self, handler) -> bool:
+        cookie = handler.headers.get("Cookie", "")
+        for part in cookie.split(";"):
+            name, _, value = part.strip().partition("=")
+            if name == SESSION_COOKIE and value in self._sessions:
+                if self.session_ttl is None or time.monotonic() - self._sessions[value] < self.session_ttl:
+                    return True
+                del self._sessions[value]
+        return False
+
+    def _handle(self, handler, body):
+        self.requests += 1
+        delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay > 0:
+            time.sleep(delay)
+        url = urlsplit(handler.path)
+        path = url.path.strip("/")
+
+        if path == "auth":
+            self.auth_requests += 1
+            self._handle_auth(handler, body)
+            return
+
+        if self.drop_rate and self.random.random() < self.drop_rate:
+            self.injected_drops += 1
+            handler.close_connection = True
+            handler.connection.close()
+            return
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.injected_errors += 1
+            self._send(handler, 500, {"error": "injected"})
+            return
+        if not self._session_valid(handler):
+            self._send_challenge(handler)
+            return
+
+        self.rci_requests += 1
+        if path == "rci" and body is not None:
+            try:
+                commands = json.loads(body or b"null")
+            except ValueError:
+                self._send(handler, 400, {"error": "bad json"})
+                return
+            if not isinstance(commands, list):
+                commands = [commands]
+            self._send(handler, 200, [self._execute(command) for command in commands])
+            return
+
+        name = parse_qs(url.query).get("name", [self.interface])[0]
+        if path == "rci/show/interface":
+            self._send(handler, 200, self._interface_status(name))
+        elif path == "rci/show/interface/stat":
+            self._send(handler, 200, self._interface_stats(name))
+        elif path == "rci/show/ip/hotspot":
+            self._send(handler, 200, {"host": []})
+        else:
+            self._send(handler, 404, {"error": "not found"})
+
+    def _handle_auth(self, handler, body):
+        if body is None:
+            if self._session_valid(handler):
+                self._send(handler, 200, {})
+            else:
+                self._send_challenge(handler)
+            return
+        try:
+            credentials = json.loads(body)
+        except ValueError:
+            self._send(handler, 400, {"error": "bad json"})
+            return
+        md5 = hashlib.md5(f"{self.login}:{self.realm}:{self.password}".encode()).hexdigest()
+        for challenge in list(self._challenges):
+            expected = hashlib.sha256((challenge + md5).encode()).hexdigest()
+            if credentials.get("login") == self.login and credentials.get("password") == expected:
+                self._challenges.discard(challenge)
+                session = secrets.token_hex(16)
+                self._sessions[session] = time.monotonic()
+                self._send(handler, 200, {}, {"Set-Cookie": f"{SESSION_COOKIE}={session}; Path=/"})
+                return
+        self._send(handler, 401, {"error": "unauthorized"})
+
+    def _send_challenge(self, handler):
+        challenge = secrets.token_hex(16)
+        self._challenges.add(challenge)
+        self._send(handler, 401, {}, {"X-NDM-Realm": self.realm, "X-NDM-Challenge": challenge})
+
+    @staticmethod
+    def _send(handler, status, payload, headers=None):
+        data = json.dumps(payload).encode()
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Keenetic RCI emulator serving scripted signal traces")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--login", default="admin")
+    parser.add_argument("--password", default="admin")
+    parser.add_argument("--interface", default="WifiMaster0/WifiStation0")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--script", help='Signal script "offset:rssi:noise[:rate],...", offsets in seconds')
+    source.add_argument("--trace", help="CSV signal log written by CsvSignalLogHandler")
+    parser.add_argument("--loop", action="store_true", help="Repeat the script or trace")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Up to this many extra seconds, uniformly random")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of RCI requests answered with HTTP 500")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="Share of RCI requests dropped without reply")
+    parser.add_argument("--session-ttl", type=float, help="Seconds before a session expires and needs re-auth")
+    parser.add_argument("--seed", type=int, help="Seed for injected jitter and errors")
+    args = parser.parse_args()
+
+    script = None
+    if args.script:
+        script = load_script(args.script)
+    elif args.trace:
+        script = load_trace(args.trace)
+    emulator = RCIEmulator(
+        args.host,
+        args.port,
+        login=args.login,
+        password=args.password,
+        interface=args.interface,
+        script=script,
+        loop=args.loop,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        drop_rate=args.drop_rate,
+        session_ttl=args.session_ttl,
+        seed=args.seed,
+    )
+    print(f"RCI emulator listening on http://{emulator.address}/ (set [Router] ip_addr = {emulator.address})")
+    try:
+        emulator.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        emulator.server.server_close()
+
+
+if __name__ == "__main__":
+    main()
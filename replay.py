@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+import argparse
+import csv
+import json
+import logging
+import time
+from datetime import datetime
+
+from src.config import Config
+from src.signalpolicy import SignalPolicyEngine
+
+
+class ReplayFFMPEGController:
+    """
+    Stand-in for FFMPEGController that records profile switches instead of
+    restarting encoders. The replay loop sets `now` before every sample.
+    """
+
+    def __init__(self, profiles):
+        self.profiles = profiles
+        self.now = None
+        self.current_profile = None
+        self.switches = []
+
+    def restart_if_needed(self, new_profile):
+        if new_profile != self.current_profile:
+            if self.current_profile is not None:
+                self.switches.append(self.now)
+            self.current_profile = new_profile
+
+    def apply_profiles(self, profiles):
+        self.restart_if_needed(profiles)
+
+    def get_progress(self):
+        return {}
+
+    def supervise(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+def load_trace(path):
+    """
+    Load a CsvSignalLogHandler file (timestamp, ssid, rssi, noise, rate_mbps, quality_percent).
+
+    Args:
+        path (str): Path to the CSV file.
+
+    Returns:
+        list: (timestamp, rssi, noise, rate_mbps) tuples; rows without rssi or noise are skipped,
+            rate_mbps is None where the router did not report it.
+    """
+    samples = []
+    with open(path, newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header and header[0] != "timestamp":
+            f.seek(0)
+            reader = csv.reader(f)
+        for row in reader:
+            if len(row) < 4 or not row[2] or not row[3]:
+                continue
+            try:
+                ts = datetime.fromisoformat(row[0]).timestamp()
+                rate = float(row[4]) if len(row) > 4 and row[4] else None
+                samples.append((ts, int(float(row[2])), int(float(row[3])), rate))
+            except ValueError:
+                continue
+    return samples
+
+
+def replay(samples, config: Config, restart_cost: float = 3.0) -> dict:
+    """
+    Run a recorded trace through the real SignalPolicyEngine.
+
+    Args:
+        samples (list): (timestamp, rssi, noise, rate_mbps) tuples in time order; the rate
+            feeds the uplink budget with policy.allocation = budget.
+        config (Config): Configuration the policy is built from.
+        restart_cost (float): Seconds of lost video per profile switch.
+
+    Returns:
+        dict: Switch count, estimated outage, time per profile, reaction latency to signal drops
+            and, with policy.predictive, how many pre-emptive step-downs the signal confirmed.
+    """
+    policy = SignalPolicyEngine(None, None, config)
+    controller = ReplayFFMPEGController(policy.profiles)
+    policy.ffmpeg = controller
+
+    time_at_profile = [0.0] * len(policy.profiles)
+    reaction_latencies = []
+    ignored_drops = 0
+    pending_drop = None  # (start time, level the raw signal dropped to)
+    previous_ts = None
+    previous_naive = None
+
+    started_at = time.perf_counter()
+    for ts, rssi, noise, rate in samples:
+        controller.now = ts
+        policy.evaluate_and_apply({"rssi": rssi, "noise": noise, "rate": rate}, now=ts)
+        index = policy.current_index
+        naive_index = policy._index_for_snr(rssi - noise)
+
+        if previous_ts is not None:
+            time_at_profile[previous_index] += ts - previous_ts
+
+        # Reaction latency: from the first raw sample below a level boundary
+        # until the policy is at that level or lower
+        if pending_drop is not None:
+            if index >= pending_drop[1]:
+                reaction_latencies.append(ts - pending_drop[0])
+                pending_drop = None
+            elif naive_index <= index:
+                ignored_drops += 1
+                pending_drop = None
+        if pending_drop is None and previous_naive is not None and naive_index > previous_naive and naive_index > index:
+            pending_drop = (ts, naive_index)
+
+        previous_ts = ts
+        previous_index = index
+        previous_naive = naive_index
+    elapsed = time.perf_counter() - started_at
+
+    reaction_latencies.sort()
+    return {
+        "samples": len(samples),
+        "duration": samples[-1][0] - samples[0][0] if samples else 0.0,
+        "switches": len(controller.switches),
+        "avoided_switches": policy.avoided_switches,
+        "outage_seconds": len(controller.switches) * restart_cost,
+        "time_at_profile": {str(i): round(t, 1) for i, t in enumerate(time_at_profile)},
+        "drops": len(reaction_latencies) + ignored_drops,
+        "drops_ignored": ignored_drops,
+        "reaction_latency_mean": sum(reaction_latencies) / len(reaction_latencies) if reaction_latencies else None,
+        "reaction_latency_p95": (
+            reaction_latencies[int(0.95 * (len(reaction_latencies) - 1))] if reaction_latencies else None
+        ),
+        "reaction_latency_max": reaction_latencies[-1] if reaction_latencies else None,
+        "prediction_hits": policy.prediction_hits,
+        "prediction_misses": policy.prediction_misses,
+        "prediction_lead_mean": (
+            round(policy.prediction_lead_total / policy.prediction_hits, 3) if policy.prediction_hits else None
+        ),
+        "unpredicted_drops": policy.unpredicted_drops,
+        "replay_seconds": round(elapsed, 3),
+        "samples_per_second": round(len(samples) / elapsed) if elapsed > 0 else None,
+    }
+
+
+def parse_override(value):
+    key, sep, option_value = value.partition("=")
+    section, dot, option = key.partition(".")
+    if not sep or not dot:
+        raise argparse.ArgumentTypeError(f"Expected section.option=value, got: {value}")
+    return (section, option), option_value
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded signal traces through SignalPolicyEngine")
+    parser.add_argument("traces", nargs="+", help="CSV signal logs written by CsvSignalLogHandler")
+    parser.add_argument("--config", default="main.conf", help="Config file the policy is built from")
+    parser.add_argument(
+        "--set",
+        dest="overrides",
+        action="append",
+        type=parse_override,
+        default=[],
+        help="Override a config option, e.g. --set policy.filter=median (repeatable)",
+    )
+    parser.add_argument("--restart-cost", type=float, default=3.0, help="Seconds of lost video per profile switch")
+    parser.add_argument("--json", action="store_true", help="Print one JSON object per trace")
+    args = parser.parse_args()
+
+    config = Config(args.config, overrides=dict(args.overrides))
+    # Per-sample policy logging would dominate the replay time
+    logging.disable(logging.INFO)
+
+    for path in args.traces:
+        report = replay(load_trace(path), config, args.restart_cost)
+        report["trace"] = path
+        if args.json:
+            print(json.dumps(report))
+            continue
+        print(f"\nTrace: {path}")
+        for key, value in report.items():
+            if key != "trace":
+                print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+def parse_kbps(bitrate) -> float:
+    """Битрейт профиля ("4000k", "2M", "800000") в кбит/с"""
+    value = str(bitrate).strip().lower()
+    if value.endswith("k"):
+        return float(value[:-1])
+    if value.endswith("m"):
+        return float(value[:-1]) * 1000
+    return float(value) / 1000
+
+
+def estimate_uplink_kbps(
+    rate_mbps, snr: float, goodput_ratio: float = 0.5, snr_floor: float = 5, snr_full: float = 25
+) -> float:
+    """
+    Оценка доступной полосы аплинка по канальной скорости станции и SNR.
+
+    Канальная скорость (rate из show interface) — это скорость PHY, полезная пропускная
+    способность Wi-Fi примерно вдвое ниже (goodput_ratio). Скорость адаптации MCS отстаёт
+    от реального сигнала, поэтому при SNR ниже snr_full оценка дополнительно линейно
+    уменьшается до нуля на snr_floor.
+
+    Returns:
+        float: кбит/с, или None, если роутер не сообщил скорость канала или SNR ещё не известен.
+    """
+    if rate_mbps is None or snr is None:
+        return None
+    try:
+        rate_kbps = float(rate_mbps) * 1000
+    except (TypeError, ValueError):
+        return None
+    if snr_full <= snr_floor:
+        snr_factor = 1.0 if snr >= snr_full else 0.0
+    else:
+        snr_factor = max(0.0, min(1.0, (snr - snr_floor) / (snr_full - snr_floor)))
+    return rate_kbps * goodput_ratio * snr_factor
+
+
+class BandwidthAllocator:
+    """
+    Делит бюджет полосы между камерами по их лестницам профилей.
+
+    Все камеры начинают с самой нижней ступени (она выдаётся даже при нехватке бюджета:
+    поток хуже, чем ничего, не бывает). Затем бюджет раздаётся по одной ступени:
+    сначала камерам с меньшим priority, внутри одного приоритета — камере с наименьшим
+    битрейтом на единицу веса. Камера, следующая ступень которой не помещается
+    в остаток, пропускается, и остаток может достаться менее важной камере.
+    """
+
+    def __init__(self):
+        # Битрейты ступеней по камерам; пересчитываются, только если лестницу заменили (reload)
+        self._costs = {}
+
+    def _ladder_costs(self, device_name: str, ladder: list) -> list:
+        cached = self._costs.get(device_name)
+        if cached is None or cached[0] is not ladder:
+            cached = (ladder, [parse_kbps(profile["bitrate"]) for profile in ladder])
+            self._costs[device_name] = cached
+        return cached[1]
+
+    def allocate(self, budget_kbps: float, ladders: dict, priorities: dict = None, weights: dict = None) -> dict:
+        """
+        Args:
+            budget_kbps (float): Доступная полоса.
+            ladders (dict): {имя устройства: [профиль, ...]}, индекс 0 — лучший профиль.
+            priorities (dict): {имя устройства: приоритет}, меньше — важнее.
+            weights (dict): {имя устройства: вес} внутри одного приоритета.
+
+        Returns:
+            dict: {имя устройства: индекс профиля в его лестнице}.
+        """
+        priorities = priorities or {}
+        weights = weights or {}
+        costs = {device_name: self._ladder_costs(device_name, ladder) for device_name, ladder in ladders.items()}
+        indices = {device_name: len(ladder) - 1 for device_name, ladder in ladders.items()}
+        remaining = budget_kbps - sum(costs[device_name][index] for device_name, index in indices.items())
+
+        while True:
+            best = None
+            best_key = None
+            for device_name, index in indices.items():
+                if index == 0:
+                    continue
+                step_cost = costs[device_name][index - 1] - costs[device_name][index]
+                if step_cost > remaining:
+                    continue
+                weight = max(weights.get(device_name, 1.0), 1e-9)
+                key = (priorities.get(device_name, 0), costs[device_name][index] / weight)
+                if best_key is None or key < best_key:
+                    best, best_key = device_name, key
+            if best is None:
+                break
+            index = indices[best]
+            remaining -= costs[best][index - 1] - costs[best][index]
+            indices[best] = index - 1
+        return indices
@@ -2,30 +2,82 @@ import configparser
 import os
 
 class DeviceConfig:
-    def __init__(self, device_name, output_destination, resolution, bitrate, fps):
+    def __init__(
+        self, device_name, output_destination, resolution, bitrate, fps,
+        degradation_steps=None, priority=0, weight=1.0,
+    ):
         self.device_name = device_name
         self.output = output_destination
         self.resolution = resolution
         self.bitrate = bitrate
         self.fps = fps
+        self.degradation_steps = degradation_steps
+        # Меньшее значение — более важная камера; вес делит полосу внутри одного приоритета
+        self.priority = priority
+        self.weight = weight
 
 class Config:
-    def __init__(self, config_path="main.conf"):
+    def __init__(self, config_path="main.conf", overrides: dict = None):
         self.config = configparser.ConfigParser()
         if not os.path.exists(config_path):
             raise FileNotFoundError(f"Config file {config_path} not found")
         self.config.read(config_path)
+        self.path = config_path
+        self.overrides = dict(overrides or {})
+        # overrides: {(section, option): value}, e.g. for replaying traces with other policy settings
+        for (section, option), value in (overrides or {}).items():
+            if not self.config.has_section(section):
+                self.config.add_section(section)
+            self.config.set(section, option, str(value))
         
         # Router settings
         self.ip = self.config.get("Router", "ip_addr")
         self.login = self.config.get("Router", "login")
         self.password = self.config.get("Router", "password")
+        self.rci_connect_timeout = self.config.getfloat("Router", "connect_timeout", fallback=2)
+        self.rci_read_timeout = self.config.getfloat("Router", "read_timeout", fallback=3)
+        self.rci_pool_maxsize = self.config.getint("Router", "pool_maxsize", fallback=2)
         
         # General settings
         self.timeout = self.config.get("settings", "timeout")
         self.logfile = self.config.get("settings", "logfile")
         self.connection_type = self.config.get("settings", "connection_type")
+        self.rci_interface = self.config.get("settings", "interface", fallback="WifiMaster0/WifiStation0")
+        self.rci_poll_stats = self.config.getboolean("settings", "poll_stats", fallback=True)
+        self.rci_poll_hotspot = self.config.getboolean("settings", "poll_hotspot", fallback=False)
+        self.connection_check = self.config.getboolean("settings", "connection_check", fallback=True)
+        self.connection_check_interval = self.config.getfloat("settings", "connection_check_interval", fallback=60)
+        self.supervise_interval = self.config.getfloat("settings", "supervise_interval", fallback=1)
+        self.reload_check_interval = self.config.getfloat("settings", "reload_check_interval", fallback=2)
+        self.auth_retry_initial = self.config.getfloat("settings", "auth_retry_initial", fallback=1)
+        self.auth_retry_max = self.config.getfloat("settings", "auth_retry_max", fallback=10)
+
+        # Signal polling schedule: fixed = every settings.timeout seconds, adaptive = see AdaptivePollScheduler
+        self.poll_mode = self.config.get("polling", "mode", fallback="fixed")
+        if self.poll_mode not in ("fixed", "adaptive"):
+            raise ValueError(f"Unknown polling mode: {self.poll_mode}")
+        self.poll_min_interval = self.config.getfloat("polling", "min_interval", fallback=0.5)
+        self.poll_max_interval = self.config.getfloat("polling", "max_interval", fallback=5)
+        self.poll_window = self.config.getint("polling", "window", fallback=8)
+        self.poll_variance_threshold = self.config.getfloat("polling", "variance_threshold", fallback=3)
+        self.poll_trend_threshold = self.config.getfloat("polling", "trend_threshold", fallback=1)
+        self.poll_switch_hold = self.config.getfloat("polling", "switch_hold", fallback=10)
+        self.poll_backoff = self.config.getfloat("polling", "backoff", fallback=1.5)
         
+        # Logging pipeline settings
+        self.log_queue_size = self.config.getint("logging", "queue_size", fallback=10000)
+        self.log_overflow = self.config.get("logging", "overflow", fallback="drop")
+        if self.log_overflow not in ("drop", "block"):
+            raise ValueError(f"Unknown logging overflow policy: {self.log_overflow}")
+        self.log_batch_size = self.config.getint("logging", "batch_size", fallback=256)
+        self.log_flush_interval = self.config.getfloat("logging", "flush_interval", fallback=1.0)
+        self.log_rotate = self.config.get("logging", "rotate", fallback="none")
+        if self.log_rotate not in ("none", "size", "time"):
+            raise ValueError(f"Unknown logging rotate mode: {self.log_rotate}")
+        self.log_max_bytes = self.config.getint("logging", "max_bytes", fallback=10 * 1024 * 1024)
+        self.log_rotate_interval = self.config.getfloat("logging", "rotate_interval", fallback=86400)
+        self.log_backup_count = self.config.getint("logging", "backup_count", fallback=5)
+
         # Profile settings
         self.resolution = self.config.get("Profile", "resolution")
         self.bitrate = self.config.get("Profile", "bitrate")
@@ -38,16 +90,138 @@ class Config:
         for entry in input_device_entries:
             if ":" in entry:
                 device, output = entry.split(":", 1)
+                # Необязательная секция [device:<имя>] переопределяет лестницу профилей камеры
+                section = f"device:{device}"
                 self.device_configs[device] = DeviceConfig(
                     device_name=device,
                     output_destination=output,
-                    resolution=self.resolution,
-                    bitrate=self.bitrate,
-                    fps=self.fps
+                    resolution=self.config.get(section, "resolution", fallback=self.resolution),
+                    bitrate=self.config.get(section, "bitrate", fallback=self.bitrate),
+                    fps=self.config.get(section, "fps", fallback=self.fps),
+                    degradation_steps=self.config.getint(section, "degradation_steps", fallback=self.degradation_steps),
+                    priority=self.config.getint(section, "priority", fallback=0),
+                    weight=self.config.getfloat(section, "weight", fallback=1.0),
                 )
         
+        # Policy settings
+        self.policy_filter = self.config.get("policy", "filter", fallback="none")
+        if self.policy_filter not in ("none", "ewma", "median"):
+            raise ValueError(f"Unknown policy filter: {self.policy_filter}")
+        self.policy_ewma_alpha = self.config.getfloat("policy", "ewma_alpha", fallback=0.3)
+        self.policy_median_window = self.config.getint("policy", "median_window", fallback=5)
+        self.policy_snr_step = self.config.getfloat("policy", "snr_step", fallback=10)
+        self.policy_hysteresis_up = self.config.getfloat("policy", "hysteresis_up", fallback=0)
+        self.policy_hysteresis_down = self.config.getfloat("policy", "hysteresis_down", fallback=0)
+        self.policy_min_dwell_up = self.config.getfloat("policy", "min_dwell_up", fallback=0)
+        self.policy_allocation = self.config.get("policy", "allocation", fallback="uniform")
+        if self.policy_allocation not in ("uniform", "budget"):
+            raise ValueError(f"Unknown policy allocation: {self.policy_allocation}")
+        self.policy_goodput_ratio = self.config.getfloat("policy", "goodput_ratio", fallback=0.5)
+        self.policy_budget_headroom = self.config.getfloat("policy", "budget_headroom", fallback=0.8)
+        # Ступень, на которой энкодеры стартуют до первого замера сигнала (-1 — самая нижняя)
+        self.policy_startup_index = self.config.getint("policy", "startup_index", fallback=-1)
+        self.policy_profile_input = self.config.get("policy", "profile_input", fallback="snr")
+        if self.policy_profile_input not in ("snr", "throughput"):
+            raise ValueError(f"Unknown policy profile_input: {self.policy_profile_input}")
+        self.policy_throughput_alpha = self.config.getfloat("policy", "throughput_alpha", fallback=0.3)
+        self.policy_throughput_min_confidence = self.config.getfloat(
+            "policy", "throughput_min_confidence", fallback=0.5
+        )
+        self.policy_throughput_hysteresis = self.config.getfloat("policy", "throughput_hysteresis", fallback=0.2)
+        self.policy_predictive = self.config.getboolean("policy", "predictive", fallback=False)
+        self.policy_predict_window = self.config.getint("policy", "predict_window", fallback=5)
+        self.policy_predict_horizon = self.config.getfloat("policy", "predict_horizon", fallback=3)
+        self.policy_predict_min_slope = self.config.getfloat("policy", "predict_min_slope", fallback=0.5)
+
+        # Telemetry settings
+        self.telemetry_capacity = self.config.getint("telemetry", "capacity", fallback=86400)
+        self.telemetry_path = self.config.get("telemetry", "path", fallback="") or None
+
+        # Metrics endpoint
+        self.metrics_enabled = self.config.getboolean("metrics", "enabled", fallback=False)
+        self.metrics_host = self.config.get("metrics", "host", fallback="127.0.0.1")
+        self.metrics_port = self.config.getint("metrics", "port", fallback=9108)
+
+        # FFMPEG settings
+        self.ffmpeg_restart_mode = self.config.get("ffmpeg", "restart_mode", fallback="sequential")
+        if self.ffmpeg_restart_mode not in ("sequential", "parallel"):
+            raise ValueError(f"Unknown ffmpeg restart_mode: {self.ffmpeg_restart_mode}")
+        self.ffmpeg_restart_concurrency = self.config.getint("ffmpeg", "restart_concurrency", fallback=5)
+        self.ffmpeg_stop_timeout = self.config.getfloat("ffmpeg", "stop_timeout", fallback=2)
+        self.ffmpeg_transition_mode = self.config.get("ffmpeg", "transition_mode", fallback="restart")
+        if self.ffmpeg_transition_mode not in ("restart", "make_before_break"):
+            raise ValueError(f"Unknown ffmpeg transition_mode: {self.ffmpeg_transition_mode}")
+        self.ffmpeg_first_frame_timeout = self.config.getfloat("ffmpeg", "first_frame_timeout", fallback=5)
+        self.ffmpeg_encoder_mode = self.config.get("ffmpeg", "encoder_mode", fallback="restart")
+        if self.ffmpeg_encoder_mode not in ("restart", "live"):
+            raise ValueError(f"Unknown ffmpeg encoder_mode: {self.ffmpeg_encoder_mode}")
+        self.ffmpeg_live_params = [
+            param.strip()
+            for param in self.config.get("ffmpeg", "live_params", fallback="resolution,fps").split(",")
+            if param.strip()
+        ]
+        self.ffmpeg_live_crf = self.config.getint("ffmpeg", "live_crf", fallback=23)
+        if not 0 <= self.ffmpeg_live_crf <= 51:
+            raise ValueError("ffmpeg live_crf must be in [0, 51]")
+        self.ffmpeg_process_layout = self.config.get("ffmpeg", "process_layout", fallback="per_device")
+        if self.ffmpeg_process_layout not in ("per_device", "single", "groups"):
+            raise ValueError(f"Unknown ffmpeg process_layout: {self.ffmpeg_process_layout}")
+        if self.ffmpeg_encoder_mode == "live" and self.ffmpeg_process_layout != "per_device":
+            # Живая перенастройка есть только у процесса одной камеры
+            raise ValueError("ffmpeg encoder_mode = live requires process_layout = per_device")
+        if self.ffmpeg_encoder_mode == "live" and self.policy_allocation == "budget":
+            # Ступени живых лестниц не отличаются битрейтом, делить бюджет по ним нечем
+            raise ValueError("ffmpeg encoder_mode = live requires policy allocation = uniform")
+        self.ffmpeg_groups = self.config.get("ffmpeg", "groups", fallback="")
+        self.ffmpeg_backoff_initial = self.config.getfloat("ffmpeg", "restart_backoff_initial", fallback=0.5)
+        self.ffmpeg_backoff_max = self.config.getfloat("ffmpeg", "restart_backoff_max", fallback=30)
+        self.ffmpeg_backoff_jitter = self.config.getfloat("ffmpeg", "restart_backoff_jitter", fallback=0.2)
+        self.ffmpeg_degraded_after = self.config.getint("ffmpeg", "degraded_after", fallback=5)
+        self.ffmpeg_stable_after = self.config.getfloat("ffmpeg", "stable_after", fallback=30)
+
+        # Encoder resources: per-process CPU/RSS sampling and tuning of x264 to the host
+        self.resources_interval = self.config.getfloat("resources", "sample_interval", fallback=2)
+        self.resources_tuning = self.config.getboolean("resources", "tuning", fallback=False)
+        self.resources_presets = [
+            preset.strip()
+            for preset in self.config.get("resources", "presets", fallback="ultrafast").split(",")
+            if preset.strip()
+        ]
+        if not self.resources_presets:
+            raise ValueError("resources presets must not be empty")
+        self.resources_threads = self.config.get("resources", "threads", fallback="0").strip()
+        if self.resources_threads != "auto":
+            self.resources_threads = int(self.resources_threads)
+        self.resources_max_threads = self.config.getint("resources", "max_threads", fallback=0)
+        self.resources_max_profile_steps = self.config.getint("resources", "max_profile_steps", fallback=1)
+        self.resources_min_speed = self.config.getfloat("resources", "min_speed", fallback=0.95)
+        self.resources_host_cpu_high = self.config.getfloat("resources", "host_cpu_high", fallback=90)
+        self.resources_host_cpu_low = self.config.getfloat("resources", "host_cpu_low", fallback=60)
+        self.resources_overload_samples = self.config.getint("resources", "overload_samples", fallback=3)
+        self.resources_dwell = self.config.getfloat("resources", "dwell", fallback=60)
+
+        # Optional in-process UDP relay between the encoders and their outputs
+        self.relay_enabled = self.config.getboolean("relay", "enabled", fallback=False)
+        self.relay_listen_host = self.config.get("relay", "listen_host", fallback="127.0.0.1")
+        self.relay_base_port = self.config.getint("relay", "base_port", fallback=0)
+        self.relay_rate_kbps = self.config.get("relay", "rate_kbps", fallback="0").strip()
+        if self.relay_rate_kbps != "auto":
+            self.relay_rate_kbps = float(self.relay_rate_kbps)
+        self.relay_min_rate_kbps = self.config.getfloat("relay", "min_rate_kbps", fallback=1000)
+        self.relay_burst_ms = self.config.getfloat("relay", "burst_ms", fallback=10)
+        self.relay_max_delay_ms = self.config.getfloat("relay", "max_delay_ms", fallback=200)
+        self.relay_queue_packets = self.config.getint("relay", "queue_packets", fallback=1024)
+        self.relay_batch = self.config.getint("relay", "batch", fallback=64)
+        if self.relay_queue_packets < 1 or self.relay_batch < 1:
+            raise ValueError("relay queue_packets and batch must be positive")
+
         self.ping_ip = self.config.get("connection_check", "ping_ip")
         self.curl_url = self.config.get("connection_check", "curl_url")
+        self.connection_check_tcp_port = self.config.getint("connection_check", "tcp_port", fallback=53)
+        self.connection_check_timeout = self.config.getfloat("connection_check", "timeout", fallback=2)
+        self.connection_rtt_congestion_factor = self.config.getfloat(
+            "connection_check", "rtt_congestion_factor", fallback=3
+        )
     
     def get_device_configs(self):
         return self.device_configs
@@ -1,5 +1,9 @@
-import subprocess
-import shlex
+import http.client
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
 
 from .config import Config
 
@@ -11,14 +15,70 @@ logger = get_logger(__name__, logType=LogType.CONSOLE, handler=GenericTextLogHan
 
 from ipaddress import AddressValueError, ip_address
 
+# Так проявляется соединение из пула, которое сервер уже закрыл по keep-alive таймауту
+_STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+
+
+class ProbeResult:
+    """Результат одной проверки: успех, время ответа в секундах и текст ошибки"""
+
+    __slots__ = ("name", "ok", "latency", "error")
+
+    def __init__(self, name: str, ok: bool, latency: float = None, error: str = None):
+        self.name = name
+        self.ok = ok
+        self.latency = latency
+        self.error = error
+
+    def __repr__(self) -> str:
+        if self.ok:
+            return f"{self.name}: ok, {self.latency * 1000:.1f} мс"
+        return f"{self.name}: ошибка ({self.error})"
+
+
+class ConnectionCheckResult:
+    """Результаты всех проверок одного запуска. Истинен, если все проверки прошли."""
+
+    def __init__(self, probes: dict, checked_at: float):
+        self.probes = probes
+        self.checked_at = checked_at
+
+    @property
+    def ok(self) -> bool:
+        return all(probe.ok for probe in self.probes.values())
+
+    @property
+    def rtt(self) -> float:
+        """Время установления TCP-соединения — ближайшая к RTT величина без raw-сокетов"""
+        probe = self.probes.get("tcp")
+        return probe.latency if probe is not None and probe.ok else None
+
+    def __bool__(self) -> bool:
+        return self.ok
+
+    def __repr__(self) -> str:
+        return ", ".join(repr(probe) for probe in self.probes.values())
+
 
 class ConnectionChecker:
+    """
+    Проверки доступности сети без запуска внешних процессов.
+
+    tcp — установление TCP-соединения с ping_ip:tcp_port (ICMP без прав root недоступен),
+    http — запрос HEAD к curl_url через постоянное соединение http.client.
+    Проверки выполняются параллельно, у каждой свой таймаут.
+    """
+
     def __init__(self, config: Config = None):
         self.ip_address = None
         self.url = None
+        self.tcp_port = 53
+        self.timeout = 2.0
         if config:
             self.ip_address = config.ping_ip
             self.url = config.curl_url
+            self.tcp_port = config.connection_check_tcp_port
+            self.timeout = config.connection_check_timeout
         else:
             self.ip_address = None
             self.url = None
@@ -26,36 +86,69 @@ class ConnectionChecker:
 
         try:
             self.ip_address = ip_address(self.ip_address)
-        except AddressValueError:
+        except (AddressValueError, ValueError):
             logger.error(f"Некорректный IP адрес: {self.ip_address}")
             raise ValueError("Некорректный IP адрес")
 
-    def check_ping(self):
+        self._http = None
+        self._http_lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="connection-check")
+        self.last_result = None
+
+    def check_tcp(self) -> ProbeResult:
+        started_at = time.perf_counter()
         try:
-            cmd = f"ping -c 3 -W 2 {self.ip_address}"
-            result = subprocess.run(shlex.split(cmd), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            return result.returncode == 0
-        except Exception as e:
-            logger.error(f"Проверка ping не удалась: {e}")
-            return False
-
-    def check_curl(self) -> bool:
+            with socket.create_connection((str(self.ip_address), self.tcp_port), timeout=self.timeout):
+                pass
+        except OSError as e:
+            return ProbeResult("tcp", False, error=str(e) or type(e).__name__)
+        return ProbeResult("tcp", True, time.perf_counter() - started_at)
+
+    def _http_connection(self, url):
+        if self._http is None:
+            connection_class = http.client.HTTPSConnection if url.scheme == "https" else http.client.HTTPConnection
+            self._http = connection_class(url.hostname, url.port, timeout=self.timeout)
+        return self._http
+
+    def check_http(self) -> ProbeResult:
         if not self.url:
-            logger.error("Некорректный URL для проверки curl")
-            return False
-        try:
-            cmd = f"curl -s -I --connect-timeout 3 {self.url}"
-            result = subprocess.run(shlex.split(cmd), stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-            if result.returncode == 0:
-                for line in result.stdout.splitlines():
-                    if line.startswith("HTTP/"):
-                        status_part = line.split(" ")[1]
-                        status_code = int(status_part)
-                        return 200 <= status_code < 400
-            return False
-        except Exception as e:
-            logger.error(f"Проверка curl не удалась: {e}")
-            return False
-
-    def check_all(self) -> dict[str, bool]:
-        return {self.check_ping() & self.check_curl()}
+            return ProbeResult("http", False, error="не задан URL")
+        url = urlsplit(self.url if "://" in self.url else f"http://{self.url}")
+        path = url.path or "/"
+        if url.query:
+            path = f"{path}?{url.query}"
+        with self._http_lock:
+            # Если сервер закрыл соединение из пула, повторяем один раз на новом
+            for attempt in range(2):
+                connection = self._http_connection(url)
+                started_at = time.perf_counter()
+                try:
+                    connection.request("HEAD", path)
+                    response = connection.getresponse()
+                    response.read()
+                except (OSError, http.client.HTTPException) as e:
+                    connection.close()
+                    self._http = None
+                    if attempt == 0 and isinstance(e, _STALE_CONNECTION_ERRORS):
+                        continue
+                    return ProbeResult("http", False, error=str(e) or type(e).__name__)
+                latency = time.perf_counter() - started_at
+                if response.will_close:
+                    connection.close()
+                    self._http = None
+                if 200 <= response.status < 400:
+                    return ProbeResult("http", True, latency)
+                return ProbeResult("http", False, latency, error=f"HTTP {response.status}")
+
+    def check_all(self) -> ConnectionCheckResult:
+        futures = {"tcp": self._pool.submit(self.check_tcp), "http": self._pool.submit(self.check_http)}
+        result = ConnectionCheckResult({name: future.result() for name, future in futures.items()}, time.monotonic())
+        self.last_result = result
+        return result
+
+    def close(self):
+        self._pool.shutdown(wait=False)
+        with self._http_lock:
+            if self._http is not None:
+                self._http.close()
+                self._http = None
@@ -1,6 +1,16 @@
+import os
+import random
 import subprocess
+import shlex
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
+from .bandwidth import parse_kbps
 from .config import Config, DeviceConfig
+from .metrics import Histogram, SWITCH_BUCKETS
+from .udp_relay import UDPRelay
 
 from .logger import get_logger
 from .logger import LogType
@@ -8,78 +18,1006 @@ from .logger import GenericTextLogHandler
 
 logger = get_logger(__name__, filename="ffmpeg_log.csv", logType=LogType.BOTH, handler=GenericTextLogHandler)
 
+class EncoderProgress:
+    """Последнее состояние энкодера по данным ffmpeg -progress"""
+
+    def __init__(self):
+        self.frame = 0
+        self.fps = 0.0
+        self.bitrate_kbps = 0.0
+        self.total_size = 0
+        self.out_time = 0.0
+        self.speed = 0.0
+        self.dup_frames = 0
+        self.drop_frames = 0
+        self.updated_at = None
+        self.ended = False
+
+    def update(self, fields: dict[bytes, bytes]):
+        self.frame = _to_int(fields.get(b"frame"), self.frame)
+        self.fps = _to_float(fields.get(b"fps"), self.fps)
+        self.bitrate_kbps = _to_float(fields.get(b"bitrate", b"").removesuffix(b"kbits/s"), self.bitrate_kbps)
+        self.total_size = _to_int(fields.get(b"total_size"), self.total_size)
+        self.out_time = _to_int(fields.get(b"out_time_us"), int(self.out_time * 1_000_000)) / 1_000_000
+        self.speed = _to_float(fields.get(b"speed", b"").removesuffix(b"x"), self.speed)
+        self.dup_frames = _to_int(fields.get(b"dup_frames"), self.dup_frames)
+        self.drop_frames = _to_int(fields.get(b"drop_frames"), self.drop_frames)
+        self.ended = fields.get(b"progress") == b"end"
+        self.updated_at = time.monotonic()
+
+    def as_dict(self) -> dict:
+        return {
+            "frame": self.frame,
+            "fps": self.fps,
+            "bitrate_kbps": self.bitrate_kbps,
+            "total_size": self.total_size,
+            "out_time": self.out_time,
+            "speed": self.speed,
+            "dup_frames": self.dup_frames,
+            "drop_frames": self.drop_frames,
+            "ended": self.ended,
+        }
+
+
+def _to_int(value, default):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _to_float(value, default):
+    # ffmpeg пишет N/A, пока значение неизвестно
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+class EncoderWatcher:
+    """
+    Читает stdout (-progress) и stderr процесса ffmpeg в фоновых потоках.
+    Пайпы не переполняются, состояние энкодера доступно в progress,
+    а момент первого закодированного кадра отмечается в first_frame.
+    """
+
+    def __init__(self, process: subprocess.Popen, device_name: str, on_first_frame=None, tail_lines: int = 20):
+        self.process = process
+        self.device_name = device_name
+        self.progress = EncoderProgress()
+        self.first_frame = threading.Event()
+        self.first_frame_at = None
+        self.tail = deque(maxlen=tail_lines)
+        self.on_first_frame = on_first_frame
+        # Однократный обработчик следующего блока -progress (замер разрыва при живом переключении)
+        self.on_next_progress = None
+        self._threads = [
+            threading.Thread(target=self._read_progress, name=f"ffmpeg-progress-{device_name}", daemon=True),
+            threading.Thread(target=self._read_stderr, name=f"ffmpeg-stderr-{device_name}", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def _read_progress(self):
+        fields = {}
+        for line in self.process.stdout:
+            key, sep, value = line.strip().partition(b"=")
+            if not sep:
+                continue
+            fields[key] = value.strip()
+            # Блок -progress всегда заканчивается строкой progress=continue|end
+            if key == b"progress":
+                self.progress.update(fields)
+                fields = {}
+                callback, self.on_next_progress = self.on_next_progress, None
+                if callback is not None:
+                    callback(self)
+                if not self.first_frame.is_set() and self.progress.frame > 0:
+                    self._mark_first_frame()
+
+    def _read_stderr(self):
+        for line in self.process.stderr:
+            line = line.rstrip()
+            if line:
+                self.tail.append(line)
+
+    def _mark_first_frame(self):
+        self.first_frame_at = time.monotonic()
+        self.first_frame.set()
+        if self.on_first_frame is not None:
+            self.on_first_frame(self)
+
+    def wait_first_frame(self, timeout: float = None) -> bool:
+        return self.first_frame.wait(timeout)
+
+    def join(self, timeout: float = None):
+        """Ждёт, пока будут прочитаны последние строки завершённого процесса"""
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def last_output(self) -> str:
+        return b"\n".join(self.tail).decode(errors="replace")
+
+
+class RestartBackoff:
+    """Экспоненциальная задержка перезапуска упавшего энкодера со случайным разбросом"""
+
+    def __init__(self, initial: float = 0.5, maximum: float = 30, jitter: float = 0.2):
+        self.initial = initial
+        self.maximum = maximum
+        self.jitter = jitter
+
+    def delay(self, failures: int) -> float:
+        base = min(self.maximum, self.initial * 2 ** max(0, failures - 1))
+        return base * (1 + random.uniform(-self.jitter, self.jitter))
+
 
 class FFMPEGInstance:
-    def __init__(self, device_config):
+    def __init__(
+        self,
+        device_config,
+        stop_timeout: float = None,
+        transition_mode: str = "restart",
+        first_frame_timeout: float = 5,
+        backoff: RestartBackoff = None,
+        degraded_after: int = 5,
+        stable_after: float = 30,
+        preset: str = "ultrafast",
+        threads: int = 0,
+    ):
         self.device_name = device_config.device_name
         self.output = device_config.output
         self.resolution = device_config.resolution
         self.bitrate = device_config.bitrate
         self.fps = device_config.fps
+        self.stop_timeout = stop_timeout
+        self.transition_mode = transition_mode
+        self.first_frame_timeout = first_frame_timeout
+        self.is_test_source = self.device_name.startswith("testsrc")
+        # v4l2-устройство нельзя открыть дважды, перекрытие процессов возможно только для тестового источника
+        self.supports_overlap = self.is_test_source
         self.process = None
+        self.watcher = None
         self.current_profile = None
+        # Настройки энкодера (пресет x264, потоки; 0 — на усмотрение ffmpeg), меняет EncoderTuner
+        self.preset = preset
+        self.threads = threads
+        self.running_options = None
+        self.switch_count = 0
+        self.last_switch_duration = None
+        self.total_switch_duration = 0.0
+        self.switch_duration = Histogram(SWITCH_BUCKETS)
+        self.last_switch_gap = None
+        self._output_stopped_at = None
+        # Watchdog
+        self.backoff = backoff if backoff is not None else RestartBackoff()
+        self.degraded_after = degraded_after
+        self.stable_after = stable_after
+        self.started_at = None
+        self.crash_count = 0
+        self.crash_restart_count = 0
+        self.consecutive_failures = 0
+        self.next_restart_at = None
+        self.degraded = False
+        self._lock = threading.RLock()
         logger.info(
             f"[FFMPEG] Инициализация устройства {self.device_name} с разрешением: {self.resolution}, "
             f"битрейтом: {self.bitrate}, частотой кадров: {self.fps}, выходом: {self.output}"
         )
         
+    def input_args(self, profile: dict[str, str]) -> str:
+        if self.is_test_source:
+            return f"-f lavfi -i testsrc=rate={profile['fps']}:size={profile['resolution']}"
+        return f"-f v4l2 -framerate {profile['fps']} -video_size {profile['resolution']} -i {self.device_name}"
+
+    def codec_args(self) -> str:
+        threads = f" -threads {self.threads}" if self.threads else ""
+        if self.is_test_source:
+            return f"-vcodec libx264 -preset {self.preset}{threads}"
+        return threads.lstrip()
+
+    def output_args(self, profile: dict[str, str]) -> str:
+        codec = self.codec_args()
+        return f"{codec} -b:v {profile['bitrate']} -f mpegts {self.output}".lstrip()
+
+    @property
+    def device_names(self) -> list[str]:
+        """Камеры, которые кодирует этот процесс"""
+        return [self.device_name]
+
+    @property
+    def uses_preset(self) -> bool:
+        """-preset передаётся только libx264 (тестовый источник), для v4l2 он не влияет на команду"""
+        return self.is_test_source
+
+    @property
+    def encoder_options(self) -> tuple:
+        # Только то, что попадает в команду: иначе смена пресета перезапускала бы v4l2-камеру впустую
+        return self.preset if self.uses_preset else None, self.threads
+
+    def set_encoder_options(self, preset: str, threads: int):
+        """Новые настройки вступают в силу при следующем restart_if_needed (нужен перезапуск процесса)"""
+        with self._lock:
+            self.preset = preset
+            self.threads = threads
+
+    def select_profile(self, profiles: dict[str, dict]) -> dict:
+        """Профиль этого процесса из набора профилей по устройствам"""
+        return profiles[self.device_name]
+
     def build_command(self, profile: dict[str, str]) -> str:
-        if self.device_name == "testsrc":
-            return (
-                f"ffmpeg -f lavfi -i testsrc=rate={profile['fps']}:size={profile['resolution']} "
-                f"-vcodec libx264 -preset ultrafast -b:v {profile['bitrate']} -f mpegts {self.output}"
-            )
-        else:
-            return (
-                f"ffmpeg -f v4l2 -framerate {profile['fps']} -video_size {profile['resolution']} "
-                f"-i {self.device_name} -b:v {profile['bitrate']} -f mpegts {self.output}"
-            )
+        return f"ffmpeg -nostats -progress pipe:1 {self.input_args(profile)} {self.output_args(profile)}"
     
-    def start(self, profile):
-        if self.process:
-            self.stop()
+    def _spawn(self, cmd: str, on_first_frame=None):
+        # Без shell: сигналы из stop() должны доходить до самого ffmpeg, а не до /bin/sh
+        process = subprocess.Popen(shlex.split(cmd), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        return process, EncoderWatcher(process, self.device_name, on_first_frame=on_first_frame)
+
+    def start(self, profile) -> bool:
+        with self._lock:
+            return self._start(profile)
+
+    def _start(self, profile) -> bool:
+        """Запускает процесс на профиле; False, если он не запустился или новый процесс не выдал кадр"""
+        options = self.encoder_options
         cmd = self.build_command(profile)
-        self.process = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.next_restart_at = None
+        if self.transition_mode == "make_before_break" and self.process:
+            if self.supports_overlap:
+                return self._start_overlapped(profile, cmd, options)
+            # Устройство не открыть дважды: самая быстрая передача — убить старый процесс без ожидания
+            # корректного завершения и сразу запустить новый с заранее собранной командой.
+            self.stop(force=True)
+        elif self.process:
+            self.stop()
+
+        on_first_frame = self._log_gap if self._output_stopped_at is not None else None
+        self.process, self.watcher = self._spawn(cmd, on_first_frame=on_first_frame)
+        self.started_at = time.monotonic()
+        # Профиль запоминается и при неудачном запуске: по нему watchdog повторит попытку
+        self.current_profile = profile
+        self.running_options = options
         if self.process.poll() is not None:
-            logger.error(f"[FFMPEG] Ошибка запуска процесса для {self.device_name}: {self.process.stderr.read().decode()}")
-            return
+            logger.error(f"[FFMPEG] Ошибка запуска процесса для {self.device_name} с командой: {cmd}")
+            self._on_crash(self.started_at)
+            return False
         logger.info(f"[FFMPEG] Процесс запущен для {self.device_name} с командой: {cmd}")
+        return True
+
+    def _start_overlapped(self, profile, cmd: str, options: tuple) -> bool:
+        """Make-before-break: старый энкодер работает, пока новый не выдаст первый кадр"""
+        process, watcher = self._spawn(cmd)
+        logger.info(f"[FFMPEG] Процесс запущен для {self.device_name} с командой: {cmd}, ожидание первого кадра")
+        if not watcher.wait_first_frame(self.first_frame_timeout):
+            logger.error(
+                f"[FFMPEG] Новый процесс для {self.device_name} не выдал кадр за {self.first_frame_timeout} с, "
+                f"остаёмся на профиле {self.current_profile}: {watcher.last_output()}"
+            )
+            self._terminate(process)
+            return False
+        old_process, old_watcher = self.process, self.watcher
+        self.process, self.watcher = process, watcher
+        self.started_at = time.monotonic()
         self.current_profile = profile
-        
-    def stop(self):
-        if self.process:
-            logger.info(f"[FFMPEG] Остановка процесса для {self.device_name}")
-            self.process.terminate()
-            self.process.wait()
-            self.process = None
+        self.running_options = options
+        self._terminate(old_process)
+        # Разрыв — от последнего блока -progress старого процесса (при SIGTERM ffmpeg пишет
+        # завершающий) до первого кадра нового; отрицательное значение — потоки перекрывались
+        old_watcher.join(self.stop_timeout)
+        last_output_at = old_watcher.progress.updated_at
+        if last_output_at is None:
+            self.last_switch_gap = None
+            logger.info(f"[FFMPEG] Переключение для {self.device_name}: старый процесс не выдавал кадров")
+            return True
+        gap = watcher.first_frame_at - last_output_at
+        self.last_switch_gap = max(0.0, gap)
+        if gap < 0:
+            logger.info(f"[FFMPEG] Бесшовное переключение для {self.device_name}, перекрытие потоков: {-gap:.3f} с")
+        else:
+            logger.info(f"[FFMPEG] Переключение для {self.device_name}, разрыв потока: {gap:.3f} с")
+        return True
+
+    def _log_gap(self, watcher: EncoderWatcher):
+        self.last_switch_gap = watcher.first_frame_at - self._output_stopped_at
+        self._output_stopped_at = None
+        logger.info(f"[FFMPEG] Первый кадр для {self.device_name}, разрыв потока: {self.last_switch_gap:.3f} с")
+
+    def _terminate(self, process: subprocess.Popen, force: bool = False):
+        if force:
+            process.kill()
+        else:
+            process.terminate()
+        try:
+            process.wait(timeout=self.stop_timeout)
+        except subprocess.TimeoutExpired:
+            logger.warning(
+                f"[FFMPEG] Процесс для {self.device_name} не завершился за {self.stop_timeout} с, отправляем SIGKILL"
+            )
+            process.kill()
+            process.wait()
+
+    def stop(self, force: bool = False):
+        with self._lock:
+            self.next_restart_at = None
+            if self.process:
+                logger.info(f"[FFMPEG] Остановка процесса для {self.device_name}")
+                self._terminate(self.process, force=force)
+                self._output_stopped_at = time.monotonic()
+                self.process = None
     
-    def restart_if_needed(self, new_profile):
-        if new_profile != self.current_profile:
-            logger.info(f"[FFMPEG] Профиль изменился для {self.device_name}: {self.current_profile} → {new_profile}")
-            self.start(new_profile)
+    def restart_if_needed(self, new_profile) -> bool:
+        if new_profile != self.current_profile or (
+            self.running_options is not None and self.encoder_options != self.running_options
+        ):
+            if new_profile != self.current_profile:
+                logger.info(
+                    f"[FFMPEG] Профиль изменился для {self.device_name}: {self.current_profile} → {new_profile}"
+                )
+            else:
+                logger.info(
+                    f"[FFMPEG] Настройки энкодера изменились для {self.device_name}: "
+                    f"{self.running_options} → {self.encoder_options}"
+                )
+            started_at = time.monotonic()
+            if not self.start(new_profile):
+                return False
+            self.last_switch_duration = time.monotonic() - started_at
+            self.total_switch_duration += self.last_switch_duration
+            self.switch_duration.observe(self.last_switch_duration)
+            self.switch_count += 1
+            logger.info(
+                f"[FFMPEG] Переключение профиля для {self.device_name} заняло {self.last_switch_duration:.3f} с"
+            )
+            return True
+        return False
+
+    def is_running(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def watchdog(self, now: float = None):
+        """
+        Обнаруживает неожиданное завершение ffmpeg и перезапускает его на текущем профиле
+        с экспоненциальной задержкой. После degraded_after неудач подряд устройство помечается
+        как деградировавшее, но попытки продолжаются с максимальной задержкой.
+        """
+        # Если идёт переключение профиля, процессом сейчас занимается start()
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            now = time.monotonic() if now is None else now
+            if self.process is not None and self.process.poll() is not None:
+                self._on_crash(now)
+            elif self.is_running() and self.consecutive_failures and now - self.started_at >= self.stable_after:
+                if self.degraded:
+                    logger.info(f"[FFMPEG] Устройство {self.device_name} восстановилось")
+                self.consecutive_failures = 0
+                self.degraded = False
+
+            if self.next_restart_at is not None and now >= self.next_restart_at and self.current_profile:
+                self.crash_restart_count += 1
+                logger.info(
+                    f"[FFMPEG] Перезапуск упавшего процесса для {self.device_name} "
+                    f"(попытка {self.consecutive_failures}) на профиле {self.current_profile}"
+                )
+                self._start(self.current_profile)
+        finally:
+            self._lock.release()
+
+    def _on_crash(self, now: float, count_failure: bool = True):
+        uptime = now - self.started_at if self.started_at is not None else 0.0
+        logger.error(
+            f"[FFMPEG] Процесс для {self.device_name} завершился с кодом {self.process.returncode} "
+            f"после {uptime:.1f} с работы: {self.watcher.last_output() if self.watcher else ''}"
+        )
+        self.process = None
+        self._output_stopped_at = now
+        self.crash_count += 1
+        if count_failure:
+            # Долго проработавший процесс считаем здоровым: счётчик неудач начинается заново
+            self.consecutive_failures = 1 if uptime >= self.stable_after else self.consecutive_failures + 1
+        if self.consecutive_failures >= self.degraded_after and not self.degraded:
+            self.degraded = True
+            logger.error(
+                f"[FFMPEG] Устройство {self.device_name} помечено как деградировавшее после "
+                f"{self.consecutive_failures} неудачных запусков подряд"
+            )
+        delay = self.backoff.delay(self.consecutive_failures)
+        self.next_restart_at = now + delay
+        logger.info(f"[FFMPEG] Следующий запуск для {self.device_name} через {delay:.2f} с")
+
+    @property
+    def degraded_members(self) -> list[str]:
+        """Камеры этого процесса, помеченные как деградировавшие"""
+        return [self.device_name] if self.degraded else []
+
+    @property
+    def progress(self) -> EncoderProgress:
+        return self.watcher.progress if self.watcher is not None else None
+
+
+_filter_commands = None
+_filter_commands_lock = threading.Lock()
+
+
+def filter_command_support() -> set[str]:
+    """Фильтры установленного ffmpeg, принимающие команды во время работы (флаг C в ffmpeg -filters)"""
+    global _filter_commands
+    with _filter_commands_lock:
+        if _filter_commands is None:
+            _filter_commands = set()
+            try:
+                result = subprocess.run(
+                    ["ffmpeg", "-hide_banner", "-filters"], capture_output=True, text=True, timeout=10
+                )
+                for line in result.stdout.splitlines():
+                    parts = line.split()
+                    if len(parts) >= 2 and len(parts[0]) == 3 and set(parts[0]) <= set("TSC.") and parts[0][2] == "C":
+                        _filter_commands.add(parts[1])
+            except (OSError, subprocess.SubprocessError) as e:
+                logger.error(f"[FFMPEG] Не удалось определить поддержку команд фильтров: {e}")
+        return _filter_commands
+
+
+class LiveFFMPEGInstance(FFMPEGInstance):
+    """
+    Долгоживущий процесс ffmpeg, параметры которого меняются без перезапуска.
+
+    Разрешение и частота кадров задаются именованными фильтрами scale@live и fps@live,
+    команды им передаются через stdin (интерактивная команда ffmpeg "c").
+    После scale@live кадр масштабируется обратно до размера, с которым был запущен
+    энкодер, поэтому энкодер и GOP не пересоздаются. CLI ffmpeg не умеет перенастраивать
+    битрейт энкодера на лету, поэтому процесс кодирует libx264 с постоянным качеством (crf),
+    а битрейт ступени служит потолком (-maxrate): меньшие и более редкие кадры обходятся
+    дешевле без смены битрейта. Лестницы в этом режиме меняют только параметры из
+    live_params (см. live_params_supported), битрейт на всех ступенях одинаков.
+    Полный перезапуск нужен, если меняется параметр вне live_params (например, битрейт
+    после перезагрузки конфигурации), разрешение или fps превышают стартовые либо
+    меняются настройки энкодера.
+    """
+
+    LIVE_FILTERS = {"resolution": "scale", "fps": "fps"}
+
+    def __init__(self, device_config, live_params=("resolution", "fps"), crf: int = 23, **kwargs):
+        super().__init__(device_config, **kwargs)
+        self.live_params = live_params_supported(live_params)
+        self.crf = crf
+        self.spawn_profile = None
+        self.live_switch_count = 0
+        logger.info(
+            f"[FFMPEG] {self.device_name}: параметры, меняемые без перезапуска: {sorted(self.live_params) or 'нет'}"
+        )
+
+    @property
+    def uses_preset(self) -> bool:
+        return True
+
+    def codec_args(self) -> str:
+        threads = f" -threads {self.threads}" if self.threads else ""
+        return f"-vcodec libx264 -preset {self.preset}{threads} -crf {self.crf}"
+
+    def output_args(self, profile: dict[str, str]) -> str:
+        bufsize = f"{parse_kbps(profile['bitrate']) * 2:.0f}k"
+        return f"{self.codec_args()} -maxrate {profile['bitrate']} -bufsize {bufsize} -f mpegts {self.output}"
+
+    def build_command(self, profile: dict[str, str]) -> str:
+        width, height = profile["resolution"].split("x")
+        filters = f"fps@live=fps={profile['fps']},scale@live=w={width}:h={height},scale@canvas=w={width}:h={height}"
+        if self.is_test_source:
+            return (
+                f"ffmpeg -nostats -progress pipe:1 -f lavfi -i testsrc=rate={profile['fps']}:size={profile['resolution']} "
+                f"-vf {filters} {self.output_args(profile)}"
+            )
+        return (
+            f"ffmpeg -nostats -progress pipe:1 -f v4l2 -framerate {profile['fps']} -video_size {profile['resolution']} "
+            f"-i {self.device_name} -vf {filters} {self.output_args(profile)}"
+        )
+
+    def _spawn(self, cmd: str, on_first_frame=None):
+        # stdin служит каналом команд для фильтров
+        process = subprocess.Popen(
+            shlex.split(cmd), stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        return process, EncoderWatcher(process, self.device_name, on_first_frame=on_first_frame)
+
+    def _start(self, profile) -> bool:
+        started = super()._start(profile)
+        if started:
+            self.spawn_profile = profile
+        return started
+
+    def can_apply_live(self, new_profile) -> bool:
+        if not self.is_running() or self.current_profile is None or self.spawn_profile is None:
+            return False
+        if self.encoder_options != self.running_options:
+            return False
+        changed = {key for key, value in new_profile.items() if self.current_profile.get(key) != value}
+        if not changed or not changed <= self.live_params:
+            return False
+        width, height = (int(v) for v in new_profile["resolution"].split("x"))
+        canvas_width, canvas_height = (int(v) for v in self.spawn_profile["resolution"].split("x"))
+        if width > canvas_width or height > canvas_height:
+            return False
+        return float(new_profile["fps"]) <= float(self.spawn_profile["fps"])
+
+    def _send_command(self, target: str, command: str, argument: str):
+        self.process.stdin.write(f"c{target} -1 {command} {argument}\n".encode())
+        self.process.stdin.flush()
+
+    def apply_live(self, new_profile):
+        if new_profile["resolution"] != self.current_profile["resolution"]:
+            width, height = new_profile["resolution"].split("x")
+            self._send_command("scale@live", "w", width)
+            self._send_command("scale@live", "h", height)
+        if new_profile["fps"] != self.current_profile["fps"]:
+            self._send_command("fps@live", "fps", new_profile["fps"])
+        self.current_profile = new_profile
+
+    def _measure_live_gap(self):
+        """
+        Разрыв при живом переключении — медиавремя, потерянное между последним блоком -progress
+        до команды и первым после неё: прошедшее время минус прирост out_time.
+        """
+        before = self.watcher.progress
+        before_at, before_out_time = before.updated_at, before.out_time
+        self.last_switch_gap = None
+        if before_at is None:
+            return
+
+        def measure(watcher: EncoderWatcher):
+            progress = watcher.progress
+            gap = (progress.updated_at - before_at) - (progress.out_time - before_out_time)
+            self.last_switch_gap = max(0.0, gap)
+            logger.info(
+                f"[FFMPEG] Живое переключение для {self.device_name}, разрыв потока: {self.last_switch_gap:.3f} с"
+            )
+
+        self.watcher.on_next_progress = measure
+
+    def restart_if_needed(self, new_profile) -> bool:
+        with self._lock:
+            if new_profile != self.current_profile and self.can_apply_live(new_profile):
+                started_at = time.monotonic()
+                try:
+                    self.apply_live(new_profile)
+                except OSError as e:
+                    logger.error(f"[FFMPEG] Не удалось передать команду для {self.device_name}: {e}")
+                else:
+                    self.last_switch_duration = time.monotonic() - started_at
+                    self.total_switch_duration += self.last_switch_duration
+                    self.switch_duration.observe(self.last_switch_duration)
+                    self.switch_count += 1
+                    self.live_switch_count += 1
+                    self._measure_live_gap()
+                    logger.info(
+                        f"[FFMPEG] Профиль для {self.device_name} изменён без перезапуска: {new_profile}"
+                    )
+                    return True
+        return super().restart_if_needed(new_profile)
+
+
+def live_params_supported(live_params) -> set[str]:
+    """Параметры профиля из live_params, которые установленный ffmpeg может менять на лету"""
+    supported = filter_command_support()
+    return {param for param in live_params if LiveFFMPEGInstance.LIVE_FILTERS.get(param) in supported}
+
+
+_ERROR_MARKERS = ("error", "failed", "no such", "invalid", "cannot", "unable")
+
+
+class FFMPEGGroupInstance(FFMPEGInstance):
+    """
+    Один процесс ffmpeg на несколько камер: граф с несколькими входами и выходами.
+
+    Ошибки в stderr сопоставляются с камерами по префиксам in#N/out#N, пути устройства
+    и адресу выхода. Если процесс упал из-за конкретных камер, при перезапуске watchdog'ом
+    они исключаются из графа, чтобы остальные продолжали вещание. Исключённая камера
+    возвращается в граф по собственной экспоненциальной задержке (watchdog перезапускает
+    группу в полном составе) или при следующей смене профиля; после degraded_after
+    неудач подряд камера считается деградировавшей.
+
+    Блок -progress у процесса один, и total_size с bitrate в нём ffmpeg считает только
+    по первому выходу. Поэтому прогресс, метрики энкодера и битрейт в телеметрии есть
+    только по процессу под именем группы ("a+b"); раздельных рядов по камерам в раскладках
+    single и groups нет.
+    """
+
+    def __init__(self, device_configs: list, **kwargs):
+        backoff = kwargs.get("backoff") or RestartBackoff()
+        # Участники не запускаются сами, но хранят счётчики неудач и задержку возврата своей камеры
+        self.members = [
+            FFMPEGInstance(
+                device_config,
+                preset=kwargs.get("preset", "ultrafast"),
+                threads=kwargs.get("threads", 0),
+                backoff=RestartBackoff(backoff.initial, backoff.maximum, backoff.jitter),
+                degraded_after=kwargs.get("degraded_after", 5),
+                stable_after=kwargs.get("stable_after", 30),
+            )
+            for device_config in device_configs
+        ]
+        group_config = DeviceConfig(
+            "+".join(member.device_name for member in self.members),
+            ",".join(member.output for member in self.members),
+            device_configs[0].resolution,
+            device_configs[0].bitrate,
+            device_configs[0].fps,
+        )
+        super().__init__(group_config, **kwargs)
+        self.is_test_source = all(member.is_test_source for member in self.members)
+        self.supports_overlap = self.is_test_source
+        self.failed_members = set()
+        self.member_failures = {member.device_name: 0 for member in self.members}
+
+    @property
+    def device_names(self) -> list[str]:
+        return [member.device_name for member in self.members]
+
+    @property
+    def uses_preset(self) -> bool:
+        # Кодек выбирается для каждой камеры отдельно (member.output_args)
+        return any(member.uses_preset for member in self.members)
+
+    def set_encoder_options(self, preset: str, threads: int):
+        with self._lock:
+            super().set_encoder_options(preset, threads)
+            for member in self.members:
+                member.set_encoder_options(preset, threads)
+
+    @property
+    def active_members(self) -> list:
+        members = [member for member in self.members if member.device_name not in self.failed_members]
+        return members or self.members
+
+    def select_profile(self, profiles: dict[str, dict]) -> dict:
+        # Профили камер группы по имени; build_command берёт из него профиль каждой камеры
+        return {member.device_name: profiles[member.device_name] for member in self.members}
+
+    def build_command(self, profile: dict[str, str]) -> str:
+        members = self.active_members
+        profiles = [profile.get(member.device_name, profile) for member in members]
+        inputs = " ".join(member.input_args(member_profile) for member, member_profile in zip(members, profiles))
+        outputs = " ".join(
+            f"-map {index}:v {member.output_args(member_profile)}"
+            for index, (member, member_profile) in enumerate(zip(members, profiles))
+        )
+        return f"ffmpeg -nostats -progress pipe:1 {inputs} {outputs}"
+
+    def start(self, profile) -> bool:
+        with self._lock:
+            self.failed_members.clear()
+            return self._start(profile)
+
+    def _attribute_failure(self) -> set:
+        members = self.active_members
+        failed = set()
+        for raw_line in self.watcher.tail if self.watcher else ():
+            line = raw_line.decode(errors="replace")
+            if not any(marker in line.lower() for marker in _ERROR_MARKERS):
+                continue
+            for index, member in enumerate(members):
+                if (
+                    f"in#{index}/" in line
+                    or f"out#{index}/" in line
+                    or (not member.is_test_source and member.device_name in line)
+                    or member.output in line
+                ):
+                    failed.add(member.device_name)
+        return failed
+
+    @property
+    def degraded_members(self) -> list[str]:
+        if self.degraded:
+            return self.device_names
+        return [member.device_name for member in self.members if member.degraded]
+
+    def _on_crash(self, now: float):
+        failed = self._attribute_failure()
+        uptime = now - self.started_at if self.started_at is not None else 0.0
+        for member in self.members:
+            if member.device_name not in failed:
+                continue
+            self.member_failures[member.device_name] += 1
+            member.crash_count += 1
+            member.consecutive_failures = 1 if uptime >= member.stable_after else member.consecutive_failures + 1
+            logger.error(f"[FFMPEG] Сбой камеры {member.device_name} в группе {self.device_name}")
+            if member.consecutive_failures >= member.degraded_after and not member.degraded:
+                member.degraded = True
+                logger.error(
+                    f"[FFMPEG] Камера {member.device_name} помечена как деградировавшая после "
+                    f"{member.consecutive_failures} неудачных запусков подряд"
+                )
+        # Сбой только части камер — неудача этих камер, а не процесса: остальные перезапускаются сразу
+        partial = bool(failed) and len(failed) < len(self.active_members)
+        if partial:
+            self.failed_members |= failed
+            for member in self.members:
+                if member.device_name in failed:
+                    member.next_restart_at = now + member.backoff.delay(member.consecutive_failures)
+            logger.info(
+                f"[FFMPEG] Группа {self.device_name} будет перезапущена без камер: {sorted(self.failed_members)}"
+            )
+        super()._on_crash(now, count_failure=not partial)
+
+    def watchdog(self, now: float = None):
+        now = time.monotonic() if now is None else now
+        super().watchdog(now)
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            if not self.is_running():
+                return
+            # Камеры, проработавшие в графе stable_after секунд, снова считаются здоровыми
+            if now - self.started_at >= self.stable_after:
+                for member in self.active_members:
+                    if member.consecutive_failures:
+                        if member.degraded:
+                            logger.info(f"[FFMPEG] Камера {member.device_name} восстановилась")
+                        member.consecutive_failures = 0
+                        member.degraded = False
+            due = [
+                member
+                for member in self.members
+                if member.device_name in self.failed_members
+                and member.next_restart_at is not None
+                and now >= member.next_restart_at
+            ]
+            if not due or not self.current_profile:
+                return
+            for member in due:
+                member.next_restart_at = None
+                member.crash_restart_count += 1
+            self.failed_members -= {member.device_name for member in due}
+            logger.info(
+                f"[FFMPEG] Возврат камер {[member.device_name for member in due]} в группу {self.device_name}"
+            )
+            if not self._start(self.current_profile) and self.is_running():
+                # Перекрывающий запуск не удался, старый граф без этих камер продолжает работать
+                self.failed_members |= {member.device_name for member in due}
+                for member in due:
+                    member.consecutive_failures += 1
+                    member.next_restart_at = now + member.backoff.delay(member.consecutive_failures)
+        finally:
+            self._lock.release()
+
+
+def parse_groups(layout: str, groups: str, device_names) -> list[list[str]]:
+    """
+    Разбивает устройства на группы процессов.
+    per_device — по процессу на камеру, single — один процесс на все,
+    groups — группы из строки вида "oakd+front_right;rear_right+rear_left", остальные по одной.
+    """
+    device_names = list(device_names)
+    if layout == "single":
+        return [device_names] if device_names else []
+    if layout != "groups":
+        return [[device_name] for device_name in device_names]
+    result = []
+    grouped = set()
+    for group in groups.split(";"):
+        members = [name.strip() for name in group.split("+") if name.strip() in device_names]
+        members = [name for name in members if name not in grouped]
+        if members:
+            result.append(members)
+            grouped.update(members)
+    result.extend([device_name] for device_name in device_names if device_name not in grouped)
+    return result
 
 
 class FFMPEGController:
-    def __init__(self, config: Config):
+    def __init__(self, config: Config, relay: UDPRelay = None):
         self.instances = {}
+        # С ретранслятором энкодеры пишут в его локальные порты, а не на выходы камер
+        self.relay = relay
+        self.restart_mode = config.ffmpeg_restart_mode
+        self.restart_concurrency = config.ffmpeg_restart_concurrency
+        self.last_switch_durations = {}
+        self.last_outage = None
+        self.encoder_mode = config.ffmpeg_encoder_mode
+        self.process_layout = config.ffmpeg_process_layout
+
+        groups = parse_groups(self.process_layout, config.ffmpeg_groups, config.device_configs)
+        self.default_threads = self._default_threads(config, len(config.device_configs))
+        for group in groups:
+            device_configs = self._device_configs(group, config)
+            instance = self._create_instance(device_configs, config)
+            instance.settings_key = self._settings_key(device_configs, config)
+            self.instances[instance.device_name] = instance
         
-        for device_name, device_config in config.device_configs.items():
-            self.instances[device_name] = FFMPEGInstance(device_config)
-        
-        logger.info(f"[FFMPEG] Инициализировано {len(self.instances)} устройств")
+        logger.info(f"[FFMPEG] Инициализировано {len(self.instances)} процессов для {len(config.device_configs)} устройств")
+        logger.info(
+            f"[FFMPEG] Режим перезапуска: {self.restart_mode}, параллельно не более {self.restart_concurrency}, "
+            f"переход между профилями: {config.ffmpeg_transition_mode}, раскладка процессов: {self.process_layout}"
+        )
         logger.info("[FFMPEG] Инициализация завершена")
 
+    def _device_configs(self, group: list[str], config: Config) -> list:
+        device_configs = [config.device_configs[device_name] for device_name in group]
+        if self.relay is None:
+            return device_configs
+        return [self.relay.route(device_config) for device_config in device_configs]
+
+    def _create_instance(self, device_configs: list, config: Config) -> FFMPEGInstance:
+        kwargs = dict(
+            stop_timeout=config.ffmpeg_stop_timeout,
+            transition_mode=config.ffmpeg_transition_mode,
+            first_frame_timeout=config.ffmpeg_first_frame_timeout,
+            backoff=RestartBackoff(
+                initial=config.ffmpeg_backoff_initial,
+                maximum=config.ffmpeg_backoff_max,
+                jitter=config.ffmpeg_backoff_jitter,
+            ),
+            degraded_after=config.ffmpeg_degraded_after,
+            stable_after=config.ffmpeg_stable_after,
+            # Самый дешёвый пресет: EncoderTuner повышает его, если хосту хватает CPU
+            preset=config.resources_presets[-1],
+            threads=self.default_threads,
+        )
+        if len(device_configs) > 1:
+            # Живая перенастройка в общем графе не поддерживается
+            return FFMPEGGroupInstance(device_configs, **kwargs)
+        if self.encoder_mode == "live":
+            return LiveFFMPEGInstance(
+                device_configs[0], live_params=config.ffmpeg_live_params, crf=config.ffmpeg_live_crf, **kwargs
+            )
+        return FFMPEGInstance(device_configs[0], **kwargs)
+
+    @staticmethod
+    def _default_threads(config: Config, encoder_count: int) -> int:
+        """
+        threads = auto: ядра делятся поровну между энкодерами, чтобы они не вытесняли друг друга.
+        Делится по камерам, а не по процессам: в общем процессе у каждой камеры свой энкодер.
+        """
+        if config.resources_threads == "auto":
+            return max(1, (os.cpu_count() or 1) // max(1, encoder_count))
+        return config.resources_threads
+
+    def _settings_key(self, device_configs: list, config: Config) -> tuple:
+        """
+        Всё, с чем процесс был создан, кроме профиля. Профиль сравнивает restart_if_needed,
+        поэтому изменение лестницы камеры перезапускает её при следующем применении политики.
+        """
+        return (
+            tuple((device_config.device_name, device_config.output) for device_config in device_configs),
+            config.ffmpeg_stop_timeout,
+            config.ffmpeg_transition_mode,
+            config.ffmpeg_first_frame_timeout,
+            config.ffmpeg_backoff_initial,
+            config.ffmpeg_backoff_max,
+            config.ffmpeg_backoff_jitter,
+            config.ffmpeg_degraded_after,
+            config.ffmpeg_stable_after,
+            self.encoder_mode,
+            tuple(config.ffmpeg_live_params) if self.encoder_mode == "live" else None,
+            config.ffmpeg_live_crf if self.encoder_mode == "live" else None,
+        )
+
+    def reconcile(self, config: Config) -> dict[str, list[str]]:
+        """
+        Приводит набор процессов к новой конфигурации.
+
+        Процессы, у которых не изменились ни состав камер, ни параметры запуска, продолжают
+        работать без перерыва. Изменившиеся и удалённые останавливаются, новые создаются
+        и запускаются при следующем применении профиля (restart_if_needed / apply_profiles).
+
+        Returns:
+            dict: Имена процессов по спискам kept, added, removed.
+        """
+        self.restart_mode = config.ffmpeg_restart_mode
+        self.restart_concurrency = config.ffmpeg_restart_concurrency
+        self.encoder_mode = config.ffmpeg_encoder_mode
+        self.process_layout = config.ffmpeg_process_layout
+
+        instances = {}
+        added = []
+        groups = parse_groups(self.process_layout, config.ffmpeg_groups, config.device_configs)
+        self.default_threads = self._default_threads(config, len(config.device_configs))
+        for group in groups:
+            device_configs = self._device_configs(group, config)
+            settings_key = self._settings_key(device_configs, config)
+            instance = self.instances.get("+".join(group))
+            if instance is None or instance.settings_key != settings_key:
+                instance = self._create_instance(device_configs, config)
+                instance.settings_key = settings_key
+                added.append(instance.device_name)
+            instances[instance.device_name] = instance
+
+        removed = [
+            device_name
+            for device_name, instance in self.instances.items()
+            if instances.get(device_name) is not instance
+        ]
+        kept = [device_name for device_name in instances if device_name not in added]
+        old_instances = self.instances
+        # Надзор обходит словарь из другого потока, поэтому он заменяется целиком
+        self.instances = instances
+        for device_name in removed:
+            old_instances[device_name].stop()
+        if self.relay is not None:
+            self.relay.retain(config.device_configs)
+
+        logger.info(
+            f"[FFMPEG] Конфигурация применена: без изменений {kept or 'нет'}, "
+            f"новые {added or 'нет'}, остановлены {removed or 'нет'}"
+        )
+        return {"kept": kept, "added": added, "removed": removed}
+
+    def _run_all(self, method: str, *args) -> dict:
+        """Call an FFMPEGInstance method for every device, in a bounded pool in parallel mode"""
+        return self._run_each(method, {device_name: args for device_name in self.instances})
+
+    def _run_each(self, method: str, args_by_device: dict) -> dict:
+        """Same as _run_all, but with separate arguments for every instance"""
+        instances = self.instances
+        if self.restart_mode == "parallel" and len(args_by_device) > 1:
+            workers = max(1, min(self.restart_concurrency, len(args_by_device)))
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ffmpeg-restart") as pool:
+                futures = {
+                    device_name: pool.submit(getattr(instances[device_name], method), *args)
+                    for device_name, args in args_by_device.items()
+                }
+                return {device_name: future.result() for device_name, future in futures.items()}
+        return {
+            device_name: getattr(instances[device_name], method)(*args)
+            for device_name, args in args_by_device.items()
+        }
+
     def start(self, profile):
         """Start all FFMPEG instances with the given profile"""
-        for device_name, instance in self.instances.items():
-            instance.start(profile)
+        self._run_all("start", profile)
 
     def stop(self):
         """Stop all FFMPEG instances"""
-        for device_name, instance in self.instances.items():
-            instance.stop()
+        self._run_all("stop")
 
     def restart_if_needed(self, new_profile):
         """Restart all FFMPEG instances if the profile has changed"""
+        started_at = time.monotonic()
+        switched = self._run_all("restart_if_needed", new_profile)
+        self._record_switches(switched, started_at)
+
+    def apply_profiles(self, profiles: dict[str, dict]):
+        """Restart FFMPEG instances whose per-device profile has changed"""
+        started_at = time.monotonic()
+        switched = self._run_each(
+            "restart_if_needed",
+            {device_name: (instance.select_profile(profiles),) for device_name, instance in self.instances.items()},
+        )
+        self._record_switches(switched, started_at)
+
+    def _record_switches(self, switched: dict, started_at: float):
+        durations = {
+            device_name: self.instances[device_name].last_switch_duration
+            for device_name, did_switch in switched.items()
+            if did_switch
+        }
+        if durations:
+            self.last_switch_durations = durations
+            self.last_outage = time.monotonic() - started_at
+            slowest = max(durations, key=durations.get)
+            logger.info(
+                f"[FFMPEG] Переключено {len(durations)} устройств за {self.last_outage:.3f} с, "
+                f"самое медленное: {slowest} ({durations[slowest]:.3f} с)"
+            )
+
+    def get_progress(self) -> dict[str, EncoderProgress]:
+        """
+        Actual encoder state per process as reported by ffmpeg -progress.
+
+        Keyed by instance name: a process encoding several cameras reports once under its
+        group name, and its total_size and bitrate cover only the first output.
+        """
+        return {
+            device_name: instance.progress
+            for device_name, instance in self.instances.items()
+            if instance.progress is not None
+        }
+
+    def supervise(self):
+        """Restart crashed FFMPEG instances with backoff"""
+        now = time.monotonic()
         for device_name, instance in self.instances.items():
-            instance.restart_if_needed(new_profile)
+            instance.watchdog(now)
+
+    def degraded_devices(self) -> list[str]:
+        """Degraded cameras; for a multi-camera process, the members that keep failing"""
+        return [device_name for instance in self.instances.values() for device_name in instance.degraded_members]
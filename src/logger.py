@@ -1,6 +1,10 @@
 import os
 import csv
+import atexit
 import logging
+import queue
+import threading
+import time
 from datetime import datetime
 from enum import Enum
 import logging
@@ -12,6 +16,197 @@ class LogType(Enum):
     BOTH = "both"
 
 
+class LogPipelineSettings:
+    """
+    Параметры фонового журналирования в файлы.
+    overflow: "drop" — при переполнении очереди запись отбрасывается, "block" — вызывающий поток ждёт.
+    rotate: "none", "size" (по max_bytes) или "time" (по rotate_interval секунд).
+    """
+
+    def __init__(self):
+        self.queue_size = 10000
+        self.overflow = "drop"
+        self.batch_size = 256
+        self.flush_interval = 1.0
+        self.rotate = "none"
+        self.max_bytes = 10 * 1024 * 1024
+        self.rotate_interval = 86400
+        self.backup_count = 5
+
+
+class _LogFile:
+    """CSV-файл журнала, в который пишет только фоновый поток"""
+
+    def __init__(self, filename: str, header: list = None) -> None:
+        self.filename = filename
+        self.header = header
+        self.file = None
+        self.writer = None
+        self.size = 0
+        self.opened_at = None
+        self.dirty = False
+
+    def open(self) -> None:
+        new_file = not os.path.exists(self.filename) or os.path.getsize(self.filename) == 0
+        self.file = open(self.filename, "a", newline="")
+        self.writer = csv.writer(self.file)
+        self.size = self.file.tell()
+        self.opened_at = time.time()
+        if new_file and self.header:
+            self.writer.writerow(self.header)
+
+    def write(self, row: list) -> None:
+        if self.file is None:
+            self.open()
+        self.writer.writerow(row)
+        self.dirty = True
+
+    def flush(self) -> None:
+        if self.file is not None and self.dirty:
+            self.file.flush()
+            self.size = self.file.tell()
+            self.dirty = False
+
+    def rotate_if_needed(self, settings: LogPipelineSettings) -> None:
+        if self.file is None or settings.rotate == "none":
+            return
+        if settings.rotate == "size" and self.size < settings.max_bytes:
+            return
+        if settings.rotate == "time" and time.time() - self.opened_at < settings.rotate_interval:
+            return
+        self.close()
+        for index in range(settings.backup_count - 1, 0, -1):
+            source = f"{self.filename}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.filename}.{index + 1}")
+        if settings.backup_count > 0:
+            os.replace(self.filename, f"{self.filename}.1")
+        else:
+            os.remove(self.filename)
+        self.open()
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.flush()
+            self.file.close()
+            self.file = None
+            self.writer = None
+
+
+class LogPipeline:
+    """
+    Очередь и фоновый поток записи журналов. Обработчики только кладут запись в очередь,
+    форматирование времени, запись на диск, сброс буферов и ротация выполняются
+    в фоне пачками по размеру (batch_size) или по времени (flush_interval).
+    """
+
+    def __init__(self, settings: LogPipelineSettings) -> None:
+        self.settings = settings
+        self.queue = queue.Queue(maxsize=settings.queue_size)
+        self.dropped = 0
+        self.written = 0
+        self._files = set()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, log_file: _LogFile, created: float, row: tuple) -> None:
+        item = (log_file, created, row)
+        if self.settings.overflow == "block":
+            self.queue.put(item)
+            return
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self) -> None:
+        last_second = None
+        timestamp = None
+        pending = 0
+        last_flush = time.monotonic()
+        while True:
+            try:
+                item = self.queue.get(timeout=self.settings.flush_interval)
+            except queue.Empty:
+                item = None
+
+            if item is not None:
+                log_file, created, row = item
+                # Метка времени с точностью до секунды: форматируем один раз на секунду
+                second = int(created)
+                if second != last_second:
+                    last_second = second
+                    timestamp = datetime.fromtimestamp(second).strftime("%Y-%m-%d %H:%M:%S")
+                try:
+                    log_file.write([timestamp, *row])
+                except Exception:
+                    self.dropped += 1
+                self._files.add(log_file)
+                pending += 1
+                self.written += 1
+
+            now = time.monotonic()
+            if pending and (pending >= self.settings.batch_size or now - last_flush >= self.settings.flush_interval):
+                self._flush()
+                pending = 0
+                last_flush = now
+            elif item is None:
+                last_flush = now
+                if self._stopped.is_set():
+                    break
+        # Файлы закрывает сам поток записи, когда очередь разобрана: stop() может не дождаться
+        # его (например, во время долгого сброса), и закрытие из другого потока потеряло бы записи
+        for log_file in self._files:
+            try:
+                log_file.close()
+            except Exception:
+                pass
+
+    def _flush(self) -> None:
+        for log_file in self._files:
+            try:
+                log_file.flush()
+                log_file.rotate_if_needed(self.settings)
+            except Exception:
+                pass
+
+    def stop(self, timeout: float = 5) -> None:
+        """Просит поток записи разобрать очередь, закрыть файлы и завершиться; ждёт не дольше timeout"""
+        self._stopped.set()
+        self._thread.join(timeout)
+
+
+_settings = LogPipelineSettings()
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+
+def get_log_pipeline() -> LogPipeline:
+    global _pipeline
+    if _pipeline is None:
+        with _pipeline_lock:
+            if _pipeline is None:
+                _pipeline = LogPipeline(_settings)
+                atexit.register(_pipeline.stop)
+    return _pipeline
+
+
+def configure_log_pipeline(config) -> None:
+    """
+    Применяет секцию [logging] конфигурации. Размер очереди учитывается, только
+    если ни одна запись ещё не была отправлена в журнал.
+    """
+    _settings.queue_size = config.log_queue_size
+    _settings.overflow = config.log_overflow
+    _settings.batch_size = config.log_batch_size
+    _settings.flush_interval = config.log_flush_interval
+    _settings.rotate = config.log_rotate
+    _settings.max_bytes = config.log_max_bytes
+    _settings.rotate_interval = config.log_rotate_interval
+    _settings.backup_count = config.log_backup_count
+
+
 class CsvSignalLogHandler(logging.Handler):
     def __init__(self, filename: str = None) -> None:
         super().__init__()
@@ -19,23 +214,21 @@ class CsvSignalLogHandler(logging.Handler):
         self._init_file()
 
     def _init_file(self) -> None:
-        new_file = not os.path.exists(self.filename)
-        self.file = open(self.filename, "a", newline="")
-        self.writer = csv.writer(self.file)
-        if new_file:
-            self.writer.writerow(["timestamp", "ssid", "rssi", "noise", "rate_mbps", "quality_percent"])
+        self.file = _LogFile(
+            self.filename, header=["timestamp", "ssid", "rssi", "noise", "rate_mbps", "quality_percent"]
+        )
 
     def emit(self, record: logging.LogRecord) -> None:
         """
-        Именно тут мы и пишем в файл
+        Именно тут мы и отправляем запись в фоновую очередь
         """
         try:
-            ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             data = record.msg
-            self.writer.writerow(
-                [ts, data.get("ssid"), data.get("rssi"), data.get("noise"), data.get("rate"), data.get("quality")]
+            get_log_pipeline().submit(
+                self.file,
+                record.created,
+                (data.get("ssid"), data.get("rssi"), data.get("noise"), data.get("rate"), data.get("quality")),
             )
-            self.file.flush()
         except Exception as e:
             self.handleError(record)
 
@@ -53,19 +246,16 @@ class GenericTextLogHandler(logging.Handler):
         self._init_file()
 
     def _init_file(self) -> None:
-        self.file = open(self.filename, "a", newline="")
-        self.writer = csv.writer(self.file)
+        self.file = _LogFile(self.filename)
 
     def emit(self, record: logging.LogRecord) -> None:
         """
-        Именно тут мы и пишем в файл
+        Именно тут мы и отправляем запись в фоновую очередь
         """
         if not hasattr(record, "msg"):
             return
         try:
-            ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            self.writer.writerow([ts, record.msg])
-            self.file.flush()
+            get_log_pipeline().submit(self.file, record.created, (record.msg,))
         except Exception as e:
             self.handleError(record)
 
@@ -0,0 +1,365 @@
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .logger import get_logger
+from .logger import LogType
+from .logger import GenericTextLogHandler
+
+logger = get_logger(__name__, filename="metrics_log.csv", logType=LogType.BOTH, handler=GenericTextLogHandler)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SWITCH_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 10.0)
+
+
+class Histogram:
+    """
+    Гистограмма с фиксированными границами корзин. observe() только увеличивает
+    заранее выделенные счётчики; строки формируются лишь при выдаче метрик.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_string(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _format_value(value) -> str:
+    if value is None:
+        return "NaN"
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsRegistry:
+    """
+    Набор метрик в текстовом формате Prometheus. Значения счётчиков и датчиков
+    читаются из состояния компонентов функциями-сборщиками в момент запроса,
+    поэтому на горячем пути никаких затрат нет.
+    """
+
+    def __init__(self):
+        self._families = {}
+
+    def family(self, name: str, help_text: str, metric_type: str, collect):
+        """collect() возвращает пары (метки, значение); для гистограмм значение — Histogram"""
+        self._families[name] = (help_text, metric_type, collect)
+
+    def gauge(self, name: str, help_text: str, read, labels: dict = None):
+        self.family(name, help_text, "gauge", lambda: [(labels, read())])
+
+    def counter(self, name: str, help_text: str, read, labels: dict = None):
+        self.family(name, help_text, "counter", lambda: [(labels, read())])
+
+    def histogram(self, name: str, help_text: str, histogram: Histogram, labels: dict = None):
+        self.family(name, help_text, "histogram", lambda: [(labels, histogram)])
+
+    def render(self) -> str:
+        lines = []
+        for name, (help_text, metric_type, collect) in self._families.items():
+            try:
+                samples = list(collect())
+            except Exception:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in samples:
+                if metric_type == "histogram":
+                    self._render_histogram(lines, name, labels or {}, value)
+                else:
+                    lines.append(f"{name}{_label_string(labels)} {_format_value(value)}")
+        lines.append("")
+        return "\n".join(lines)
+
+    @staticmethod
+    def _render_histogram(lines: list, name: str, labels: dict, histogram: Histogram):
+        cumulative = 0
+        for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f"{name}_bucket{_label_string({**labels, 'le': le})} {cumulative}")
+        lines.append(f"{name}_sum{_label_string(labels)} {histogram.sum!r}")
+        lines.append(f"{name}_count{_label_string(labels)} {histogram.count}")
+
+
+def _per_device(ffmpeg, read):
+    """Сборщик, проходящий по текущему набору энкодеров при каждом запросе"""
+    return lambda: [({"device": device_name}, read(instance)) for device_name, instance in ffmpeg.instances.items()]
+
+
+def _per_stream(relay, read):
+    """Сборщик по потокам ретранслятора; набор потоков меняется при перезагрузке конфигурации"""
+    return lambda: [({"device": name}, read(stream)) for name, stream in list(relay.streams.items())]
+
+
+def _uptime(instance) -> float:
+    return time.monotonic() - instance.started_at if instance.is_running() else 0
+
+
+def build_registry(client=None, ffmpeg=None, policy=None, supervisor=None) -> MetricsRegistry:
+    """Регистрирует метрики KeeneticRCIClient, FFMPEGController, SignalPolicyEngine и Supervisor"""
+    registry = MetricsRegistry()
+
+    if client is not None:
+        stats = client.stats
+        registry.histogram("keenetic_rci_request_duration_seconds", "RCI request latency", stats.latency)
+        registry.counter("keenetic_rci_requests_total", "RCI requests sent", lambda: stats.requests)
+        registry.counter("keenetic_rci_errors_total", "RCI requests that failed", lambda: stats.errors)
+        registry.counter("keenetic_rci_auth_total", "Challenge/response logins", lambda: stats.auth_count)
+        registry.counter("keenetic_rci_reauth_total", "Logins triggered by a 401", lambda: stats.reauth_count)
+
+    if supervisor is not None:
+        registry.histogram(
+            "keenetic_poll_jitter_seconds",
+            "Deviation of the interval between signal polls from the configured one",
+            supervisor.poll_jitter,
+        )
+        registry.gauge(
+            "keenetic_poll_interval_seconds", "Configured signal poll interval", lambda: supervisor.poll_interval
+        )
+        registry.gauge(
+            "keenetic_poll_current_interval_seconds",
+            "Signal poll interval in effect (adaptive polling changes it with the signal)",
+            lambda: supervisor.current_poll_interval,
+        )
+        registry.gauge(
+            "keenetic_poll_rate_hz", "Successful signal polls per second over the last minute",
+            lambda: supervisor.poll_rate.rate(time.monotonic()),
+        )
+        registry.gauge(
+            "keenetic_router_request_rate", "RCI requests per second over the last minute",
+            lambda: supervisor.router_request_rate.rate(time.monotonic()),
+        )
+        registry.counter("keenetic_poll_samples_total", "Successful signal polls", lambda: supervisor.samples_taken)
+        registry.counter("keenetic_poll_failures_total", "Failed signal polls", lambda: supervisor.samples_failed)
+        registry.counter(
+            "keenetic_poll_skipped_ticks_total",
+            "Poll ticks skipped because the router had not answered yet",
+            lambda: supervisor.ticks_skipped,
+        )
+        registry.gauge(
+            "keenetic_router_connected", "1 once the daemon has authenticated on the router", lambda: supervisor.client_ready
+        )
+        registry.counter(
+            "keenetic_router_auth_failures_total", "Failed startup logins before the router answered",
+            lambda: supervisor.auth_failures,
+        )
+        registry.family(
+            "keenetic_startup_first_frame_seconds", "Seconds from daemon start to the first encoded frame", "gauge",
+            lambda: [({"device": name}, seconds) for name, seconds in supervisor.startup_first_frame.items()],
+        )
+
+    if policy is not None:
+        registry.gauge("keenetic_profile_index", "Current profile index (0 = best)", lambda: policy.current_index)
+        registry.counter(
+            "keenetic_policy_switches_total", "Profile switches decided by the policy", lambda: policy.switch_count
+        )
+        registry.counter(
+            "keenetic_policy_avoided_switches_total",
+            "Switches a raw-sample policy would have made",
+            lambda: policy.avoided_switches,
+        )
+        registry.counter(
+            "keenetic_policy_prediction_hits_total",
+            "Pre-emptive step-downs the reactive policy later confirmed within the horizon",
+            lambda: policy.prediction_hits,
+        )
+        registry.counter(
+            "keenetic_policy_prediction_misses_total",
+            "Pre-emptive step-downs the signal did not confirm within the horizon",
+            lambda: policy.prediction_misses,
+        )
+        registry.gauge(
+            "keenetic_uplink_budget_kbps",
+            "Uplink bandwidth budget split across devices (allocation = budget)",
+            lambda: policy.uplink_budget,
+        )
+        registry.gauge(
+            "keenetic_goodput_estimate_kbps",
+            "Smoothed uplink goodput estimate from interface counters, PHY rate and encoder output",
+            lambda: policy.throughput.estimate.goodput_kbps,
+        )
+        registry.gauge(
+            "keenetic_goodput_confidence", "Confidence of the goodput estimate (0..1)",
+            lambda: policy.throughput.estimate.confidence,
+        )
+        registry.family(
+            "keenetic_device_profile_index", "Profile index in the device's own ladder (allocation = budget)", "gauge",
+            lambda: [({"device": device_name}, index) for device_name, index in policy.device_indices.items()],
+        )
+
+    if supervisor is not None and supervisor.checker is not None:
+        checker = supervisor.checker
+        registry.family(
+            "keenetic_connection_probe_up", "1 if the last connection probe succeeded", "gauge",
+            lambda: [({"probe": name}, probe.ok) for name, probe in checker.last_result.probes.items()],
+        )
+        registry.family(
+            "keenetic_connection_probe_latency_seconds", "Latency of the last successful connection probe", "gauge",
+            lambda: [({"probe": name}, probe.latency) for name, probe in checker.last_result.probes.items()],
+        )
+
+    if supervisor is not None:
+        resources = supervisor.resources
+        registry.family(
+            "keenetic_encoder_cpu_percent", "CPU used by the encoder process, percent of one core", "gauge",
+            lambda: [({"device": name}, usage.cpu_percent) for name, usage in resources.usage.items()],
+        )
+        registry.family(
+            "keenetic_encoder_rss_bytes", "Resident memory of the encoder process", "gauge",
+            lambda: [({"device": name}, usage.rss_bytes) for name, usage in resources.usage.items()],
+        )
+        registry.family(
+            "keenetic_encoder_speed", "Encoded media seconds per wall-clock second (below 1 = falling behind)",
+            "gauge",
+            lambda: [({"device": name}, usage.speed) for name, usage in resources.usage.items()],
+        )
+        registry.gauge("keenetic_host_cpu_percent", "Host CPU utilisation", lambda: resources.host_cpu_percent)
+
+    if policy is not None:
+        registry.family(
+            "keenetic_device_cpu_profile_steps", "Profile steps below the policy's choice because the CPU is short",
+            "gauge",
+            lambda: [({"device": device_name}, steps) for device_name, steps in policy.cpu_steps.items()],
+        )
+
+    if ffmpeg is not None:
+        registry.family(
+            "keenetic_encoder_switch_duration_seconds",
+            "Time spent switching an encoder to a new profile",
+            "histogram",
+            _per_device(ffmpeg, lambda instance: instance.switch_duration),
+        )
+        registry.family(
+            "keenetic_encoder_switches_total", "Profile switches per encoder", "counter",
+            _per_device(ffmpeg, lambda instance: instance.switch_count),
+        )
+        registry.family(
+            "keenetic_encoder_crashes_total", "Unexpected encoder exits", "counter",
+            _per_device(ffmpeg, lambda instance: instance.crash_count),
+        )
+        registry.family(
+            "keenetic_encoder_restarts_total", "Watchdog restarts of crashed encoders", "counter",
+            _per_device(ffmpeg, lambda instance: instance.crash_restart_count),
+        )
+        registry.family(
+            "keenetic_encoder_uptime_seconds", "Seconds since the running encoder was started", "gauge",
+            _per_device(ffmpeg, _uptime),
+        )
+        registry.family(
+            "keenetic_encoder_degraded", "1 if the watchdog marked the device as degraded", "gauge",
+            _per_device(ffmpeg, lambda instance: instance.degraded),
+        )
+        registry.family(
+            "keenetic_encoder_preset", "1 for the x264 preset the encoder runs with", "gauge",
+            lambda: [
+                ({"device": device_name, "preset": instance.preset}, 1) for device_name, instance in ffmpeg.instances.items()
+            ],
+        )
+        registry.family(
+            "keenetic_encoder_threads", "Encoder threads (0 = ffmpeg default)", "gauge",
+            _per_device(ffmpeg, lambda instance: instance.threads),
+        )
+        registry.family(
+            "keenetic_encoder_bitrate_kbps",
+            "Actual encoder output bitrate from ffmpeg -progress (first output of a multi-camera process)",
+            "gauge",
+            _per_device(ffmpeg, lambda instance: instance.progress.bitrate_kbps if instance.progress else None),
+        )
+
+    if ffmpeg is not None and ffmpeg.relay is not None:
+        relay = ffmpeg.relay
+        registry.gauge(
+            "keenetic_relay_rate_limit_kbps", "Relay send rate limit (absent = unpaced)", lambda: relay.rate_kbps
+        )
+        registry.family(
+            "keenetic_relay_received_bytes_total", "Bytes received by the relay from the encoder", "counter",
+            _per_stream(relay, lambda stream: stream.received_bytes),
+        )
+        registry.family(
+            "keenetic_relay_sent_bytes_total", "Bytes forwarded by the relay to the output", "counter",
+            _per_stream(relay, lambda stream: stream.sent_bytes),
+        )
+        registry.family(
+            "keenetic_relay_sent_packets_total", "Datagrams forwarded by the relay to the output", "counter",
+            _per_stream(relay, lambda stream: stream.sent_packets),
+        )
+        registry.family(
+            "keenetic_relay_dropped_packets_total", "Datagrams dropped by the relay under the rate limit", "counter",
+            _per_stream(relay, lambda stream: stream.dropped_packets),
+        )
+        registry.family(
+            "keenetic_relay_dropped_keyframe_packets_total", "Dropped datagrams that carried a keyframe or PSI",
+            "counter",
+            _per_stream(relay, lambda stream: stream.dropped_protected),
+        )
+        registry.family(
+            "keenetic_relay_send_errors_total", "Datagrams the relay failed to send", "counter",
+            _per_stream(relay, lambda stream: stream.send_errors),
+        )
+        registry.family(
+            "keenetic_relay_throughput_kbps", "Relay output rate over the last second", "gauge",
+            _per_stream(relay, lambda stream: stream.sent_kbps),
+        )
+        registry.family(
+            "keenetic_relay_queue_bytes", "Bytes waiting in the relay queue", "gauge",
+            _per_stream(relay, lambda stream: stream.queued_bytes),
+        )
+
+    return registry
+
+
+class MetricsServer:
+    """Локальный HTTP-сервер, отдающий /metrics в фоновом потоке"""
+
+    def __init__(self, registry: MetricsRegistry, host: str = "127.0.0.1", port: int = 9108):
+        self.registry = registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(handler):
+                if handler.path.split("?", 1)[0] != "/metrics":
+                    handler.send_error(404)
+                    return
+                body = registry.render().encode()
+                handler.send_response(200)
+                handler.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                handler.send_header("Content-Length", str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self._thread = threading.Thread(target=self.server.serve_forever, name="metrics-http", daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self.server.server_address[1]
+
+    def start(self):
+        self._thread.start()
+        logger.info(f"[METRICS] Метрики доступны на http://{self.server.server_address[0]}:{self.port}/metrics")
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,125 @@
+from collections import deque
+import statistics
+
+from .config import Config
+from .signalpolicy import SNRTrend
+
+
+class RateMeter:
+    """Частота событий за скользящее окно в секундах"""
+
+    def __init__(self, window: float = 60.0):
+        self.window = window
+        self.events = deque()
+        self.count = 0
+
+    def mark(self, timestamp: float, count: int = 1):
+        if count <= 0:
+            return
+        self.events.append((timestamp, count))
+        self.count += count
+        self._expire(timestamp)
+
+    def rate(self, now: float) -> float:
+        """Событий в секунду за последние window секунд"""
+        self._expire(now)
+        if not self.events:
+            return 0.0
+        return sum(count for _, count in self.events) / self.window
+
+    def _expire(self, now: float):
+        while self.events and self.events[0][0] < now - self.window:
+            self.events.popleft()
+
+
+class AdaptivePollScheduler:
+    """
+    Период опроса роутера в зависимости от поведения сигнала.
+
+    По последним window замерам считаются разброс SNR (стандартное отклонение, дБ)
+    и тренд (наклон линейной регрессии, дБ/с). Их отношения к variance_threshold
+    и trend_threshold дают «срочность»: при срочности 1 и выше, а также в течение
+    switch_hold секунд после переключения профиля опрос идёт с min_interval.
+    При меньшей срочности период линейно приближается к max_interval, но растёт
+    не быстрее чем в backoff раз за такт, а сокращается сразу.
+    """
+
+    def __init__(
+        self,
+        min_interval: float,
+        max_interval: float,
+        window: int = 8,
+        variance_threshold: float = 3.0,
+        trend_threshold: float = 1.0,
+        switch_hold: float = 10.0,
+        backoff: float = 1.5,
+    ):
+        if not 0 < min_interval <= max_interval:
+            raise ValueError("Период опроса: нужно 0 < min_interval <= max_interval")
+        if window < 3:
+            raise ValueError("Окно адаптивного опроса должно быть не меньше 3 замеров")
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.variance_threshold = variance_threshold
+        self.trend_threshold = trend_threshold
+        self.switch_hold = switch_hold
+        self.backoff = max(1.0, backoff)
+        self.settings = (min_interval, max_interval, window, variance_threshold, trend_threshold, switch_hold, backoff)
+
+        self.snr_trend = SNRTrend(window)
+        self.interval = min_interval
+        self.last_switch_at = None
+        self.spread = None
+        self.trend = None
+        self.urgency = None
+
+    def observe(self, timestamp: float, snr: float) -> float:
+        """Учитывает замер SNR и возвращает новый период опроса"""
+        self.snr_trend.update(timestamp, snr)
+        return self.update(timestamp)
+
+    def notify_switch(self, timestamp: float) -> float:
+        """Политика только что переключила профиль: опрашиваем часто, пока всё не уляжется"""
+        self.last_switch_at = timestamp
+        self.interval = self.min_interval
+        return self.interval
+
+    def update(self, now: float) -> float:
+        if self.last_switch_at is not None and now - self.last_switch_at < self.switch_hold:
+            self.interval = self.min_interval
+            return self.interval
+        samples = self.snr_trend.samples
+        if len(samples) < 3:
+            return self.interval
+
+        self.spread = statistics.pstdev(snr for _, snr in samples)
+        self.trend = self.snr_trend.slope if self.snr_trend.slope is not None else 0.0
+
+        urgency = 0.0
+        if self.variance_threshold > 0:
+            urgency = max(urgency, self.spread / self.variance_threshold)
+        if self.trend_threshold > 0:
+            urgency = max(urgency, abs(self.trend) / self.trend_threshold)
+        self.urgency = urgency
+
+        target = self.max_interval - (self.max_interval - self.min_interval) * min(1.0, urgency)
+        if target < self.interval:
+            self.interval = target
+        else:
+            self.interval = min(target, self.interval * self.backoff)
+        return self.interval
+
+
+def build_poll_scheduler(config: Config):
+    """None при poll_mode = fixed: опрос идёт с постоянным периодом settings.timeout"""
+    if config.poll_mode != "adaptive":
+        return None
+    return AdaptivePollScheduler(
+        config.poll_min_interval,
+        config.poll_max_interval,
+        config.poll_window,
+        config.poll_variance_threshold,
+        config.poll_trend_threshold,
+        config.poll_switch_hold,
+        config.poll_backoff,
+    )
@@ -1,6 +1,10 @@
 import requests
 import hashlib
+import threading
+import time
+from requests.adapters import HTTPAdapter
 from .config import Config
+from .metrics import Histogram
 
 
 from .logger import get_logger
@@ -10,25 +14,179 @@ from .logger import GenericTextLogHandler
 
 logger_text = get_logger(__name__, filename="RCI_log.csv", logType=LogType.FILE, handler=GenericTextLogHandler)
 
+
+class RCIStats:
+    """Счётчики запросов к RCI: задержки и количество (повторных) аутентификаций"""
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.last_latency = None
+        self.auth_count = 0
+        self.reauth_count = 0
+        self.latency = Histogram()
+
+    def record(self, latency: float, ok: bool = True):
+        self.latency.observe(latency)
+        self.requests += 1
+        if not ok:
+            self.errors += 1
+        self.total_latency += latency
+        self.last_latency = latency
+        if latency > self.max_latency:
+            self.max_latency = latency
+
+    @property
+    def mean_latency(self) -> float:
+        return self.total_latency / self.requests if self.requests else 0.0
+
+    def summary(self) -> str:
+        return (
+            f"запросов: {self.requests}, ошибок: {self.errors}, средняя задержка: {self.mean_latency * 1000:.1f} мс, "
+            f"максимальная: {self.max_latency * 1000:.1f} мс, аутентификаций: {self.auth_count}, "
+            f"повторных: {self.reauth_count}"
+        )
+
+
+def _rci_error(result) -> str:
+    """Текст ошибки, если роутер вернул статус ошибки вместо данных команды"""
+    if not isinstance(result, dict):
+        return "неожиданный формат ответа"
+    for status in result.get("status", []) or []:
+        if isinstance(status, dict) and status.get("status") == "error":
+            return status.get("message", "ошибка")
+    return None
+
+
+class InterfaceStatus:
+    """Ответ на show interface name=<...>: параметры радиосвязи станции"""
+
+    def __init__(self, data: dict):
+        self.raw = data
+        self.ssid = data.get("ssid")
+        self.rssi = data.get("rssi")
+        self.noise = data.get("noise")
+        self.rate = data.get("rate")
+        self.quality = data.get("quality")
+        self.link = data.get("link")
+
+
+class InterfaceStats:
+    """Ответ на show interface stat name=<...>: счётчики трафика интерфейса"""
+
+    def __init__(self, data: dict):
+        self.raw = data
+        self.rxbytes = int(data.get("rxbytes", 0))
+        self.txbytes = int(data.get("txbytes", 0))
+        self.rxpackets = int(data.get("rxpackets", 0))
+        self.txpackets = int(data.get("txpackets", 0))
+        self.rxerrors = int(data.get("rxerrors", 0))
+        self.txerrors = int(data.get("txerrors", 0))
+
+
+class HotspotHosts:
+    """Ответ на show ip hotspot: подключённые клиенты"""
+
+    def __init__(self, data: dict):
+        self.raw = data
+        self.hosts = data.get("host", []) if isinstance(data, dict) else []
+
+
+class RCICommand:
+    """Одна команда пакетного запроса и тип, в который разбирается её результат"""
+
+    def __init__(self, name: str, body: dict, result_type):
+        self.name = name
+        self.body = body
+        self.result_type = result_type
+
+
+class RCIBatchResult:
+    def __init__(self, results: dict):
+        self.results = results
+        self.status: InterfaceStatus = results.get("status")
+        self.stats: InterfaceStats = results.get("stats")
+        self.hotspot: HotspotHosts = results.get("hotspot")
+
+
 class KeeneticRCIClient:
     def __init__(self, config: Config):
         self.session = requests.session()
+        # Одно keep-alive соединение к роутеру переиспользуется между опросами
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=config.rci_pool_maxsize, max_retries=0)
+        self.session.mount("http://", adapter)
         self.ip = config.ip
         self.login = config.login
         self.password = config.password
         self.timeout = config.timeout
+        self.request_timeout = (config.rci_connect_timeout, config.rci_read_timeout)
         self.logfile = config.logfile
+        self.interface = config.rci_interface
+        self.poll_stats = config.rci_poll_stats
+        self.poll_hotspot = config.rci_poll_hotspot
+        self.last_poll = None
+        self.stats = RCIStats()
+        self._auth_lock = threading.Lock()
         logger_text.info(
             f"[Keenetic] Инициализация сессии с таймаутом: {self.timeout} и файлом журнала: {self.logfile}"
         )
         logger_text.info("[Keenetic] Конфигурация загружена успешно.")
         logger_text.info("[Keenetic] Инициализация сессии...")
 
+    def reload(self, config: Config) -> bool:
+        """Применяет новые настройки опроса. Возвращает True, если изменились адрес или учётные данные."""
+        credentials_changed = (self.ip, self.login, self.password) != (config.ip, config.login, config.password)
+        self.ip = config.ip
+        self.login = config.login
+        self.password = config.password
+        self.timeout = config.timeout
+        self.request_timeout = (config.rci_connect_timeout, config.rci_read_timeout)
+        self.interface = config.rci_interface
+        self.poll_stats = config.rci_poll_stats
+        self.poll_hotspot = config.rci_poll_hotspot
+        if credentials_changed:
+            self.session.cookies.clear()
+        return credentials_changed
+
     def _request(self, path, post=None):
         url = f"http://{self.ip}/{path}"
-        return self.session.post(url, json=post) if post else self.session.get(url)
+        started_at = time.monotonic()
+        try:
+            if post:
+                r = self.session.post(url, json=post, timeout=self.request_timeout)
+            else:
+                r = self.session.get(url, timeout=self.request_timeout)
+        except requests.RequestException:
+            self.stats.record(time.monotonic() - started_at, ok=False)
+            raise
+        self.stats.record(time.monotonic() - started_at, ok=r.status_code < 500)
+        return r
+
+    def _call(self, path, post=None):
+        """
+        Запрос от имени авторизованной сессии. Challenge/response выполняется
+        повторно только если роутер ответил 401.
+        """
+        r = self._request(path, post)
+        if r.status_code == 401:
+            logger_text.info("[Keenetic] Сессия истекла, повторная аутентификация")
+            self.stats.reauth_count += 1
+            if self.authenticate():
+                r = self._request(path, post)
+        return r
 
     def authenticate(self) -> bool:
+        with self._auth_lock:
+            try:
+                return self._authenticate()
+            except requests.RequestException as e:
+                logger_text.error(f"[Keenetic] Ошибка аутентификации: {e}")
+                return False
+
+    def _authenticate(self) -> bool:
+        self.stats.auth_count += 1
         r = self._request("auth")
         if r.status_code == 401:
             realm = r.headers.get("X-NDM-Realm", "")
@@ -49,13 +207,43 @@ class KeeneticRCIClient:
             logger_text.error(f"[Keenetic] Ошибка аутентификации: {r.status_code}")
         return False
 
+    def batch(self, commands: list[RCICommand]) -> dict:
+        """
+        Выполняет несколько команд RCI одним POST-запросом на /rci/.
+        Возвращает словарь name → типизированный результат (None, если команда не удалась).
+        """
+        r = self._call("rci/", [command.body for command in commands])
+        if r.status_code != 200:
+            raise requests.HTTPError(f"RCI batch failed with status {r.status_code}", response=r)
+        data = r.json()
+        if not isinstance(data, list) or len(data) != len(commands):
+            raise ValueError("RCI batch response does not match the request")
+
+        results = {}
+        for command, result in zip(commands, data):
+            error = _rci_error(result)
+            if error:
+                logger_text.error(f"[Keenetic] Команда {command.name} завершилась ошибкой: {error}")
+                results[command.name] = None
+                continue
+            results[command.name] = command.result_type(result)
+        return results
+
+    def poll(self) -> RCIBatchResult:
+        """Статус интерфейса, его счётчики и (опционально) список клиентов за один запрос"""
+        commands = [RCICommand("status", {"show": {"interface": {"name": self.interface}}}, InterfaceStatus)]
+        if self.poll_stats:
+            commands.append(
+                RCICommand("stats", {"show": {"interface": {"stat": {"name": self.interface}}}}, InterfaceStats)
+            )
+        if self.poll_hotspot:
+            commands.append(RCICommand("hotspot", {"show": {"ip": {"hotspot": {}}}}, HotspotHosts))
+        self.last_poll = RCIBatchResult(self.batch(commands))
+        return self.last_poll
+
     def get_connected_devices(self):
-        if not self.authenticate():
-            logger_text.error("[Keenetic] Failed to authenticate before getting connected devices")
-            return None
-            
-        r = self._request("rci/show/ip/hotspot")
         try:
+            r = self._call("rci/show/ip/hotspot")
             data = r.json()
             logger_text.info("[Keenetic] Successfully retrieved connected devices information")
             logger_text.info(data)
@@ -77,13 +265,12 @@ class KeeneticRCIClient:
         return "wifi"
 
     def get_wifi_info(self):
-        r = self._request("rci/show/interface")
         try:
-            data = r.json()
-        except:
+            result = self.poll()
+        except (requests.RequestException, ValueError) as e:
+            logger_text.error(f"[Keenetic] Ошибка запроса информации о Wi-Fi: {e}")
             return None
-        wifi_info = data.get("WifiMaster0/WifiStation0")
-        if not wifi_info:
+        if not result.status:
             logger_text.error("[Keenetic] Информация о Wi-Fi не найдена")
             return None
-        return wifi_info
\ No newline at end of file
+        return result.status.raw
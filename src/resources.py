@@ -0,0 +1,297 @@
+import os
+import time
+
+from .config import Config
+from .ffmpeg import FFMPEGController
+from .signalpolicy import SignalPolicyEngine
+
+from .logger import get_logger
+from .logger import LogType
+from .logger import GenericTextLogHandler
+
+logger = get_logger(__name__, filename="resources_log.csv", logType=LogType.BOTH, handler=GenericTextLogHandler)
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+def read_proc(pid):
+    """
+    Read CPU time and RSS of a process from /proc.
+
+    Args:
+        pid (int): Process id.
+
+    Returns:
+        tuple: (cpu seconds, rss bytes), or None if the process is gone.
+    """
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # comm may contain spaces, fields after it are fixed
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/statm") as f:
+            rss_pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS, rss_pages * PAGE_SIZE
+
+
+def read_host_cpu():
+    """
+    Aggregate CPU counters of the host from /proc/stat.
+
+    Returns:
+        tuple: (busy ticks, total ticks), or None if /proc/stat is unavailable.
+    """
+    try:
+        with open("/proc/stat") as f:
+            values = [int(value) for value in f.readline().split()[1:]]
+    except (OSError, ValueError):
+        return None
+    # idle и iowait
+    idle = values[3] + (values[4] if len(values) > 4 else 0)
+    total = sum(values[:8])
+    return total - idle, total
+
+
+class ProcessUsage:
+    """Замер одного процесса ffmpeg: CPU в процентах одного ядра, RSS и скорость энкодера"""
+
+    __slots__ = ("pid", "cpu_seconds", "cpu_percent", "rss_bytes", "speed", "out_time", "progress_at", "sampled_at")
+
+    def __init__(self, pid: int, cpu_seconds: float, rss_bytes: int, sampled_at: float):
+        self.pid = pid
+        self.cpu_seconds = cpu_seconds
+        self.cpu_percent = None
+        self.rss_bytes = rss_bytes
+        self.speed = None
+        self.out_time = None
+        self.progress_at = None
+        self.sampled_at = sampled_at
+
+    def as_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class ResourceSampler:
+    """
+    Потребление ресурсов процессами ffmpeg по /proc: два чтения файла на процесс за замер,
+    без внешних процессов. CPU считается по приращению utime + stime между замерами,
+    поэтому у только что (пере)запущенного процесса он появляется со второго замера.
+
+    Скорость энкодера — приращение out_time из -progress к прошедшему времени между замерами.
+    speed из самого ffmpeg усреднён с момента запуска и после часов работы почти не реагирует
+    на замедление; он используется, только если ffmpeg не сообщает out_time.
+    """
+
+    def __init__(self):
+        self.usage = {}
+        self.host_cpu_percent = None
+        self._host_counters = None
+
+    def sample(self, ffmpeg: FFMPEGController, now: float = None) -> dict:
+        """
+        Returns:
+            dict: {имя процесса: ProcessUsage} для работающих процессов.
+        """
+        now = time.monotonic() if now is None else now
+        usage = {}
+        for device_name, instance in ffmpeg.instances.items():
+            process = instance.process
+            if process is None or process.poll() is not None:
+                continue
+            counters = read_proc(process.pid)
+            if counters is None:
+                continue
+            current = ProcessUsage(process.pid, counters[0], counters[1], now)
+            previous = self.usage.get(device_name)
+            if previous is not None and previous.pid != process.pid:
+                previous = None
+            if previous is not None and now > previous.sampled_at:
+                current.cpu_percent = 100 * (current.cpu_seconds - previous.cpu_seconds) / (now - previous.sampled_at)
+
+            progress = instance.progress
+            # Блок -progress старше пары секунд означает, что энкодер встал: скорость неизвестна
+            if progress is not None and progress.updated_at is not None and now - progress.updated_at < 2:
+                current.out_time = progress.out_time
+                current.progress_at = progress.updated_at
+                if (
+                    previous is not None
+                    and previous.out_time
+                    and current.out_time
+                    and current.progress_at > previous.progress_at
+                ):
+                    current.speed = (current.out_time - previous.out_time) / (current.progress_at - previous.progress_at)
+                elif not current.out_time:
+                    current.speed = progress.speed
+            usage[device_name] = current
+        self.usage = usage
+
+        counters = read_host_cpu()
+        if counters is not None and self._host_counters is not None:
+            busy = counters[0] - self._host_counters[0]
+            total = counters[1] - self._host_counters[1]
+            if total > 0:
+                self.host_cpu_percent = 100 * busy / total
+        self._host_counters = counters
+        return usage
+
+
+class EncoderTuning:
+    """Состояние подстройки одного процесса под ресурсы хоста"""
+
+    __slots__ = (
+        "preset_index",
+        "uses_preset",
+        "threads",
+        "profile_steps",
+        "overloaded",
+        "healthy_since",
+        "changed_at",
+        "upgraded",
+        "dwell",
+    )
+
+    def __init__(self, preset_index: int, threads: int, dwell: float, uses_preset: bool = True):
+        self.preset_index = preset_index
+        self.uses_preset = uses_preset
+        self.threads = threads
+        self.profile_steps = 0
+        self.overloaded = 0
+        self.healthy_since = None
+        self.changed_at = None
+        self.upgraded = False
+        self.dwell = dwell
+
+
+class EncoderTuner:
+    """
+    Вторая ось адаптации: настройки энкодеров под CPU хоста, а не под радиоканал.
+
+    Энкодер не успевает, если его скорость из -progress ниже min_speed overload_samples
+    замеров подряд. Тогда, по порядку:
+    - если у хоста есть запас CPU (ниже host_cpu_high), энкодеру добавляется поток (до max_threads);
+    - иначе пресет x264 сдвигается к более дешёвому (presets — от лучшего качества к самому дешёвому);
+      у процессов без libx264 (v4l2) пресета нет, и этот шаг пропускается;
+    - на самом дешёвом пресете профиль камеры понижается на ступень сверх выбора политики
+      (до max_profile_steps ступеней).
+    Если хост загружен меньше host_cpu_low и энкодер успевает, через dwell секунд изменения
+    откатываются в обратном порядке: сначала профиль, затем пресет. Если энкодер перегрузился
+    вскоре после такого повышения, время ожидания следующего удваивается.
+    Каждое изменение перезапускает процесс, поэтому решения принимаются редко.
+    """
+
+    def __init__(self, ffmpeg: FFMPEGController, policy: SignalPolicyEngine, config: Config):
+        self.ffmpeg = ffmpeg
+        self.policy = policy
+        self.presets = list(config.resources_presets)
+        self.max_threads = config.resources_max_threads or (os.cpu_count() or 1)
+        self.max_profile_steps = config.resources_max_profile_steps
+        self.min_speed = config.resources_min_speed
+        self.host_cpu_high = config.resources_host_cpu_high
+        self.host_cpu_low = config.resources_host_cpu_low
+        self.overload_samples = config.resources_overload_samples
+        self.dwell = config.resources_dwell
+        self.settings = (
+            tuple(self.presets),
+            self.max_threads,
+            self.max_profile_steps,
+            self.min_speed,
+            self.host_cpu_high,
+            self.host_cpu_low,
+            self.overload_samples,
+            self.dwell,
+        )
+        self.states = {}
+        self.adjustments = 0
+
+    def _state(self, instance) -> EncoderTuning:
+        state = self.states.get(instance.device_name)
+        if state is None:
+            preset_index = self.presets.index(instance.preset) if instance.preset in self.presets else len(self.presets) - 1
+            state = EncoderTuning(preset_index, instance.threads, self.dwell, instance.uses_preset)
+            self.states[instance.device_name] = state
+        return state
+
+    def update(self, usage: dict, host_cpu_percent: float = None, now: float = None) -> list[str]:
+        """
+        Принимает замер ResourceSampler и меняет настройки перегруженных или недогруженных энкодеров.
+        Процессы перезапускаются при следующем применении профилей (SignalPolicyEngine.reapply).
+
+        Returns:
+            list: Имена процессов, настройки которых изменились.
+        """
+        now = time.monotonic() if now is None else now
+        instances = self.ffmpeg.instances
+        self.states = {name: state for name, state in self.states.items() if name in instances}
+        changed = []
+        for device_name, instance in instances.items():
+            current = usage.get(device_name)
+            if current is None or current.speed is None:
+                continue
+            state = self._state(instance)
+            if current.speed < self.min_speed:
+                state.overloaded += 1
+                state.healthy_since = None
+            else:
+                state.overloaded = 0
+                if host_cpu_percent is not None and host_cpu_percent < self.host_cpu_low:
+                    state.healthy_since = state.healthy_since if state.healthy_since is not None else now
+                else:
+                    state.healthy_since = None
+
+            if state.overloaded >= self.overload_samples:
+                action = self._step_down(state, host_cpu_percent, now)
+            elif state.healthy_since is not None and now - state.healthy_since >= state.dwell and (
+                state.changed_at is None or now - state.changed_at >= state.dwell
+            ):
+                action = self._step_up(state)
+            else:
+                continue
+            if action is None:
+                continue
+
+            state.changed_at = now
+            state.overloaded = 0
+            state.healthy_since = None
+            self.adjustments += 1
+            changed.append(device_name)
+            instance.set_encoder_options(self.presets[state.preset_index], state.threads)
+            self.policy.set_cpu_steps(instance.device_names, state.profile_steps)
+            logger.info(
+                f"[RESOURCES] {device_name}: {action} (скорость энкодера {current.speed:.2f}x, "
+                f"CPU процесса {current.cpu_percent or 0:.0f}%, хоста {host_cpu_percent or 0:.0f}%), "
+                f"пресет {self.presets[state.preset_index] if state.uses_preset else 'нет'}, "
+                f"потоков {state.threads or 'авто'}, "
+                f"понижение профиля из-за CPU: {state.profile_steps}"
+            )
+        return changed
+
+    def _step_down(self, state: EncoderTuning, host_cpu_percent: float, now: float) -> str:
+        # Перегрузка вскоре после повышения: следующего повышения ждём дольше
+        if state.upgraded and now - state.changed_at < state.dwell:
+            state.dwell = min(state.dwell * 2, self.dwell * 16)
+        state.upgraded = False
+        host_has_headroom = host_cpu_percent is not None and host_cpu_percent < self.host_cpu_high
+        if host_has_headroom and state.threads and state.threads < self.max_threads:
+            state.threads += 1
+            return "добавлен поток"
+        if state.uses_preset and state.preset_index < len(self.presets) - 1:
+            state.preset_index += 1
+            return "более быстрый пресет"
+        if state.profile_steps < self.max_profile_steps:
+            state.profile_steps += 1
+            return "понижение профиля"
+        return None
+
+    def _step_up(self, state: EncoderTuning) -> str:
+        if state.profile_steps > 0:
+            state.profile_steps -= 1
+            action = "возврат профиля"
+        elif state.uses_preset and state.preset_index > 0:
+            state.preset_index -= 1
+            action = "более качественный пресет"
+        else:
+            return None
+        state.upgraded = True
+        return action
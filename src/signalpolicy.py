@@ -1,8 +1,20 @@
 from .rciclient import KeeneticRCIClient
 from .ffmpeg import FFMPEGController
+from .ffmpeg import live_params_supported
+from collections import deque
 from datetime import datetime
+import logging
+import statistics
+import time
 
+from .bandwidth import BandwidthAllocator
+from .bandwidth import estimate_uplink_kbps
+from .bandwidth import parse_kbps
 from .config import Config
+from .rciclient import InterfaceStats
+from .telemetry import TelemetryRing
+from .throughput import ThroughputEstimate
+from .throughput import ThroughputEstimator
 from .logger import LogType
 from .logger import GenericTextLogHandler
 from .logger import get_logger
@@ -11,37 +23,144 @@ from .logger import get_logger
 logger = get_logger(__name__, filename="signalpolicy_log.csv", logType=LogType.FILE, handler=GenericTextLogHandler)
 
 
+class PassthroughFilter:
+    def update(self, value: float) -> float:
+        return value
+
+
+class EWMAFilter:
+    """Экспоненциальное скользящее среднее SNR"""
+
+    def __init__(self, alpha: float):
+        if not 0 < alpha <= 1:
+            raise ValueError("Коэффициент EWMA должен быть в диапазоне (0, 1]")
+        self.alpha = alpha
+        self.value = None
+
+    def update(self, value: float) -> float:
+        self.value = value if self.value is None else self.alpha * value + (1 - self.alpha) * self.value
+        return self.value
+
+
+class MedianFilter:
+    """Медиана по скользящему окну последних замеров SNR"""
+
+    def __init__(self, window: int):
+        if window < 1:
+            raise ValueError("Окно медианного фильтра должно быть больше 0")
+        self.samples = deque(maxlen=window)
+
+    def update(self, value: float) -> float:
+        self.samples.append(value)
+        return statistics.median(self.samples)
+
+
+class SNRTrend:
+    """Линейный тренд SNR (наименьшие квадраты) по последним window замерам"""
+
+    def __init__(self, window: int):
+        if window < 3:
+            raise ValueError("Окно тренда SNR должно быть не меньше 3 замеров")
+        self.samples = deque(maxlen=window)
+        self.slope = None
+        self.level = None
+
+    def update(self, timestamp: float, snr: float) -> float:
+        """
+        Returns:
+            float: Наклон в дБ/с, или None, пока замеров меньше трёх или они в один момент времени.
+        """
+        self.samples.append((timestamp, snr))
+        self.slope = None
+        self.level = None
+        if len(self.samples) < 3:
+            return None
+        mean_time = sum(timestamp for timestamp, _ in self.samples) / len(self.samples)
+        mean_value = sum(value for _, value in self.samples) / len(self.samples)
+        time_variance = sum((timestamp - mean_time) ** 2 for timestamp, _ in self.samples)
+        if time_variance <= 0:
+            return None
+        covariance = sum((timestamp - mean_time) * (value - mean_value) for timestamp, value in self.samples)
+        self.slope = covariance / time_variance
+        # Значение линии тренда в момент последнего замера
+        self.level = mean_value + self.slope * (self.samples[-1][0] - mean_time)
+        return self.slope
+
+    def project(self, horizon: float) -> float:
+        """SNR через horizon секунд после последнего замера, если тренд сохранится"""
+        if self.slope is None:
+            return None
+        return self.level + self.slope * horizon
+
+
+def build_signal_filter(config: Config):
+    if config.policy_filter == "ewma":
+        return EWMAFilter(config.policy_ewma_alpha)
+    if config.policy_filter == "median":
+        return MedianFilter(config.policy_median_window)
+    return PassthroughFilter()
+
+
+def build_profile_ladder(resolution: str, bitrate: str, fps: str, degradation_steps: int, fixed=()) -> list[dict]:
+    """
+    Лестница профилей от базового (индекс 0) до самого деградированного.
+    Параметры из fixed ("resolution", "bitrate", "fps") на всех ступенях остаются базовыми.
+    """
+    if degradation_steps < 1:
+        logger.error("[POLICY] Количество шагов деградации должно быть больше 0")
+        raise ValueError("Количество шагов деградации должно быть больше 0")
+
+    profiles = []
+    for step in range(degradation_steps + 1):
+        width, height = resolution.split("x")
+        width = int(width) - step * (int(width) // degradation_steps)
+        height = int(height) - step * (int(height) // degradation_steps)
+        # Последняя ступень может выродиться из-за целочисленного деления (1280 // 3 * 3 = 1278)
+        if width < 320:
+            width = 320
+        if height < 240:
+            height = 240
+        step_resolution = f"{width}x{height}"
+        step_bitrate = f"{int(int(bitrate.split('k')[0]) * ((degradation_steps - step) / degradation_steps))}k"
+        if int(step_bitrate.split('k')[0]) < 300:
+            step_bitrate = "300k"
+        step_fps = str(int(fps) - step * 3 if int(fps) - step * 3 > 0 else 1)
+        if int(step_fps) < 10:
+            step_fps = "12"
+        profile = {"resolution": step_resolution, "bitrate": step_bitrate, "fps": step_fps}
+        base = {"resolution": resolution, "bitrate": bitrate, "fps": fps}
+        for key in fixed:
+            profile[key] = base[key]
+        profiles.append(profile)
+    return profiles
+
+
+def fixed_profile_params(config: Config) -> set:
+    """
+    Параметры, которые лестницы не меняют. С encoder_mode = live ступени отличаются только
+    тем, что процесс ffmpeg может поменять без перезапуска (LiveFFMPEGInstance); если таких
+    параметров нет, лестницы обычные и каждая ступень перезапускает процесс.
+    """
+    if config.ffmpeg_encoder_mode != "live":
+        return set()
+    live_params = live_params_supported(config.ffmpeg_live_params)
+    if not live_params:
+        return set()
+    return {"resolution", "bitrate", "fps"} - live_params
+
+
 class SignalPolicyEngine:
-    def __init__(self, client: KeeneticRCIClient, ffmpeg: FFMPEGController, config: Config):
+    def __init__(
+        self, client: KeeneticRCIClient, ffmpeg: FFMPEGController, config: Config, telemetry: TelemetryRing = None
+    ):
         self.client = client
         self.ffmpeg = ffmpeg
         self.config = config
+        self.telemetry = telemetry
 
         base_profile = {"resolution": config.resolution, "bitrate": config.bitrate, "fps": config.fps}
         logger.info(f"[POLICY] Инициализация с базовым профилем: {base_profile}")
-        # Degradation steps
-        degradation_steps = config.degradation_steps
-        if degradation_steps < 1:
-            logger.error("[POLICY] Количество шагов деградации должно быть больше 0")
-            raise ValueError("Количество шагов деградации должно быть больше 0")
-
-        self.profiles = []
-        for step in range(degradation_steps + 1):
-            width, height = base_profile["resolution"].split("x")
-            width = int(width) - step * (int(width) // degradation_steps)
-            height = int(height) - step * (int(height) // degradation_steps)
-            if width <= 1:
-                width = 320
-            if height <= 1:
-                height = 240
-            resolution = f"{width}x{height}"
-            bitrate = f"{int(int(base_profile['bitrate'].split('k')[0]) * ((degradation_steps - step) / degradation_steps))}k"
-            if int(bitrate.split('k')[0]) < 300:
-                bitrate = "300k"
-            fps = str(int(base_profile["fps"]) - step * 3 if int(base_profile["fps"]) - step * 3 > 0 else 1)
-            if int(fps) < 10:
-                fps = "12"
-            self.profiles.append({"resolution": resolution, "bitrate": bitrate, "fps": fps})
+        self._build_ladders(config)
 
         # Check if we have any devices configured
         if not config.device_configs:
@@ -50,10 +169,424 @@ class SignalPolicyEngine:
             logger.info(f"[POLICY] Сконфигурировано {len(config.device_configs)} устройств")
             for device_name, device_config in config.device_configs.items():
                 logger.info(f"[POLICY] - Устройство: {device_name}, выход: {device_config.output}")
-                
+
+        self.signal_filter = build_signal_filter(config)
+        self.filtered_snr = None
+        self.current_index = None
+        self.last_switch_at = None
+        self.switch_count = 0
+        self.avoided_switches = 0
+        self._naive_index = None
+
+        # Распределение полосы аплинка между камерами
+        self.allocator = BandwidthAllocator()
+        self.device_indices = {}
+        self.device_switched_at = {}
+        self.uplink_budget = None
+        # Ступени понижения сверх выбора политики, когда узкое место — CPU хоста (EncoderTuner)
+        self.cpu_steps = {}
+
+        # Оценка пропускной способности канала как альтернатива SNR
+        self.throughput = ThroughputEstimator(
+            alpha=config.policy_throughput_alpha, goodput_ratio=config.policy_goodput_ratio
+        )
+        self.throughput_fallbacks = 0
+
+        # Доступность сети и RTT из периодических проверок ConnectionChecker
+        self.connection_ok = None
+        self.connection_rtt = None
+        self._rtt_window = deque(maxlen=30)
+        self.blocked_upgrades = 0
+        self._blocked_at = None
+
+        # Упреждающее понижение по тренду SNR (predictive = true)
+        self.snr_trend = SNRTrend(config.policy_predict_window)
+        self.predicted_snr = None
+        self.prediction_hits = 0
+        self.prediction_misses = 0
+        self.prediction_lead_total = 0.0
+        self.unpredicted_drops = 0
+        self._pending_prediction = None
+
+        self._apply_settings(config)
         logger.info(f"[POLICY] Инициализация завершена с профилями: {self.profiles}")
+        self._log_settings()
+
+    def _build_ladders(self, config: Config):
+        fixed = fixed_profile_params(config)
+        self.profiles = build_profile_ladder(
+            config.resolution, config.bitrate, config.fps, config.degradation_steps, fixed
+        )
+        # Собственная лестница у каждой камеры (секции [device:<имя>] в конфиге)
+        self.device_ladders = {
+            device_name: build_profile_ladder(
+                device_config.resolution,
+                device_config.bitrate,
+                device_config.fps,
+                device_config.degradation_steps,
+                fixed,
+            )
+            for device_name, device_config in config.device_configs.items()
+        }
+        # Профили uniform_profiles по индексу ступени; сбрасываются при смене лестниц и cpu_steps
+        self._uniform_cache = {}
+
+    def _apply_settings(self, config: Config):
+        self.snr_step = config.policy_snr_step
+        self.hysteresis_up = config.policy_hysteresis_up
+        self.hysteresis_down = config.policy_hysteresis_down
+        self.min_dwell_up = config.policy_min_dwell_up
+        self.allocation = config.policy_allocation
+        self.goodput_ratio = config.policy_goodput_ratio
+        self.budget_headroom = config.policy_budget_headroom
+        self.priorities = {name: device_config.priority for name, device_config in config.device_configs.items()}
+        self.weights = {name: device_config.weight for name, device_config in config.device_configs.items()}
+        self.profile_input = config.policy_profile_input
+        self.throughput.alpha = config.policy_throughput_alpha
+        self.throughput.goodput_ratio = config.policy_goodput_ratio
+        self.throughput_min_confidence = config.policy_throughput_min_confidence
+        self.throughput_hysteresis = config.policy_throughput_hysteresis
+        self.rtt_congestion_factor = config.connection_rtt_congestion_factor
+        self.predictive = config.policy_predictive
+        self.predict_horizon = config.policy_predict_horizon
+        self.predict_min_slope = config.policy_predict_min_slope
+
+    def _log_settings(self):
+        if self.allocation == "budget":
+            for device_name, ladder in self.device_ladders.items():
+                logger.info(
+                    f"[POLICY] Лестница {device_name} (приоритет {self.priorities[device_name]}, "
+                    f"вес {self.weights[device_name]}): {ladder}"
+                )
+        logger.info(
+            f"[POLICY] Фильтр SNR: {self.config.policy_filter}, гистерезис вверх/вниз: "
+            f"{self.hysteresis_up}/{self.hysteresis_down} дБ, минимальное время до повышения: {self.min_dwell_up} с"
+        )
+        if self.predictive:
+            logger.info(
+                f"[POLICY] Упреждающее понижение: горизонт {self.predict_horizon} с, "
+                f"окно тренда {self.config.policy_predict_window} замеров, порог спада {self.predict_min_slope} дБ/с"
+            )
+
+    def reload(self, config: Config):
+        """
+        Перестраивает лестницы профилей и параметры политики на месте.
+
+        Текущие индексы, время последних переключений, счётчики и состояние оценщика
+        пропускной способности сохраняются; фильтр SNR пересоздаётся, только если
+        изменились его настройки. Индексы за пределами новой лестницы сдвигаются на её последнюю ступень.
+        """
+        old_config = self.config
+        self.config = config
+        self._build_ladders(config)
+        filter_settings = ("policy_filter", "policy_ewma_alpha", "policy_median_window")
+        if any(getattr(old_config, name) != getattr(config, name) for name in filter_settings):
+            self.signal_filter = build_signal_filter(config)
+        if old_config.policy_predict_window != config.policy_predict_window:
+            self.snr_trend = SNRTrend(config.policy_predict_window)
+        self._apply_settings(config)
+
+        if self.current_index is not None:
+            self.current_index = min(self.current_index, len(self.profiles) - 1)
+        self.device_indices = {
+            device_name: min(index, len(self.device_ladders[device_name]) - 1)
+            for device_name, index in self.device_indices.items()
+            if device_name in self.device_ladders
+        }
+        self.device_switched_at = {
+            device_name: switched_at
+            for device_name, switched_at in self.device_switched_at.items()
+            if device_name in self.device_ladders
+        }
+        self.cpu_steps = {
+            device_name: steps for device_name, steps in self.cpu_steps.items() if device_name in self.device_ladders
+        }
+        logger.info(f"[POLICY] Конфигурация перезагружена, профили: {self.profiles}")
+        self._log_settings()
+
+    def start_safe(self):
+        """
+        Запускает энкодеры на стартовой ступени (startup_index) до первого замера сигнала.
+        Время удержания на неё не распространяется: первый замер может сразу повысить профиль.
+        """
+        index = self.config.policy_startup_index
+        if index < 0:
+            index += len(self.profiles)
+        self.current_index = max(0, min(len(self.profiles) - 1, index))
+        self.last_switch_at = None
+        if self.allocation == "budget":
+            self.device_indices = {
+                device_name: min(self.current_index, len(ladder) - 1)
+                for device_name, ladder in self.device_ladders.items()
+            }
+        logger.info(f"[POLICY] Старт энкодеров на профиле {self.current_index}: {self.profiles[self.current_index]}")
+        self.reapply()
+
+    def device_profiles(self, indices: dict) -> dict:
+        """Профили по индексам камер с учётом понижения из-за CPU хоста"""
+        profiles = {}
+        for device_name, index in indices.items():
+            ladder = self.device_ladders[device_name]
+            profiles[device_name] = ladder[min(index + self.cpu_steps.get(device_name, 0), len(ladder) - 1)]
+        return profiles
+
+    def uniform_profiles(self, profile_index: int) -> dict:
+        """Одна и та же ступень для всех камер, каждая — на своей лестнице"""
+        profiles = self._uniform_cache.get(profile_index)
+        if profiles is None:
+            profiles = self.device_profiles({device_name: profile_index for device_name in self.device_ladders})
+            self._uniform_cache[profile_index] = profiles
+        return profiles
 
-    def evaluate_and_apply(self, signal_data: dict):
+    def set_cpu_steps(self, device_names: list, steps: int):
+        """Камеры кодируются на steps ступеней ниже выбора политики; применяется при следующем reapply"""
+        self._uniform_cache = {}
+        for device_name in device_names:
+            if steps > 0:
+                self.cpu_steps[device_name] = steps
+            else:
+                self.cpu_steps.pop(device_name, None)
+
+    def reapply(self):
+        """Применяет последнее решение политики, например к процессам, созданным при перезагрузке"""
+        if self.current_index is None:
+            return
+        if self.allocation == "budget":
+            for device_name, ladder in self.device_ladders.items():
+                self.device_indices.setdefault(device_name, min(self.current_index, len(ladder) - 1))
+            self.ffmpeg.apply_profiles(self.device_profiles(self.device_indices))
+        else:
+            self.ffmpeg.apply_profiles(self.uniform_profiles(self.current_index))
+
+    def _index_for_snr(self, snr: float) -> int:
+        # Вызывается несколько раз на каждом замере, поэтому без max/min
+        degradation_steps = self.config.degradation_steps
+        if snr <= 0:
+            return degradation_steps
+        profile_index = degradation_steps - int(snr // self.snr_step)
+        return profile_index if profile_index > 0 else 0
+
+    def select_profile_index(self, snr: float, now: float = None) -> int:
+        """
+        Выбирает индекс профиля по SNR с фильтрацией, гистерезисом и временем удержания.
+
+        Понижение качества происходит, как только отфильтрованный SNR опускается ниже
+        границы текущего уровня на hysteresis_down дБ. Повышение — только если SNR выше
+        границы нового уровня на hysteresis_up дБ и с прошлого переключения прошло
+        не меньше min_dwell_up секунд.
+
+        С predictive = true понижение происходит уже тогда, когда SNR, продолженный
+        по тренду на predict_horizon секунд, окажется ниже границы (см. _predict_index).
+        """
+        now = time.monotonic() if now is None else now
+        filtered_snr = self.signal_filter.update(snr)
+        self.filtered_snr = filtered_snr
+        down_index = self._index_for_snr(filtered_snr + self.hysteresis_down)
+        up_index = self._index_for_snr(filtered_snr - self.hysteresis_up)
+        reactive_index = down_index
+
+        predicted_index = self._predict_index(snr, now)
+        if predicted_index is not None:
+            down_index = max(down_index, predicted_index)
+            up_index = max(up_index, predicted_index)
+        if self.current_index is not None and reactive_index > self.current_index and self._pending_prediction is None:
+            self.unpredicted_drops += 1
+
+        previous_index = self.current_index
+        new_index = self._switch_index(
+            self._index_for_snr(filtered_snr), down_index, up_index, self._index_for_snr(snr), now
+        )
+        if previous_index is not None and new_index > previous_index and new_index > reactive_index:
+            self._pending_prediction = (now, new_index, now + self.predict_horizon)
+            logger.info(
+                f"[POLICY] Упреждающее понижение до профиля {new_index}: прогноз SNR через "
+                f"{self.predict_horizon} с — {self.predicted_snr:.1f} дБ, тренд {self.snr_trend.slope:+.2f} дБ/с"
+            )
+        return new_index
+
+    def _predict_index(self, snr: float, now: float) -> int:
+        """
+        Индекс профиля по SNR, продолженному по тренду на predict_horizon секунд,
+        или None, если прогноз выключен или SNR падает медленнее predict_min_slope дБ/с.
+
+        Заодно оценивает прошлое упреждающее понижение: попадание — если текущий SNR
+        (значение линии тренда, без задержки фильтра) в пределах горизонта действительно
+        опустился до уровня этого профиля, промах — если нет.
+        """
+        if not self.predictive:
+            self.predicted_snr = None
+            return None
+        slope = self.snr_trend.update(now, snr)
+        pending = self._pending_prediction
+        if pending is not None:
+            made_at, index, deadline = pending
+            level = self.snr_trend.level if self.snr_trend.level is not None else snr
+            if self._index_for_snr(level + self.hysteresis_down) >= index:
+                self.prediction_hits += 1
+                self.prediction_lead_total += now - made_at
+                self._pending_prediction = None
+            elif now > deadline:
+                self.prediction_misses += 1
+                self._pending_prediction = None
+
+        if slope is None or slope > -self.predict_min_slope:
+            self.predicted_snr = None
+            return None
+        self.predicted_snr = self.snr_trend.project(self.predict_horizon)
+        return self._index_for_snr(self.predicted_snr + self.hysteresis_down)
+
+    def _index_for_goodput(self, goodput_kbps: float) -> int:
+        """Лучший профиль, который для всех камер сразу помещается в goodput с запасом budget_headroom"""
+        streams = max(1, len(self.config.device_configs))
+        budget = goodput_kbps * self.budget_headroom
+        for index, profile in enumerate(self.profiles):
+            if parse_kbps(profile["bitrate"]) * streams <= budget:
+                return index
+        return len(self.profiles) - 1
+
+    def select_profile_index_by_throughput(self, estimate: ThroughputEstimate, snr: float, now: float = None) -> int:
+        """
+        Выбирает индекс профиля по оценке goodput (profile_input = throughput).
+
+        Понижение — как только профиль перестаёт помещаться в оценку, повышение — только
+        если новый профиль помещается с запасом throughput_hysteresis и прошло min_dwell_up секунд.
+        """
+        now = time.monotonic() if now is None else now
+        # SNR продолжает фильтроваться, чтобы переход обратно на него был плавным
+        self.filtered_snr = self.signal_filter.update(snr)
+        goodput = estimate.goodput_kbps
+        down_index = self._index_for_goodput(goodput)
+        return self._switch_index(
+            down_index,
+            down_index,
+            self._index_for_goodput(goodput / (1 + self.throughput_hysteresis)),
+            self._index_for_goodput(estimate.raw_kbps),
+            now,
+        )
+
+    def update_connection(self, result):
+        """
+        Принимает результат ConnectionChecker.check_all().
+
+        Пока сеть недоступна или RTT выше минимального за последние проверки
+        в rtt_congestion_factor раз (очередь в канале растёт), повышение профиля запрещено.
+        """
+        self.connection_ok = result.ok
+        self.connection_rtt = result.rtt
+        if result.rtt is not None:
+            self._rtt_window.append(result.rtt)
+
+    @property
+    def rtt_baseline(self) -> float:
+        return min(self._rtt_window) if self._rtt_window else None
+
+    def upgrades_blocked(self) -> bool:
+        if self.connection_ok is False:
+            return True
+        baseline = self.rtt_baseline
+        return (
+            self.connection_rtt is not None
+            and baseline is not None
+            and self.connection_rtt > baseline * self.rtt_congestion_factor
+        )
+
+    def _block_upgrade(self, now: float):
+        """Учитывает отложенное повышение один раз за такт, даже если его отложили и общий индекс, и бюджет"""
+        if self._blocked_at == now:
+            return
+        self._blocked_at = now
+        self.blocked_upgrades += 1
+        logger.info(
+            f"[POLICY] Повышение профиля отложено: сеть доступна: {self.connection_ok}, "
+            f"RTT: {self.connection_rtt}, базовый RTT: {self.rtt_baseline}"
+        )
+
+    def _switch_index(self, initial_index: int, down_index: int, up_index: int, naive_index: int, now: float) -> int:
+        if self.current_index is None:
+            new_index = initial_index
+        else:
+            new_index = self.current_index
+            if down_index > self.current_index:
+                new_index = down_index
+            elif up_index < self.current_index:
+                if self.upgrades_blocked():
+                    self._block_upgrade(now)
+                elif self.last_switch_at is None or now - self.last_switch_at >= self.min_dwell_up:
+                    new_index = up_index
+
+        # Переключение, которое сделала бы политика "сырой замер → профиль", но не сделали мы
+        if self._naive_index is not None and naive_index != self._naive_index and new_index == self.current_index:
+            self.avoided_switches += 1
+        self._naive_index = naive_index
+
+        if new_index != self.current_index:
+            if self.current_index is not None:
+                self.switch_count += 1
+            self.current_index = new_index
+            self.last_switch_at = now
+        return new_index
+
+    def update_throughput(self, signal_data: dict, stats: InterfaceStats = None, now: float = None):
+        """Подаёт в оценщик счётчики интерфейса, канальную скорость и выход энкодеров"""
+        now = time.monotonic() if now is None else now
+        if stats is None and self.client is not None and self.client.last_poll is not None:
+            stats = self.client.last_poll.stats
+        encoder_bytes = None
+        if self.ffmpeg is not None:
+            progress = self.ffmpeg.get_progress()
+            if progress:
+                encoder_bytes = sum(item.total_size for item in progress.values())
+        return self.throughput.update(
+            now, stats.txbytes if stats is not None else None, signal_data.get("rate"), encoder_bytes
+        )
+
+    def allocate_profiles(self, rate, profile_index: int, now: float = None, uplink_kbps: float = None) -> dict:
+        """
+        Индексы профилей по камерам в режиме allocation = budget.
+
+        Бюджет — оценка полосы аплинка по канальной скорости и отфильтрованному SNR
+        с запасом budget_headroom; его делит BandwidthAllocator с учётом приоритетов и весов.
+        Понижение применяется сразу, повышение — не раньше min_dwell_up секунд после
+        прошлого переключения этой камеры и только если upgrades_blocked() не сообщает
+        о перегрузке сети. Если роутер не сообщил скорость канала,
+        все камеры получают общий индекс по SNR (в пределах своей лестницы).
+        uplink_kbps заменяет оценку по скорости канала (оценка ThroughputEstimator).
+        При упреждающем понижении берётся меньшее из отфильтрованного и прогнозного SNR.
+        """
+        now = time.monotonic() if now is None else now
+        uplink = uplink_kbps
+        if uplink is None:
+            snr = self.filtered_snr
+            if self.predicted_snr is not None:
+                snr = min(snr, self.predicted_snr)
+            uplink = estimate_uplink_kbps(rate, snr, self.goodput_ratio)
+        if uplink is None:
+            self.uplink_budget = None
+            targets = {
+                device_name: min(profile_index, len(ladder) - 1) for device_name, ladder in self.device_ladders.items()
+            }
+        else:
+            self.uplink_budget = uplink * self.budget_headroom
+            targets = self.allocator.allocate(self.uplink_budget, self.device_ladders, self.priorities, self.weights)
+
+        blocked = None
+        for device_name, target in targets.items():
+            current = self.device_indices.get(device_name)
+            if current is not None and target < current:
+                # Повышение по бюджету откладывается по тем же признакам перегрузки сети, что и общее
+                if blocked is None:
+                    blocked = self.upgrades_blocked()
+                    if blocked:
+                        self._block_upgrade(now)
+                switched_at = self.device_switched_at.get(device_name)
+                if blocked or (switched_at is not None and now - switched_at < self.min_dwell_up):
+                    target = current
+            if target != current:
+                self.device_indices[device_name] = target
+                self.device_switched_at[device_name] = now
+        return dict(self.device_indices)
+
+    def evaluate_and_apply(self, signal_data: dict, now: float = None, stats: InterfaceStats = None):
         """
         Evaluates the signal-to-noise ratio (SNR) based on the provided signal data
         and applies the appropriate profile settings to all active devices.
@@ -62,12 +595,23 @@ class SignalPolicyEngine:
             signal_data (dict): A dictionary containing signal information. Expected keys:
                 - "rssi" (int): Received Signal Strength Indicator. Defaults to -100 if not provided.
                 - "noise" (int): Noise level. Defaults to -100 if not provided.
+            now (float): Sample time in seconds (monotonic clock by default,
+                trace timestamps when replaying recorded signal logs).
+            stats (InterfaceStats): Interface counters for the throughput estimator;
+                taken from the client's last poll if not provided.
 
         Behavior:
             - Calculates the SNR as the difference between RSSI and noise.
             - Logs the SNR, RSSI, and noise values with a timestamp.
-            - Selects a profile based on the SNR value.
-            - Applies the selected profile to all active devices.
+            - Selects a profile based on the filtered SNR value, with hysteresis
+              and a minimum dwell time before upgrading (see select_profile_index),
+              or, with profile_input = throughput, on the estimated goodput while
+              its confidence is high enough.
+            - Applies the selected step of each device's ladder to all devices or, with
+              allocation = budget, splits the estimated uplink across devices
+              by priority and weight (see allocate_profiles).
+            - Records the tick (signal, chosen profile, actual encoder bitrates)
+              in the telemetry ring buffer, if one is attached.
 
         Returns:
             None
@@ -75,14 +619,48 @@ class SignalPolicyEngine:
         rssi = int(signal_data.get("rssi", -100))
         noise = int(signal_data.get("noise", -100))
         snr = rssi - noise
-        logger.info(f"[SIGNAL INFO] SNR: {snr}, RSSI: {rssi}, NOISE: {noise}")
+        # Строки журнала на каждом замере собираются, только если INFO включён (при воспроизведении трасс — нет)
+        verbose = logger.isEnabledFor(logging.INFO)
+        if verbose:
+            logger.info(f"[SIGNAL INFO] SNR: {snr}, RSSI: {rssi}, NOISE: {noise}")
 
-        degradation_steps = self.config.degradation_steps
-        effective_snr = max(snr, 0)
-        profile_index = degradation_steps - (effective_snr // 10)
-        profile_index = max(0, min(degradation_steps, profile_index))
+        estimate = self.update_throughput(signal_data, stats, now)
+        confident = estimate.goodput_kbps is not None and estimate.confidence >= self.throughput_min_confidence
+        if self.profile_input == "throughput" and confident:
+            if verbose:
+                logger.info(
+                    f"[POLICY] Оценка goodput: {estimate.goodput_kbps:.0f} кбит/с, "
+                    f"достоверность: {estimate.confidence:.2f}"
+                )
+            profile_index = self.select_profile_index_by_throughput(estimate, snr, now)
+        else:
+            if self.profile_input == "throughput":
+                self.throughput_fallbacks += 1
+                if verbose:
+                    logger.info(f"[POLICY] Оценка goodput недостоверна ({estimate.confidence:.2f}), выбор по SNR")
+            profile_index = self.select_profile_index(snr, now)
         profile = self.profiles[profile_index]
-        
-        # Apply the selected profile to all devices
-        logger.info(f"[POLICY] Применение профиля {profile} ко всем устройствам")
-        self.ffmpeg.restart_if_needed(profile)
+        if verbose:
+            logger.info(
+                f"[POLICY] Индекс профиля: {profile_index}, переключений: {self.switch_count}, "
+                f"предотвращено переключений: {self.avoided_switches}"
+            )
+
+        if self.allocation == "budget":
+            uplink = estimate.goodput_kbps if self.profile_input == "throughput" and confident else None
+            indices = self.allocate_profiles(signal_data.get("rate"), profile_index, now, uplink)
+            if verbose:
+                budget = f"{self.uplink_budget:.0f} кбит/с" if self.uplink_budget is not None else "неизвестен"
+                logger.info(f"[POLICY] Бюджет аплинка: {budget}, индексы профилей по устройствам: {indices}")
+            self.ffmpeg.apply_profiles(self.device_profiles(indices))
+        else:
+            # Apply the selected profile to all devices
+            if verbose:
+                logger.info(f"[POLICY] Применение профиля {profile} ко всем устройствам")
+            self.ffmpeg.apply_profiles(self.uniform_profiles(profile_index))
+
+        if self.telemetry is not None:
+            bitrates = {
+                device_name: progress.bitrate_kbps for device_name, progress in self.ffmpeg.get_progress().items()
+            }
+            self.telemetry.record(time.time(), rssi, noise, signal_data.get("rate"), profile_index, bitrates)
@@ -0,0 +1,476 @@
+import asyncio
+import os
+import time
+
+from .bandwidth import estimate_uplink_kbps
+from .config import Config
+from .connection_checker import ConnectionChecker
+from .ffmpeg import FFMPEGController
+from .ffmpeg import RestartBackoff
+from .metrics import Histogram
+from .polling import RateMeter
+from .polling import build_poll_scheduler
+from .rciclient import KeeneticRCIClient
+from .resources import EncoderTuner
+from .resources import ResourceSampler
+from .signalpolicy import SignalPolicyEngine
+
+from .logger import get_logger
+from .logger import LogType
+from .logger import GenericTextLogHandler
+
+logger = get_logger(__name__, filename="supervisor_log.csv", logType=LogType.BOTH, handler=GenericTextLogHandler)
+
+
+class Supervisor:
+    """
+    Асинхронный рантайм демона.
+
+    Опрос RCI, применение политики, надзор за ffmpeg и проверки соединения
+    работают как независимые задачи со своим расписанием. Блокирующие вызовы
+    уходят в пул потоков, поэтому медленный роутер или долгий рестарт
+    энкодеров не сдвигает такты опроса сигнала.
+    """
+
+    def __init__(
+        self,
+        config: Config,
+        client: KeeneticRCIClient,
+        ffmpeg: FFMPEGController,
+        policy: SignalPolicyEngine,
+        checker: ConnectionChecker = None,
+        started_at: float = None,
+    ):
+        self.config = config
+        self.client = client
+        self.ffmpeg = ffmpeg
+        self.policy = policy
+        self.checker = checker
+        self.relay = ffmpeg.relay
+
+        self.poll_interval = float(config.timeout)
+        # None — фиксированный период poll_interval
+        self.poll_scheduler = build_poll_scheduler(config)
+        self.poll_rate = RateMeter()
+        self.router_request_rate = RateMeter()
+        self._router_requests_seen = 0
+        self._last_logged_interval = None
+        self.supervise_interval = config.supervise_interval
+        self.connection_check_interval = config.connection_check_interval
+        self.reload_check_interval = config.reload_check_interval
+        self.resources_interval = config.resources_interval
+        self.resources = ResourceSampler()
+        self.tuner = EncoderTuner(ffmpeg, policy, config) if config.resources_tuning else None
+
+        self.latest_signal = None
+        self.samples_taken = 0
+        self.samples_failed = 0
+        self.ticks_skipped = 0
+        self.samples_dropped = 0
+        self.poll_jitter = Histogram()
+        self.reload_count = 0
+        self.reload_failures = 0
+        # Холодный старт: энкодеры запускаются сразу, роутер подключается в фоне
+        self.started_at = started_at if started_at is not None else time.monotonic()
+        self.client_ready = False
+        self.auth_failures = 0
+        self.startup_first_frame = {}
+        self.startup_first_frame_all = None
+
+        self._stop_event = None
+        self._signal_event = None
+        self._reload_event = None
+        self._poll_wakeup = None
+        self._policy_lock = None
+        self._poll_task = None
+        self._tasks = {}
+        self._task_intervals = {}
+        self._startup_tasks = []
+
+    def stop(self):
+        """Запрос на остановку всех задач (безопасно вызывать из обработчика сигнала)"""
+        if self._stop_event is not None and not self._stop_event.is_set():
+            logger.info("[SUPERVISOR] Инициирована остановка.")
+            self._stop_event.set()
+
+    def request_reload(self):
+        """Запрос на перечитывание конфигурации (безопасно вызывать из обработчика SIGHUP)"""
+        if self._reload_event is not None:
+            self._reload_event.set()
+
+    def _wanted_tasks(self) -> dict:
+        """Задачи, которые должны работать при текущих настройках: имя → (фабрика корутины, период)"""
+        wanted = {
+            "signal-sampling": (self._sample_signal, self._poll_schedule()),
+            "policy": (self._apply_policy, None),
+            "ffmpeg-supervision": (self._supervise_ffmpeg, self.supervise_interval),
+            "config-reload": (self._watch_config, self.reload_check_interval),
+        }
+        if self.resources_interval > 0:
+            wanted["resource-sampling"] = (self._sample_resources, self.resources_interval)
+        if self.checker is not None and self.config.connection_check and self.connection_check_interval > 0:
+            wanted["connection-check"] = (self._check_connection, self.connection_check_interval)
+        return wanted
+
+    def _poll_schedule(self):
+        """Настройки расписания опроса; задача опроса перезапускается, если они изменились"""
+        return self.poll_interval if self.poll_scheduler is None else self.poll_scheduler.settings
+
+    @property
+    def current_poll_interval(self) -> float:
+        return self.poll_interval if self.poll_scheduler is None else self.poll_scheduler.interval
+
+    def _sync_tasks(self):
+        """Запускает недостающие задачи и перезапускает те, у которых изменился период"""
+        wanted = self._wanted_tasks()
+        for name in list(self._tasks):
+            if name not in wanted or self._task_intervals[name] != wanted[name][1]:
+                self._tasks.pop(name).cancel()
+                del self._task_intervals[name]
+        for name, (factory, interval) in wanted.items():
+            if name not in self._tasks:
+                self._tasks[name] = asyncio.create_task(factory(), name=name)
+                self._task_intervals[name] = interval
+
+    async def run(self):
+        self._stop_event = asyncio.Event()
+        self._signal_event = asyncio.Event()
+        self._reload_event = asyncio.Event()
+        self._poll_wakeup = asyncio.Event()
+        self._policy_lock = asyncio.Lock()
+
+        # Энкодеры стартуют до любого обращения к сети
+        try:
+            async with self._policy_lock:
+                await asyncio.to_thread(self.policy.start_safe)
+        except Exception as e:
+            logger.error(f"[SUPERVISOR] Ошибка запуска энкодеров на стартовом профиле: {e}")
+        self._startup_tasks = [
+            asyncio.create_task(self._report_first_frames(), name="startup-first-frame"),
+            asyncio.create_task(self._connect(), name="router-connect"),
+        ]
+        if self.checker is not None:
+            self._startup_tasks.append(asyncio.create_task(self._initial_check(), name="initial-connection-check"))
+
+        self._sync_tasks()
+        if self.poll_scheduler is None:
+            schedule = f"{self.poll_interval} с"
+        else:
+            schedule = f"адаптивный, {self.poll_scheduler.min_interval}..{self.poll_scheduler.max_interval} с"
+        logger.info(f"[SUPERVISOR] Старт {len(self._tasks)} задач, период опроса сигнала: {schedule}")
+        try:
+            await self._stop_event.wait()
+        finally:
+            tasks = list(self._tasks.values()) + self._startup_tasks
+            self._tasks.clear()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await asyncio.to_thread(self.ffmpeg.stop)
+            if self.checker is not None:
+                self.checker.close()
+            if self.relay is not None:
+                logger.info(f"[SUPERVISOR] Ретранслятор: {self.relay.summary() or 'потоков нет'}")
+                await asyncio.to_thread(self.relay.stop)
+            logger.info(
+                f"[SUPERVISOR] Остановлено. Опросов: {self.samples_taken}, ошибок: {self.samples_failed}, "
+                f"пропущено тактов: {self.ticks_skipped}, вытеснено замеров: {self.samples_dropped}"
+            )
+            uptime = time.monotonic() - self.started_at
+            if uptime > 0:
+                logger.info(
+                    f"[SUPERVISOR] Средняя частота опроса: {self.samples_taken / uptime:.2f} Гц, "
+                    f"нагрузка на роутер: {self.client.stats.requests / uptime:.2f} запросов/с"
+                )
+            logger.info(f"[SUPERVISOR] Статистика RCI: {self.client.stats.summary()}")
+
+    async def _every(self, interval: float):
+        """
+        Генератор тактов с фиксированным расписанием.
+        Если такт пропущен, расписание не сдвигается, а догоняет ближайший следующий.
+        """
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        while True:
+            yield
+            next_tick += interval
+            now = loop.time()
+            if next_tick < now:
+                missed = int((now - next_tick) // interval) + 1
+                next_tick += missed * interval
+            await asyncio.sleep(next_tick - now)
+
+    async def _adaptive_ticks(self):
+        """
+        Такты с периодом от планировщика опроса. Период пересчитывается после каждого
+        замера и переключения; если он сократился, ожидание текущего такта тоже сокращается.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            tick_at = loop.time()
+            yield
+            while True:
+                self._poll_wakeup.clear()
+                delay = tick_at + self.poll_scheduler.interval - loop.time()
+                if delay <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(self._poll_wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    break
+
+    async def _sample_signal(self):
+        loop = asyncio.get_running_loop()
+        last_tick = None
+        last_interval = None
+        ticks = self._every(self.poll_interval) if self.poll_scheduler is None else self._adaptive_ticks()
+        async for _ in ticks:
+            now = loop.time()
+            if last_tick is not None:
+                self.poll_jitter.observe(abs(now - last_tick - last_interval))
+            last_tick = now
+            last_interval = self.current_poll_interval
+            if not self.client_ready:
+                # Аутентификацию с повторами ведёт _connect, здесь роутер не дёргаем
+                continue
+            if self._poll_task is not None and not self._poll_task.done():
+                # Роутер ещё не ответил на прошлый запрос: второй не отправляем,
+                # но и расписание не сдвигаем.
+                self.ticks_skipped += 1
+                logger.warning("[SIGNAL POLICY] Роутер не ответил за период опроса, такт пропущен.")
+                continue
+            self._poll_task = asyncio.create_task(self._poll_once())
+
+    async def _connect(self):
+        """Аутентификация на роутере с повторами; до её успеха политика держит стартовый профиль"""
+        backoff = RestartBackoff(self.config.auth_retry_initial, self.config.auth_retry_max)
+        while not await asyncio.to_thread(self.client.authenticate):
+            self.auth_failures += 1
+            delay = backoff.delay(self.auth_failures)
+            logger.error(f"[SUPERVISOR] Аутентификация на роутере не удалась, повтор через {delay:.1f} с")
+            await asyncio.sleep(delay)
+        self.client_ready = True
+        logger.info(f"[SUPERVISOR] Роутер подключён через {time.monotonic() - self.started_at:.3f} с после старта")
+        # Первый замер — сразу, не дожидаясь такта опроса
+        if self._poll_task is None or self._poll_task.done():
+            self._poll_task = asyncio.create_task(self._poll_once())
+
+    async def _initial_check(self):
+        try:
+            connection = await asyncio.to_thread(self.checker.check_all)
+        except Exception as e:
+            logger.error(f"[CONNECTION CHECKER] Ошибка во время начальной проверки соединения: {e}")
+            return
+        # Без периодических проверок результат устарел бы навсегда и держал бы политику
+        if self.config.connection_check:
+            self.policy.update_connection(connection)
+        if connection:
+            logger.info(f"[CONNECTION CHECKER] Начальные проверки соединения прошли успешно: {connection}")
+        else:
+            logger.error(f"[CONNECTION CHECKER] Ошибка при начальной проверке соединения: {connection}")
+
+    async def _report_first_frames(self):
+        """Время от запуска демона до первого кадра каждого энкодера"""
+        pending = set(self.ffmpeg.instances)
+        while pending:
+            for device_name in list(pending):
+                instance = self.ffmpeg.instances.get(device_name)
+                if instance is None:
+                    pending.discard(device_name)
+                elif instance.watcher is not None and instance.watcher.first_frame.is_set():
+                    self.startup_first_frame[device_name] = instance.watcher.first_frame_at - self.started_at
+                    pending.discard(device_name)
+            await asyncio.sleep(0.02)
+        if self.startup_first_frame:
+            self.startup_first_frame_all = max(self.startup_first_frame.values())
+            logger.info(
+                f"[SUPERVISOR] Первый кадр на всех выходах через {self.startup_first_frame_all:.3f} с после старта: "
+                + ", ".join(f"{name} {seconds:.3f} с" for name, seconds in self.startup_first_frame.items())
+            )
+
+    async def _poll_once(self):
+        try:
+            signal_info = await asyncio.to_thread(self.client.get_signal_info)
+        except Exception as e:
+            signal_info = None
+            logger.error(f"[SIGNAL POLICY] Ошибка запроса к роутеру: {e}")
+        if not signal_info:
+            self.samples_failed += 1
+            logger.error("[SIGNAL POLICY] Не удалось получить информацию о качестве соединения.")
+            return
+        self.samples_taken += 1
+        now = time.monotonic()
+        self.poll_rate.mark(now)
+        self.router_request_rate.mark(now, self.client.stats.requests - self._router_requests_seen)
+        self._router_requests_seen = self.client.stats.requests
+        logger.info(f"[SIGNAL POLICY] Получена информация о качестве соединения: {signal_info}")
+        if self.poll_scheduler is not None:
+            try:
+                snr = int(signal_info.get("rssi", -100)) - int(signal_info.get("noise", -100))
+            except (TypeError, ValueError):
+                snr = None
+            if snr is not None:
+                self._reschedule(self.poll_scheduler.observe(now, snr))
+        if self._signal_event.is_set():
+            self.samples_dropped += 1
+        self.latest_signal = signal_info
+        self._signal_event.set()
+
+    async def _apply_policy(self):
+        while True:
+            await self._signal_event.wait()
+            self._signal_event.clear()
+            # Пока политика применяется, новые замеры только перезаписывают
+            # latest_signal, так что следующим будет обработан самый свежий.
+            signal_info = self.latest_signal
+            decision = self._policy_decision()
+            try:
+                async with self._policy_lock:
+                    await asyncio.to_thread(self.policy.evaluate_and_apply, signal_info)
+                if self.relay is not None and self.policy.filtered_snr is not None:
+                    # Ретранслятор выравнивает отправку под ту же оценку аплинка, что и бюджет политики
+                    self.relay.follow(
+                        estimate_uplink_kbps(
+                            signal_info.get("rate"), self.policy.filtered_snr, self.policy.goodput_ratio
+                        )
+                    )
+                if self.poll_scheduler is not None and self._policy_decision() != decision:
+                    self._reschedule(self.poll_scheduler.notify_switch(time.monotonic()))
+            except Exception as e:
+                logger.error(f"[POLICY] Ошибка применения политики: {e}")
+
+    def _policy_decision(self):
+        return self.policy.switch_count, dict(self.policy.device_indices)
+
+    def _reschedule(self, interval: float):
+        """Новый период опроса от планировщика; сокращение применяется к текущему такту"""
+        if interval != self._last_logged_interval:
+            spread, trend = self.poll_scheduler.spread, self.poll_scheduler.trend
+            logger.info(
+                f"[SUPERVISOR] Период опроса: {interval:.2f} с"
+                + (f" (разброс SNR: {spread:.1f} дБ, тренд: {trend:+.2f} дБ/с)" if spread is not None else "")
+            )
+            self._last_logged_interval = interval
+        if self._poll_wakeup is not None:
+            self._poll_wakeup.set()
+
+    async def _supervise_ffmpeg(self):
+        async for _ in self._every(self.supervise_interval):
+            try:
+                await asyncio.to_thread(self.ffmpeg.supervise)
+            except Exception as e:
+                logger.error(f"[FFMPEG] Ошибка надзора за процессами: {e}")
+
+    async def _sample_resources(self):
+        """Замер CPU/RSS энкодеров; с tuning = true — подстройка энкодеров под CPU хоста"""
+        async for _ in self._every(self.resources_interval):
+            try:
+                usage = await asyncio.to_thread(self.resources.sample, self.ffmpeg)
+                if self.tuner is None or not self.tuner.update(usage, self.resources.host_cpu_percent):
+                    continue
+                # Новые настройки энкодеров и понижение профиля применяются перезапуском процессов
+                async with self._policy_lock:
+                    await asyncio.to_thread(self.policy.reapply)
+            except Exception as e:
+                logger.error(f"[RESOURCES] Ошибка замера ресурсов энкодеров: {e}")
+
+    async def _check_connection(self):
+        async for _ in self._every(self.connection_check_interval):
+            try:
+                connection = await asyncio.to_thread(self.checker.check_all)
+            except Exception as e:
+                logger.error(f"[CONNECTION CHECKER] Ошибка периодической проверки соединения: {e}")
+                continue
+            self.policy.update_connection(connection)
+            if connection:
+                logger.info(f"[CONNECTION CHECKER] Периодическая проверка соединения прошла успешно: {connection}")
+            else:
+                logger.error(f"[CONNECTION CHECKER] Периодическая проверка соединения не прошла: {connection}")
+
+    def _config_mtime(self):
+        try:
+            return os.stat(self.config.path).st_mtime_ns
+        except OSError:
+            return None
+
+    async def _watch_config(self):
+        """Перечитывает конфигурацию по SIGHUP или при изменении файла (reload_check_interval = 0 — только SIGHUP)"""
+        last_mtime = self._config_mtime()
+        while True:
+            timeout = self.reload_check_interval if self.reload_check_interval > 0 else None
+            try:
+                await asyncio.wait_for(self._reload_event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            mtime = self._config_mtime()
+            if not self._reload_event.is_set() and mtime == last_mtime:
+                continue
+            self._reload_event.clear()
+            last_mtime = mtime
+            await self.reload()
+
+    async def reload(self) -> bool:
+        """
+        Перечитывает конфигурацию и применяет её без остановки демона.
+
+        Энкодеры, чьи камеры и параметры запуска не изменились, продолжают работать;
+        политика перестраивает лестницы на месте и сразу применяет последнее решение,
+        так что новые камеры запускаются, не дожидаясь следующего замера сигнала.
+        Если файл не читается, остаётся прежняя конфигурация.
+        """
+        try:
+            config = await asyncio.to_thread(Config, self.config.path, self.config.overrides)
+            scheduler = build_poll_scheduler(config)
+            tuner = EncoderTuner(self.ffmpeg, self.policy, config) if config.resources_tuning else None
+        except Exception as e:
+            self.reload_failures += 1
+            logger.error(f"[SUPERVISOR] Конфигурация {self.config.path} не применена: {e}")
+            return False
+
+        async with self._policy_lock:
+            try:
+                await asyncio.to_thread(self._apply_config, config, tuner)
+            except Exception as e:
+                self.reload_failures += 1
+                logger.error(f"[SUPERVISOR] Ошибка применения новой конфигурации: {e}")
+                return False
+
+        self.poll_interval = float(config.timeout)
+        # Планировщик с прежними настройками сохраняет накопленную историю сигнала
+        if scheduler is None or self.poll_scheduler is None or scheduler.settings != self.poll_scheduler.settings:
+            self.poll_scheduler = scheduler
+        self.resources_interval = config.resources_interval
+        self.supervise_interval = config.supervise_interval
+        self.connection_check_interval = config.connection_check_interval
+        self.reload_check_interval = config.reload_check_interval
+        self.reload_count += 1
+        # Задачи с изменившимся периодом перезапускаются; сама эта задача при этом может быть отменена
+        self._sync_tasks()
+        return True
+
+    def _apply_config(self, config: Config, tuner: EncoderTuner = None):
+        if self.client.reload(config):
+            logger.info("[SUPERVISOR] Изменились адрес роутера или учётные данные, повторная аутентификация")
+            self.client.authenticate()
+        previous_defaults = (self.config.resources_presets[-1], self.ffmpeg.default_threads)
+        changes = self.ffmpeg.reconcile(config)
+        if self.relay is not None:
+            self.relay.configure(config)
+        if config.relay_enabled != (self.relay is not None):
+            logger.warning("[SUPERVISOR] Включение и выключение ретранслятора применяется только после перезапуска")
+        self.policy.reload(config)
+        tuning_changed = (tuner and tuner.settings) != (self.tuner and self.tuner.settings)
+        # С threads = auto доля ядер меняется и при изменении числа камер
+        defaults_changed = previous_defaults != (config.resources_presets[-1], self.ffmpeg.default_threads)
+        if tuning_changed or defaults_changed:
+            # Подстройка под CPU начинается заново с исходных настроек энкодеров
+            self.tuner = tuner
+            self.policy.cpu_steps.clear()
+            for instance in self.ffmpeg.instances.values():
+                instance.set_encoder_options(config.resources_presets[-1], self.ffmpeg.default_threads)
+        self.policy.reapply()
+        self.config = config
+        logger.info(
+            f"[SUPERVISOR] Конфигурация перезагружена: новых процессов {len(changes['added'])}, "
+            f"остановлено {len(changes['removed'])}, без изменений {len(changes['kept'])}"
+        )
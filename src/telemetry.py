@@ -0,0 +1,219 @@
+import math
+import mmap
+import os
+import struct
+import threading
+import zlib
+from array import array
+
+from .logger import get_logger
+from .logger import LogType
+from .logger import GenericTextLogHandler
+
+logger = get_logger(__name__, filename="telemetry_log.csv", logType=LogType.FILE, handler=GenericTextLogHandler)
+
+BASE_FIELDS = ("timestamp", "rssi", "noise", "snr", "rate", "profile_index")
+
+# magic, версия, число колонок, crc32 имён колонок, ёмкость, число записанных строк
+_HEADER = struct.Struct("<8sIIIIQ")
+_COUNT = struct.Struct("<Q")
+_MAGIC = b"KNTELEM1"
+_VERSION = 1
+_ITEM = struct.calcsize("d")
+
+
+class WindowStats:
+    """Результат оконного запроса. Объект можно переиспользовать между запросами."""
+
+    __slots__ = ("count", "min", "max", "mean", "p50", "p95")
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.min = math.nan
+        self.max = math.nan
+        self.mean = math.nan
+        self.p50 = math.nan
+        self.p95 = math.nan
+
+    def as_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class TelemetryRing:
+    """
+    Кольцевой буфер телеметрии фиксированного размера: одна строка на такт политики
+    (rssi, noise, SNR, скорость канала, индекс профиля и фактический битрейт каждого энкодера).
+
+    Данные лежат в одном плоском массиве double, поэтому память не растёт со временем.
+    Если задан path, буфер отображается в файл (mmap) и переживает перезапуск демона.
+    Пропущенные значения хранятся как NaN и не учитываются в статистике.
+    """
+
+    def __init__(self, capacity: int, device_names, path: str = None):
+        if capacity < 1:
+            raise ValueError("Ёмкость буфера телеметрии должна быть больше 0")
+        self.capacity = capacity
+        self.fields = BASE_FIELDS + tuple(f"bitrate:{device_name}" for device_name in device_names)
+        self.columns = {name: index for index, name in enumerate(self.fields)}
+        self.width = len(self.fields)
+        self.path = path
+        self._lock = threading.Lock()
+        # Рабочий массив для перцентилей, выделяется один раз
+        self._scratch = array("d", bytes(capacity * _ITEM))
+
+        size = _HEADER.size + capacity * self.width * _ITEM
+        self._mmap = None
+        self._file = None
+        if path:
+            self._buffer = self._open_mapped(path, size)
+        else:
+            self._buffer = bytearray(size)
+            self._write_header(0)
+        self._data = memoryview(self._buffer)[_HEADER.size :].cast("d")
+        self.count = _HEADER.unpack_from(self._buffer, 0)[5]
+        if self.count:
+            logger.info(f"[TELEMETRY] Восстановлено {min(self.count, capacity)} строк из {path}")
+
+    def _fields_crc(self) -> int:
+        return zlib.crc32(",".join(self.fields).encode())
+
+    def _write_header(self, count: int):
+        _HEADER.pack_into(
+            self._buffer, 0, _MAGIC, _VERSION, self.width, self._fields_crc(), self.capacity, count
+        )
+
+    def _open_mapped(self, path: str, size: int):
+        reuse = False
+        if os.path.exists(path) and os.path.getsize(path) == size:
+            with open(path, "rb") as f:
+                magic, version, width, crc, capacity, _ = _HEADER.unpack(f.read(_HEADER.size))
+            reuse = (magic, version, width, crc, capacity) == (
+                _MAGIC, _VERSION, self.width, self._fields_crc(), self.capacity
+            )
+        if not reuse:
+            if os.path.exists(path):
+                logger.info(f"[TELEMETRY] Формат {path} не совпадает с текущими настройками, файл пересоздан")
+            with open(path, "wb") as f:
+                f.truncate(size)
+        self._file = open(path, "r+b")
+        self._mmap = mmap.mmap(self._file.fileno(), size)
+        if not reuse:
+            self._buffer = self._mmap
+            self._write_header(0)
+        return self._mmap
+
+    def __len__(self) -> int:
+        return min(self.count, self.capacity)
+
+    def record(self, timestamp: float, rssi=None, noise=None, rate=None, profile_index=None, bitrates: dict = None):
+        """Записывает строку одного такта, перезаписывая самую старую при заполнении буфера"""
+        with self._lock:
+            base = (self.count % self.capacity) * self.width
+            data = self._data
+            data[base] = timestamp
+            data[base + 1] = math.nan if rssi is None else rssi
+            data[base + 2] = math.nan if noise is None else noise
+            data[base + 3] = math.nan if rssi is None or noise is None else rssi - noise
+            data[base + 4] = math.nan if rate is None else rate
+            data[base + 5] = math.nan if profile_index is None else profile_index
+            for column in range(len(BASE_FIELDS), self.width):
+                data[base + column] = math.nan
+            if bitrates:
+                for device_name, bitrate in bitrates.items():
+                    column = self.columns.get(f"bitrate:{device_name}")
+                    if column is not None and bitrate is not None:
+                        data[base + column] = bitrate
+            self.count += 1
+            _COUNT.pack_into(self._buffer, _HEADER.size - _COUNT.size, self.count)
+
+    def latest(self, field: str) -> float:
+        if not self.count:
+            return math.nan
+        return self._data[((self.count - 1) % self.capacity) * self.width + self.columns[field]]
+
+    def stats(self, field: str, window: float = None, last: int = None, out: WindowStats = None) -> WindowStats:
+        """
+        Статистика по полю за последние window секунд (или последние last строк).
+        Проходит только по строкам окна; результат пишется в out, если он передан.
+        """
+        out = out if out is not None else WindowStats()
+        out.reset()
+        column = self.columns[field]
+        with self._lock:
+            rows = len(self)
+            if last is not None:
+                rows = min(rows, last)
+            if not rows:
+                return out
+            data = self._data
+            width = self.width
+            capacity = self.capacity
+            newest = self.count - 1
+            since = data[(newest % capacity) * width] - window if window is not None else None
+            scratch = self._scratch
+            n = 0
+            total = 0.0
+            low = math.inf
+            high = -math.inf
+            for offset in range(rows):
+                base = ((newest - offset) % capacity) * width
+                if since is not None and data[base] < since:
+                    break
+                value = data[base + column]
+                if value != value:  # NaN
+                    continue
+                scratch[n] = value
+                n += 1
+                total += value
+                if value < low:
+                    low = value
+                if value > high:
+                    high = value
+            if not n:
+                return out
+            out.count = n
+            out.min = low
+            out.max = high
+            out.mean = total / n
+            out.p50 = _select(scratch, n, int(0.5 * (n - 1)))
+            out.p95 = _select(scratch, n, int(0.95 * (n - 1)))
+        return out
+
+    def flush(self):
+        if self._mmap is not None:
+            self._mmap.flush()
+
+    def close(self):
+        if self._mmap is not None:
+            self._data.release()
+            self._mmap.flush()
+            self._mmap.close()
+            self._file.close()
+            self._mmap = None
+
+
+def _select(values: array, n: int, k: int) -> float:
+    """k-я порядковая статистика первых n элементов (quickselect на месте, в среднем O(n))"""
+    left, right = 0, n - 1
+    while left < right:
+        pivot = values[(left + right) // 2]
+        i, j = left, right
+        while i <= j:
+            while values[i] < pivot:
+                i += 1
+            while values[j] > pivot:
+                j -= 1
+            if i <= j:
+                values[i], values[j] = values[j], values[i]
+                i += 1
+                j -= 1
+        if k <= j:
+            right = j
+        elif k >= i:
+            left = i
+        else:
+            break
+    return values[k]
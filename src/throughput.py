@@ -0,0 +1,131 @@
+class ThroughputEstimate:
+    """Результат одного такта оценки. Значения в кбит/с, None — источник недоступен."""
+
+    __slots__ = ("goodput_kbps", "raw_kbps", "confidence", "tx_kbps", "offered_kbps", "phy_kbps", "saturated")
+
+    def __init__(self):
+        self.goodput_kbps = None
+        self.raw_kbps = None
+        self.confidence = 0.0
+        self.tx_kbps = None
+        self.offered_kbps = None
+        self.phy_kbps = None
+        self.saturated = False
+
+    def as_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class _CounterRate:
+    """Скорость по приращению монотонного счётчика байт; сброс счётчика начинает отсчёт заново"""
+
+    def __init__(self):
+        self.last_value = None
+        self.last_time = None
+
+    def update(self, timestamp: float, value) -> float:
+        if value is None:
+            return None
+        previous_value, previous_time = self.last_value, self.last_time
+        self.last_value, self.last_time = value, timestamp
+        if previous_value is None or timestamp <= previous_time or value < previous_value:
+            return None
+        return (value - previous_value) * 8 / 1000 / (timestamp - previous_time)
+
+
+class ThroughputEstimator:
+    """
+    Оценка доступной полосы аплинка (goodput) с показателем достоверности.
+
+    Источники за такт:
+    - приращение txbytes станции из show interface stat — сколько реально ушло в эфир;
+    - суммарный выход энкодеров (total_size из ffmpeg -progress) — сколько мы пытались отправить;
+    - канальная скорость rate из show interface — потолок, умноженный на goodput_ratio.
+
+    Если отправлено заметно меньше, чем выдали энкодеры, канал насыщен и отправленное
+    и есть его пропускная способность. Иначе канал не загружен до предела и оценкой
+    служит потолок по канальной скорости (но не ниже фактически отправленного).
+    После насыщения потолок по канальной скорости ограничивается замеренной ёмкостью,
+    которая затем растёт на probe_rate за такт: скорость PHY не падает вместе с реальной
+    пропускной способностью (помехи, соседние сети), и без этого оценка прыгала бы обратно.
+    Рост оценки сглаживается EWMA, а падение ниже сглаженного значения при насыщении
+    принимается сразу: это прямой замер, и реагировать на него нужно без задержки.
+
+    Достоверность (0..1) — доля доступных на такте источников, умноженная на прогрев
+    (первые warmup тактов); без источников она затухает.
+    """
+
+    def __init__(
+        self,
+        alpha: float = 0.3,
+        goodput_ratio: float = 0.5,
+        saturation_ratio: float = 0.9,
+        probe_rate: float = 0.05,
+        warmup: int = 3,
+    ):
+        if not 0 < alpha <= 1:
+            raise ValueError("Коэффициент EWMA должен быть в диапазоне (0, 1]")
+        self.alpha = alpha
+        self.goodput_ratio = goodput_ratio
+        self.saturation_ratio = saturation_ratio
+        self.probe_rate = probe_rate
+        self.measured_capacity = None
+        self.warmup = warmup
+        self.samples = 0
+        self.goodput_kbps = None
+        self.estimate = ThroughputEstimate()
+        self._tx = _CounterRate()
+        self._encoders = _CounterRate()
+
+    def update(self, timestamp: float, txbytes=None, rate_mbps=None, encoder_bytes=None) -> ThroughputEstimate:
+        """
+        Args:
+            timestamp (float): Время замера в секундах (монотонные часы или время из трассы).
+            txbytes (int): Счётчик переданных байт интерфейса станции.
+            rate_mbps (float): Канальная скорость станции.
+            encoder_bytes (int): Сумма total_size всех энкодеров.
+
+        Returns:
+            ThroughputEstimate: Тот же объект на каждом такте, перезаписывается.
+        """
+        estimate = self.estimate
+        estimate.tx_kbps = self._tx.update(timestamp, txbytes)
+        estimate.offered_kbps = self._encoders.update(timestamp, encoder_bytes)
+        try:
+            estimate.phy_kbps = float(rate_mbps) * 1000 * self.goodput_ratio if rate_mbps is not None else None
+        except (TypeError, ValueError):
+            estimate.phy_kbps = None
+
+        tx, offered, phy = estimate.tx_kbps, estimate.offered_kbps, estimate.phy_kbps
+        estimate.saturated = tx is not None and bool(offered) and tx < offered * self.saturation_ratio
+        if estimate.saturated:
+            raw = tx
+            self.measured_capacity = tx
+        else:
+            if self.measured_capacity is not None and tx is not None:
+                self.measured_capacity *= 1 + self.probe_rate
+                if phy is not None and self.measured_capacity >= phy:
+                    self.measured_capacity = None
+            ceiling = phy
+            if ceiling is not None and self.measured_capacity is not None:
+                ceiling = min(ceiling, self.measured_capacity)
+            raw = max(ceiling, tx or 0.0) if ceiling is not None else tx
+        estimate.raw_kbps = raw
+
+        if raw is None:
+            # Ни одного источника на этом такте: оценка прежняя, доверие к ней падает
+            estimate.confidence *= 1 - self.alpha
+            return estimate
+
+        self.samples += 1
+        previous = self.goodput_kbps
+        if previous is None or (estimate.saturated and raw < previous):
+            self.goodput_kbps = raw
+        else:
+            self.goodput_kbps = self.alpha * raw + (1 - self.alpha) * previous
+        estimate.goodput_kbps = self.goodput_kbps
+
+        coverage = sum(source is not None for source in (tx, offered, phy)) / 3
+        warmup = min(1.0, self.samples / self.warmup) if self.warmup > 0 else 1.0
+        estimate.confidence = coverage * warmup
+        return estimate
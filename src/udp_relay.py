@@ -0,0 +1,503 @@
+import selectors
+import socket
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+
+from .config import Config
+from .config import DeviceConfig
+
+from .logger import get_logger
+from .logger import LogType
+from .logger import GenericTextLogHandler
+
+logger = get_logger(__name__, filename="relay_log.csv", logType=LogType.BOTH, handler=GenericTextLogHandler)
+
+TS_PACKET_SIZE = 188
+TS_SYNC_BYTE = 0x47
+# Датаграмма ffmpeg с pkt_size=1316 — ровно 7 TS-пакетов; слот с запасом до MTU Ethernet
+DEFAULT_PKT_SIZE = 7 * TS_PACKET_SIZE
+SLOT_SIZE = 2048
+SOCKET_BUFFER_SIZE = 1 << 20
+
+_EMPTY, _QUEUED, _PROTECTED = 0, 1, 2
+
+
+def parse_udp_url(url: str) -> tuple:
+    """
+    Returns:
+        tuple: (host, port, параметры запроса) для адреса вида udp://host:port?pkt_size=1316.
+    """
+    parts = urlsplit(url)
+    if parts.scheme != "udp" or not parts.hostname or parts.port is None:
+        raise ValueError(f"Ретранслятор поддерживает только выходы udp://host:port, получено: {url}")
+    return parts.hostname, parts.port, parse_qs(parts.query)
+
+
+class TransportStreamScanner:
+    """
+    Разметка датаграмм mpegts для отбрасывания под ограничением полосы.
+
+    Защищены датаграммы с PAT и PMT (без них декодер не найдёт видео) и все датаграммы
+    ключевого кадра: от TS-пакета с random_access_indicator до начала следующего PES
+    того же PID. Остальное — разностные кадры, их потеря портит картинку только до
+    следующего ключевого кадра.
+    """
+
+    __slots__ = ("pmt_pids", "video_pid", "in_keyframe", "keyframes")
+
+    def __init__(self):
+        self.pmt_pids = set()
+        self.video_pid = None
+        self.in_keyframe = False
+        self.keyframes = 0
+
+    def scan(self, data, length: int) -> tuple:
+        """
+        Returns:
+            tuple: (датаграмму нельзя отбрасывать, в ней начинается ключевой кадр).
+        """
+        protected = False
+        keyframe = False
+        for offset in range(0, length - TS_PACKET_SIZE + 1, TS_PACKET_SIZE):
+            if data[offset] != TS_SYNC_BYTE:
+                continue
+            pid = ((data[offset + 1] & 0x1F) << 8) | data[offset + 2]
+            unit_start = data[offset + 1] & 0x40
+            has_adaptation = data[offset + 3] & 0x20
+            if has_adaptation and data[offset + 4] > 0 and data[offset + 5] & 0x40:
+                self.video_pid = pid
+                self.in_keyframe = True
+                self.keyframes += 1
+                keyframe = True
+            elif unit_start and pid == self.video_pid:
+                self.in_keyframe = False
+
+            if pid == 0:
+                protected = True
+                if unit_start:
+                    self._read_pat(data, offset, has_adaptation)
+            elif pid in self.pmt_pids or (self.in_keyframe and pid == self.video_pid):
+                protected = True
+        return protected, keyframe
+
+    def _read_pat(self, data, offset: int, has_adaptation: int):
+        end = offset + TS_PACKET_SIZE
+        position = offset + 4 + (1 + data[offset + 4] if has_adaptation else 0)
+        if position >= end:
+            return
+        table = position + 1 + data[position]
+        if table + 8 > end or data[table] != 0:
+            return
+        section_end = min(end, table + 3 + (((data[table + 1] & 0x0F) << 8) | data[table + 2]) - 4)
+        for entry in range(table + 8, section_end - 3, 4):
+            program = (data[entry] << 8) | data[entry + 1]
+            if program != 0:
+                self.pmt_pids.add(((data[entry + 2] & 0x1F) << 8) | data[entry + 3])
+
+
+class RelayStream:
+    """
+    Один поток ретранслятора: сокет, в который пишет ffmpeg, кольцевая очередь датаграмм
+    в заранее выделенном буфере и сокет отправки на настоящий адрес камеры.
+    """
+
+    def __init__(self, device_config: DeviceConfig, listen_host: str, port: int, capacity: int):
+        self.name = device_config.device_name
+        self.priority = device_config.priority
+        self.capacity = capacity
+        self.buffer = bytearray(capacity * SLOT_SIZE)
+        view = memoryview(self.buffer)
+        self.slots = [view[index * SLOT_SIZE:(index + 1) * SLOT_SIZE] for index in range(capacity)]
+        self.lengths = [0] * capacity
+        self.states = [_EMPTY] * capacity
+        self.sequences = [0] * capacity
+        self.head = 0
+        self.count = 0
+        self.queued = 0
+        self.queued_bytes = 0
+        self.scanner = TransportStreamScanner()
+
+        self.received_packets = 0
+        self.received_bytes = 0
+        self.sent_packets = 0
+        self.sent_bytes = 0
+        self.dropped_packets = 0
+        self.dropped_bytes = 0
+        self.dropped_protected = 0
+        self.send_errors = 0
+        self.received_kbps = 0.0
+        self.sent_kbps = 0.0
+        self._rate_marks = (0, 0)
+
+        self.source = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            self.source.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
+            self.source.bind((listen_host, port))
+            self.source.setblocking(False)
+        except OSError:
+            self.source.close()
+            raise
+        self.local_address = self.source.getsockname()[:2]
+        self.sink = None
+        self.output = None
+        self.set_output(device_config.output)
+
+    def set_output(self, output: str):
+        host, port, options = parse_udp_url(output)
+        pkt_size = int(options.get("pkt_size", [DEFAULT_PKT_SIZE])[0])
+        if pkt_size > SLOT_SIZE:
+            raise ValueError(f"pkt_size {pkt_size} больше слота ретранслятора ({SLOT_SIZE} байт)")
+        family, _, _, _, destination = socket.getaddrinfo(host, port, type=socket.SOCK_DGRAM)[0]
+        if self.sink is None or self.sink.family != family:
+            sink = socket.socket(family, socket.SOCK_DGRAM)
+            sink.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
+            sink.setblocking(False)
+            if self.sink is not None:
+                self.sink.close()
+            self.sink = sink
+        self.output = output
+        self.destination = destination
+        self.input_url = f"udp://{self.local_address[0]}:{self.local_address[1]}?pkt_size={pkt_size}"
+
+    def push(self, length: int, protected: bool, sequence: int):
+        index = (self.head + self.count) % self.capacity
+        self.lengths[index] = length
+        self.states[index] = _PROTECTED if protected else _QUEUED
+        self.sequences[index] = sequence
+        self.count += 1
+        self.queued += 1
+        self.queued_bytes += length
+
+    def front(self):
+        """Индекс самой старой датаграммы в очереди (отброшенные слоты освобождаются по пути) или None"""
+        while self.count and self.states[self.head] == _EMPTY:
+            self.head = (self.head + 1) % self.capacity
+            self.count -= 1
+        return self.head if self.count else None
+
+    def pop(self):
+        index = self.head
+        self.queued -= 1
+        self.queued_bytes -= self.lengths[index]
+        self.states[index] = _EMPTY
+        self.head = (index + 1) % self.capacity
+        self.count -= 1
+
+    def drop(self, index: int):
+        length = self.lengths[index]
+        if self.states[index] == _PROTECTED:
+            self.dropped_protected += 1
+        self.states[index] = _EMPTY
+        self.queued -= 1
+        self.queued_bytes -= length
+        self.dropped_packets += 1
+        self.dropped_bytes += length
+
+    def drop_oldest(self, protected: bool) -> int:
+        """Отбрасывает самую старую датаграмму очереди (защищённую — только при protected); возвращает её размер"""
+        for offset in range(self.count):
+            index = (self.head + offset) % self.capacity
+            state = self.states[index]
+            if state == _QUEUED or (state == _PROTECTED and protected):
+                length = self.lengths[index]
+                self.drop(index)
+                return length
+        return 0
+
+    def update_rates(self, elapsed: float):
+        received, sent = self._rate_marks
+        self.received_kbps = (self.received_bytes - received) * 8 / 1000 / elapsed
+        self.sent_kbps = (self.sent_bytes - sent) * 8 / 1000 / elapsed
+        self._rate_marks = (self.received_bytes, self.sent_bytes)
+
+    def close(self):
+        self.source.close()
+        self.sink.close()
+
+
+class UDPRelay:
+    """
+    Ретранслятор mpegts между энкодерами и их настоящими выходами в отдельном потоке.
+
+    ffmpeg пишет в локальный порт ретранслятора, ретранслятор отправляет датаграммы
+    на адрес камеры из конфигурации. Приём пачками: по готовности сокета читается до batch
+    датаграмм подряд через recv_into прямо в слоты заранее выделенного кольцевого буфера,
+    без создания объектов на датаграмму; отправка — тоже пачкой, пока хватает токенов.
+
+    Отправка выравнивается корзиной токенов под скорость rate_kbps (burst_ms — её глубина),
+    так что всплеск ключевого кадра уходит в канал равномерно, а не переполняет очередь Wi-Fi.
+    Датаграммы разных потоков уходят в порядке поступления. Если очередь превышает то, что
+    при текущей скорости уйдёт за max_delay_ms, отбрасываются сначала разностные кадры потоков
+    с наименее важным приоритетом (больший priority из [device:<имя>]), затем более важных,
+    и только потом ключевые кадры. Без ограничения скорости (rate_kbps = 0, или auto, пока
+    оценки аплинка нет) датаграммы пересылаются сразу.
+    """
+
+    def __init__(self, config: Config):
+        self.listen_host = config.relay_listen_host
+        self.base_port = config.relay_base_port
+        self.queue_packets = config.relay_queue_packets
+        self.streams = {}
+        self.rate_kbps = None
+        self._rate_bytes = None
+        self._tokens = 0.0
+        self._refilled_at = time.monotonic()
+        self._sequence = 0
+        self._send_blocked = False
+        self._lock = threading.Lock()
+        self._selector = selectors.DefaultSelector()
+        self._wakeup_reader, self._wakeup_writer = socket.socketpair()
+        self._wakeup_reader.setblocking(False)
+        self._wakeup_writer.setblocking(False)
+        self._selector.register(self._wakeup_reader, selectors.EVENT_READ, None)
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="udp-relay", daemon=True)
+        self.configure(config)
+
+    def configure(self, config: Config):
+        """
+        Настройки выравнивания и отбрасывания; применяются на лету.
+        listen_host, base_port и queue_packets действуют только на новые потоки.
+        """
+        with self._lock:
+            self.min_rate_kbps = config.relay_min_rate_kbps
+            self.burst_ms = config.relay_burst_ms
+            self.max_delay_ms = config.relay_max_delay_ms
+            self.batch = config.relay_batch
+            self.follow_uplink = config.relay_rate_kbps == "auto"
+            if not self.follow_uplink:
+                self._set_rate(config.relay_rate_kbps or None)
+        self._wake()
+
+    def start(self):
+        self._thread.start()
+        logger.info(f"[RELAY] Ретранслятор запущен на {self.listen_host}")
+
+    def stop(self):
+        self._stopping = True
+        self._wake()
+        if self._thread.is_alive():
+            self._thread.join()
+        with self._lock:
+            for stream in self.streams.values():
+                self._selector.unregister(stream.source)
+                stream.close()
+            self.streams.clear()
+        self._selector.close()
+        self._wakeup_reader.close()
+        self._wakeup_writer.close()
+
+    def route(self, device_config: DeviceConfig) -> DeviceConfig:
+        """
+        Заводит (или обновляет) поток камеры и возвращает её конфигурацию с выходом
+        в локальный порт ретранслятора. Порт потока не меняется, пока камера есть в конфигурации,
+        поэтому смена её настоящего выхода не требует перезапуска энкодера.
+        """
+        with self._lock:
+            stream = self.streams.get(device_config.device_name)
+            if stream is None:
+                stream = RelayStream(device_config, self.listen_host, self._free_port(), self.queue_packets)
+                self._selector.register(stream.source, selectors.EVENT_READ, stream)
+                self.streams[stream.name] = stream
+                logger.info(f"[RELAY] {stream.name}: {stream.input_url} → {device_config.output}")
+            elif stream.output != device_config.output:
+                stream.set_output(device_config.output)
+                logger.info(f"[RELAY] {stream.name}: новый выход {device_config.output}")
+            stream.priority = device_config.priority
+        return DeviceConfig(
+            device_name=device_config.device_name,
+            output_destination=stream.input_url,
+            resolution=device_config.resolution,
+            bitrate=device_config.bitrate,
+            fps=device_config.fps,
+            degradation_steps=device_config.degradation_steps,
+            priority=device_config.priority,
+            weight=device_config.weight,
+        )
+
+    def retain(self, device_names):
+        """Закрывает потоки камер, которых больше нет в конфигурации"""
+        with self._lock:
+            for name in [name for name in self.streams if name not in device_names]:
+                stream = self.streams.pop(name)
+                self._selector.unregister(stream.source)
+                stream.close()
+                logger.info(f"[RELAY] {name}: поток закрыт")
+
+    def _free_port(self) -> int:
+        if not self.base_port:
+            return 0
+        used = {stream.local_address[1] for stream in self.streams.values()}
+        port = self.base_port
+        while port in used:
+            port += 1
+        return port
+
+    def set_rate(self, rate_kbps: float = None):
+        """Скорость отправки, кбит/с (не ниже min_rate_kbps); None — без ограничения"""
+        with self._lock:
+            self._set_rate(rate_kbps)
+        self._wake()
+
+    def follow(self, uplink_kbps: float):
+        """Оценка полосы аплинка от политики; учитывается при rate_kbps = auto"""
+        if self.follow_uplink and uplink_kbps is not None:
+            self.set_rate(uplink_kbps)
+
+    def _set_rate(self, rate_kbps: float):
+        if rate_kbps is not None:
+            rate_kbps = max(rate_kbps, self.min_rate_kbps)
+        previous = self.rate_kbps
+        self.rate_kbps = rate_kbps
+        self._rate_bytes = rate_kbps * 1000 / 8 if rate_kbps is not None else None
+        if (previous is None) != (rate_kbps is None) or (
+            rate_kbps is not None and abs(rate_kbps - previous) > 0.1 * previous
+        ):
+            limit = f"{rate_kbps:.0f} кбит/с" if rate_kbps is not None else "без ограничения"
+            logger.info(f"[RELAY] Скорость отправки: {limit}")
+
+    def _wake(self):
+        try:
+            self._wakeup_writer.send(b"\0")
+        except OSError:
+            pass
+
+    def _run(self):
+        stats_at = time.monotonic()
+        while not self._stopping:
+            events = self._selector.select(self._wait_time())
+            now = time.monotonic()
+            with self._lock:
+                for key, _ in events:
+                    if key.data is None:
+                        self._drain_wakeups()
+                    elif key.data.name in self.streams:
+                        self._receive(key.data)
+                self._shed()
+                self._send(now)
+                if now - stats_at >= 1.0:
+                    for stream in self.streams.values():
+                        stream.update_rates(now - stats_at)
+                    stats_at = now
+
+    def _drain_wakeups(self):
+        try:
+            while self._wakeup_reader.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _wait_time(self) -> float:
+        if self._send_blocked:
+            return 0.001
+        if self._rate_bytes is None or not any(stream.queued for stream in self.streams.values()):
+            return 1.0
+        # Ждём, пока в корзине наберутся токены на следующую датаграмму
+        deficit = -self._tokens if self._tokens <= 0 else 0.0
+        return max(0.0005, deficit / self._rate_bytes)
+
+    def _receive(self, stream: RelayStream):
+        for _ in range(self.batch):
+            if stream.count == stream.capacity:
+                # Кольцо заполнено: место освобождает самая старая датаграмма этого потока
+                stream.front()
+                if stream.count == stream.capacity:
+                    stream.drop(stream.head)
+                    stream.front()
+            index = (stream.head + stream.count) % stream.capacity
+            try:
+                length = stream.source.recv_into(stream.slots[index])
+            except BlockingIOError:
+                return
+            except OSError as e:
+                logger.error(f"[RELAY] {stream.name}: ошибка приёма: {e}")
+                return
+            protected, _ = stream.scanner.scan(stream.slots[index], length)
+            stream.received_packets += 1
+            stream.received_bytes += length
+            self._sequence += 1
+            stream.push(length, protected, self._sequence)
+
+    def _shed(self):
+        if self._rate_bytes is None:
+            return
+        limit = self._rate_bytes * self.max_delay_ms / 1000
+        queued = sum(stream.queued_bytes for stream in self.streams.values())
+        if queued <= limit:
+            return
+        # Сначала наименее важные камеры; при равном приоритете — с самой длинной очередью
+        order = sorted(self.streams.values(), key=lambda stream: (-stream.priority, -stream.queued_bytes))
+        for protected in (False, True):
+            for stream in order:
+                while queued > limit:
+                    freed = stream.drop_oldest(protected)
+                    if not freed:
+                        break
+                    queued -= freed
+                if queued <= limit:
+                    return
+
+    def _send(self, now: float):
+        self._send_blocked = False
+        if self._rate_bytes is not None:
+            burst = max(self._rate_bytes * self.burst_ms / 1000, SLOT_SIZE)
+            self._tokens = min(burst, self._tokens + (now - self._refilled_at) * self._rate_bytes)
+        self._refilled_at = now
+
+        streams = list(self.streams.values())
+        while self._rate_bytes is None or self._tokens > 0:
+            stream = None
+            index = None
+            for candidate in streams:
+                candidate_index = candidate.front()
+                if candidate_index is not None and (
+                    stream is None or candidate.sequences[candidate_index] < stream.sequences[index]
+                ):
+                    stream, index = candidate, candidate_index
+            if stream is None:
+                return
+            length = stream.lengths[index]
+            try:
+                stream.sink.sendto(stream.slots[index][:length], stream.destination)
+            except BlockingIOError:
+                self._send_blocked = True
+                return
+            except OSError as e:
+                if not stream.send_errors:
+                    logger.error(f"[RELAY] {stream.name}: ошибка отправки на {stream.output}: {e}")
+                stream.send_errors += 1
+            else:
+                stream.sent_packets += 1
+                stream.sent_bytes += length
+            stream.pop()
+            if self._rate_bytes is not None:
+                self._tokens -= length
+
+    def snapshot(self) -> dict:
+        """Счётчики по потокам: имя → словарь"""
+        with self._lock:
+            return {
+                name: {
+                    "received_packets": stream.received_packets,
+                    "received_bytes": stream.received_bytes,
+                    "sent_packets": stream.sent_packets,
+                    "sent_bytes": stream.sent_bytes,
+                    "dropped_packets": stream.dropped_packets,
+                    "dropped_bytes": stream.dropped_bytes,
+                    "dropped_protected": stream.dropped_protected,
+                    "send_errors": stream.send_errors,
+                    "queued_bytes": stream.queued_bytes,
+                    "received_kbps": stream.received_kbps,
+                    "sent_kbps": stream.sent_kbps,
+                    "keyframes": stream.scanner.keyframes,
+                }
+                for name, stream in self.streams.items()
+            }
+
+    def summary(self) -> str:
+        return ", ".join(
+            f"{name}: отправлено {stats['sent_packets']}, отброшено {stats['dropped_packets']} "
+            f"(ключевых {stats['dropped_protected']})"
+            for name, stats in self.snapshot().items()
+        )